@@ -0,0 +1,451 @@
+#!/usr/bin/env python3
+"""
+Benchmark the lsof parser collection backends and parsers
+Usage: python3 lsof_bench.py [suite|generate|backends|parsers|memory|input|resolver] [options]   (see --help)
+
+suite: generates `lsof -i` output of each --sizes line count and times
+parse_lsof_line() (both copies), main() end-to-end on the dump and JSON
+serialization. Results are written as JSON with --output so runs from two
+commits can be compared with --compare BASELINE.json.
+
+generate: writes --lines synthetic `lsof -i` lines to stdout.
+
+backends: builds a synthetic /proc tree (net tables plus fd symlinks) and the
+matching `lsof -i -n -P` text, then times the /proc backend against the lsof
+parsing path on the same data. With --live the real `lsof -i` is timed as well.
+
+parsers: renders the same synthetic sockets as column output and as `lsof -F0`
+field output and reports the per-line cost of each parser, then compares
+parse_lsof_line() and the batch parse_lsof_lines(), with and without the
+structured endpoint fields, on a mixed TCP/UDP/IPv6 corpus.
+
+memory: parses synthetic lsof lines into a list of dicts and into a
+ConnectionTable and compares the memory each holds (via tracemalloc).
+
+input: writes a --lines dump and times main() --input on it (the JSON output
+path, serialized in the workers) and parse_lsof_file() (records rebuilt as
+dictionaries in the parent) for each --workers count, with the speedup over
+one worker.
+
+resolver: resolves the peers of --lines synthetic connections through a stub
+lookup that takes --lookup-latency seconds (and never answers for a share of
+addresses), once cold and once from the cache, to show the deadline holds.
+"""
+
+import sys
+import os
+import pwd
+import time
+import random
+import tempfile
+import argparse
+import json
+import platform
+import contextlib
+import subprocess
+import tracemalloc
+from datetime import datetime
+
+import lsof_parser
+import lsof_parser_v2
+
+from lsof_parser_v2 import parse_lsof_line, parse_lsof_lines, parse_lsof_fields, add_endpoint_fields
+from lsof_procfs import get_proc_connections
+from lsof_table import ConnectionTable
+from lsof_input import parse_lsof_file
+from lsof_resolver import Resolver, resolve_connections
+
+PROC_NET_HEADER = "  sl  local_address rem_address   st tx_queue rx_queue tr tm->when retrnsmt   uid  timeout inode\n"
+
+def encode_ipv4(address, port):
+    """Encode an IPv4 address the way /proc/net/tcp prints it"""
+    raw = bytes(int(octet) for octet in address.split('.'))
+    return f"{raw[::-1].hex().upper()}:{port:04X}"
+
+def make_proc_fixture(root, sockets=10000, processes=100, seed=0):
+    """Write a synthetic /proc tree under root and return the equivalent lsof lines"""
+    rng = random.Random(seed)
+    os.makedirs(os.path.join(root, 'net'))
+
+    lines = ["COMMAND    PID   USER   FD   TYPE DEVICE SIZE/OFF NODE NAME"]
+    tables = {'tcp': [], 'udp': []}
+    user = pwd.getpwuid(os.geteuid()).pw_name
+
+    inode = 10000
+    for pid in range(1000, 1000 + processes):
+        command = f"svc{pid}"
+        os.makedirs(os.path.join(root, str(pid), 'fd'))
+        with open(os.path.join(root, str(pid), 'comm'), 'w') as f:
+            f.write(command + '\n')
+
+        for fd in range(3, 3 + sockets // processes):
+            inode += 1
+            local_port = rng.randint(1024, 65535)
+            os.symlink(f"socket:[{inode}]", os.path.join(root, str(pid), 'fd', str(fd)))
+
+            if rng.random() < 0.8:
+                remote = f"10.0.{rng.randint(0, 255)}.{rng.randint(1, 254)}"
+                remote_port = rng.choice([443, 5432, 6379])
+                state = rng.choice([('01', 'ESTABLISHED'), ('0A', 'LISTEN'), ('08', 'CLOSE_WAIT')])
+                if state[1] == 'LISTEN':
+                    rem_hex, name = "00000000:0000", f"127.0.0.1:{local_port} (LISTEN)"
+                else:
+                    rem_hex = encode_ipv4(remote, remote_port)
+                    name = f"127.0.0.1:{local_port}->{remote}:{remote_port} ({state[1]})"
+                table, node, st = 'tcp', 'TCP', state[0]
+            else:
+                rem_hex, name = "00000000:0000", f"127.0.0.1:{local_port}"
+                table, node, st = 'udp', 'UDP', '07'
+
+            tables[table].append(
+                f"{len(tables[table]):4d}: {encode_ipv4('127.0.0.1', local_port)} {rem_hex} {st} "
+                f"00000000:00000000 00:00000000 00000000     0        0 {inode} 1 0000000000000000\n"
+            )
+            lines.append(f"{command:<9} {pid:>5} {user:>6} {fd:>4}u  IPv4 {inode:>6}      0t0  {node} {name}")
+
+    for table, rows in tables.items():
+        with open(os.path.join(root, 'net', table), 'w') as f:
+            f.write(PROC_NET_HEADER)
+            f.writelines(rows)
+
+    return lines
+
+LSOF_HEADER = "COMMAND     PID     USER   FD   TYPE  DEVICE SIZE/OFF NODE NAME"
+
+# (command, user) pairs seen on busy hosts; lsof cuts COMMAND to 9 characters unless run with +c
+PROCESSES = [
+    ('nginx', 'www-data'), ('postgres', 'postgres'), ('redis-ser', 'redis'), ('python3', 'app'),
+    ('sshd', 'root'), ('java', 'app'), ('systemd-r', 'systemd-resolve'), ('chronyd', '_chrony'),
+    ('containerd-shim', 'root'), ('node_exporter', 'prometheus'),
+]
+
+def generate_lsof_lines(count, seed=0, long_names=False):
+    """Yield count synthetic `lsof -i -n -P` connection lines without touching the filesystem
+
+    The mix follows a typical server: about 60% established TCP, 20% LISTEN
+    and 20% UDP (half of it connected), 30% of everything over IPv6. With
+    long_names commands are not cut to lsof's nine characters (as with +c 0).
+    """
+    rng = random.Random(seed)
+    pid = 1000
+    for index in range(count):
+        if index % 50 == 0:
+            pid += rng.randint(1, 40)
+            command, user = rng.choice(PROCESSES)
+            if not long_names:
+                command = command[:9]
+        local_port = rng.randint(1024, 65535)
+        remote_port = rng.choice([443, 5432, 6379, 53, 8080])
+
+        if rng.random() < 0.3:
+            type_field = 'IPv6'
+            local = f"[fd00::1]:{local_port}"
+            remote = f"[2001:db8::{rng.randint(1, 0xffff):x}]:{remote_port}"
+        else:
+            type_field = 'IPv4'
+            local = f"10.0.0.1:{local_port}"
+            remote = f"10.{rng.randint(0, 255)}.{rng.randint(0, 255)}.{rng.randint(1, 254)}:{remote_port}"
+
+        roll = rng.random()
+        if roll < 0.6:
+            node, name = 'TCP', f"{local}->{remote} ({rng.choice(['ESTABLISHED'] * 8 + ['CLOSE_WAIT', 'TIME_WAIT'])})"
+        elif roll < 0.8:
+            node, name = 'TCP', f"*:{local_port} (LISTEN)"
+        elif roll < 0.9:
+            node, name = 'UDP', f"{local}->{remote}"
+        else:
+            node, name = 'UDP', f"*:{local_port}"
+        yield f"{command:<9} {pid:>7} {user:>8} {index % 1000 + 3:>4}u  {type_field} {100000 + index:>7}      0t0  {node} {name}"
+
+def write_lsof_dump(path, count, seed=0, long_names=False):
+    """Write a synthetic `lsof -i` dump with a header line to path"""
+    with open(path, 'w') as f:
+        f.write(LSOF_HEADER + '\n')
+        for line in generate_lsof_lines(count, seed, long_names):
+            f.write(line + '\n')
+
+def render_fields(lines):
+    """Render column output lines as the equivalent `lsof -F0` field output"""
+    fields = []
+    last_pid = None
+    for line in lines[1:]:
+        parts = line.split()
+        command, pid, user, fd, type_field, device, size_off, node = parts[:8]
+        name = ' '.join(parts[8:])
+        state = None
+        if name.endswith(')'):
+            name, state = name[:-1].rsplit(' (', 1)
+
+        if pid != last_pid:
+            fields.append(f"p{pid}\0c{command}\0u{os.geteuid()}\0L{user}\0\n")
+            last_pid = pid
+        tcp_info = f"TST={state}\0TQR=0\0TQS=0\0" if state else ""
+        fields.append(f"f{fd[:-1]}\0a{fd[-1]}\0t{type_field}\0d{device}\0o{size_off}\0P{node}\0n{name}\0{tcp_info}\n")
+    return fields
+
+def time_call(func, repeat=5):
+    """Return the best wall time of func() over a few runs"""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def parse_lines(lines):
+    """Parse lsof lines the way main() does"""
+    return [parse_lsof_line(line) for line in lines[1:]]
+
+def bench_backends(args):
+    """Time the /proc backend against parsing the equivalent lsof text"""
+    with tempfile.TemporaryDirectory() as tmp:
+        root = os.path.join(tmp, 'proc')
+        lines = make_proc_fixture(root, args.sockets, args.processes)
+
+        proc_records = list(get_proc_connections(root))
+        lsof_records = parse_lines(lines)
+        if proc_records != lsof_records:
+            print("Error: /proc backend and lsof parser disagree on the fixture", file=sys.stderr)
+            sys.exit(1)
+
+        print(f"Synthetic fixture: {len(proc_records)} sockets in {args.processes} processes")
+        print(f"  parse lsof text:  {time_call(lambda: parse_lines(lines)):.4f}s")
+        print(f"  /proc backend:    {time_call(lambda: list(get_proc_connections(root))):.4f}s")
+
+    if args.live:
+        print("Live host:")
+        print(f"  lsof -i:          {time_call(lambda: subprocess.run(['lsof', '-i'], capture_output=True)):.4f}s")
+        print(f"  /proc backend:    {time_call(lambda: list(get_proc_connections())):.4f}s")
+
+def bench_parsers(args):
+    """Report the per-line cost of the column, batch and field parsers"""
+    with tempfile.TemporaryDirectory() as tmp:
+        lines = make_proc_fixture(os.path.join(tmp, 'proc'), args.sockets, args.processes)
+    fields = render_fields(lines)
+    count = len(lines) - 1
+
+    print(f"Parsers over {count} sockets")
+    print(f"  parse_lsof_line:   {time_call(lambda: parse_lines(lines)) / count * 1e6:.2f} us/socket")
+    print(f"  parse_lsof_fields: {time_call(lambda: list(parse_lsof_fields(fields))) / count * 1e6:.2f} us/socket")
+
+    # Mixed TCP/UDP/IPv4/IPv6 corpus for the batch parser
+    mixed = list(generate_lsof_lines(args.sockets))
+    single = [parse_lsof_line(line) for line in mixed]
+    if list(parse_lsof_lines(mixed)) != single or list(parse_lsof_lines(mixed, endpoints=True)) != list(map(add_endpoint_fields, single)):
+        print("Error: parse_lsof_lines and parse_lsof_line disagree on the mixed corpus", file=sys.stderr)
+        sys.exit(1)
+
+    parsers = {
+        'parse_lsof_line': lambda: [parse_lsof_line(line) for line in mixed],
+        'parse_lsof_lines': lambda: list(parse_lsof_lines(mixed)),
+        'parse_lsof_line + add_endpoint_fields': lambda: [add_endpoint_fields(parse_lsof_line(line)) for line in mixed],
+        'parse_lsof_lines(endpoints=True)': lambda: list(parse_lsof_lines(mixed, endpoints=True)),
+    }
+    # Interleaved rounds and the median, so a noisy machine does not favour whichever ran last
+    samples = {name: [] for name in parsers}
+    for _ in range(args.rounds):
+        for name, parse in parsers.items():
+            samples[name].append(time_call(parse, repeat=1) / len(mixed) * 1e6)
+    medians = {name: sorted(times)[len(times) // 2] for name, times in samples.items()}
+
+    print(f"Mixed TCP/UDP/IPv6 corpus, {len(mixed)} lines, median of {args.rounds} rounds")
+    for name, median in medians.items():
+        print(f"  {name:<38} {median:.2f} us/line")
+    for batch, single_name in (('parse_lsof_lines', 'parse_lsof_line'),
+                               ('parse_lsof_lines(endpoints=True)', 'parse_lsof_line')):
+        change = (medians[batch] / medians[single_name] - 1) * 100
+        verdict = 'faster' if change < 0 else 'NOT faster'
+        print(f"  {batch} is {verdict} than {single_name}: {change:+.1f}%")
+
+def measure_memory(build):
+    """Return (result, bytes still allocated by build())"""
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        result = build()
+        return result, tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+
+def bench_memory(args):
+    """Compare list-of-dicts and ConnectionTable memory for each row count"""
+    for rows in args.rows:
+        records, dict_bytes = measure_memory(lambda: [parse_lsof_line(line) for line in generate_lsof_lines(rows)])
+        del records
+        table, table_bytes = measure_memory(lambda: ConnectionTable(parse_lsof_line(line) for line in generate_lsof_lines(rows)))
+        del table
+
+        print(f"{rows} rows")
+        print(f"  list of dicts:   {dict_bytes / 2**20:8.1f} MiB ({dict_bytes / rows:.0f} B/row)")
+        print(f"  ConnectionTable: {table_bytes / 2**20:8.1f} MiB ({table_bytes / rows:.0f} B/row)")
+
+def stub_lookup(latency, hung_share, seed=0):
+    """Return a fake reverse lookup that sleeps latency and hangs for about hung_share of addresses"""
+    def lookup(address):
+        if random.Random(f"{seed}{address}").random() < hung_share:
+            time.sleep(3600)
+        time.sleep(latency)
+        return f"host-{address.replace(':', '-').replace('.', '-')}.example"
+    return lookup
+
+def bench_resolver(args):
+    """Time cold and cached name resolution of a synthetic snapshot against a stub lookup"""
+    connections = [parse_lsof_line(line) for line in generate_lsof_lines(args.lines, args.seed)]
+    resolver = Resolver(lookup=stub_lookup(args.lookup_latency, 0.01, args.seed), deadline=args.deadline)
+
+    for label in ('cold', 'cached'):
+        start = time.perf_counter()
+        resolved = resolve_connections(connections, resolver)
+        elapsed = time.perf_counter() - start
+        named = sum(1 for connection in resolved if connection['remote_name'])
+        peers = sum(1 for connection in resolved if connection['remote_address'])
+        print(f"  {label:<8} {elapsed:8.3f}s  {named}/{peers} peers named, {len(resolver.cache)} cached")
+        # Let lookups that missed the deadline finish into the cache
+        time.sleep(args.lookup_latency * 2)
+
+def bench_input(args):
+    """Time --input parsing of one dump with each worker count
+
+    Besides wall time, the parent's own CPU time is reported: whatever the
+    core count, the speedup cannot exceed the one-worker time divided by it.
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        dump = os.path.join(tmp, 'lsof.txt')
+        write_lsof_dump(dump, args.lines, args.seed, args.long_names)
+        print(f"--input over {args.lines} lines, {os.cpu_count()} CPUs")
+
+        baseline = {}
+        for workers in args.workers:
+            runs = {
+                'main --input': lambda: time_main(dump, workers),
+                'parse_lsof_file': lambda: sum(1 for _ in parse_lsof_file(dump, workers)),
+            }
+            for name, run in runs.items():
+                cpu_start, start = time.process_time(), time.perf_counter()
+                run()
+                seconds, parent_cpu = time.perf_counter() - start, time.process_time() - cpu_start
+                baseline.setdefault(name, seconds)
+                print(f"  {name:<16} workers={workers:<3} {seconds:8.3f}s  {baseline[name] / seconds:5.2f}x"
+                      f"  parent CPU {parent_cpu:7.3f}s (ceiling {baseline[name] / max(parent_cpu, 1e-6):5.1f}x)")
+
+def time_main(dump, workers=1):
+    """Time lsof_parser_v2.main() end-to-end on a dump, discarding its JSON output"""
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        return time_call(lambda: lsof_parser_v2.main(['--input', dump, '--workers', str(workers)]), repeat=1)
+
+def bench_suite(args):
+    """Time parsing, main() and JSON serialization for each size and return the results"""
+    results = {
+        'timestamp': datetime.now().isoformat(),
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'seed': args.seed,
+        'long_names': args.long_names,
+        'sizes': {},
+    }
+
+    for size in args.sizes:
+        lines = list(generate_lsof_lines(size, args.seed, args.long_names))
+        records = [lsof_parser_v2.parse_lsof_line(line) for line in lines]
+        timings = {
+            'parse_lsof_line': time_call(lambda: [lsof_parser_v2.parse_lsof_line(line) for line in lines]),
+            'lsof_parser.parse_lsof_line': time_call(lambda: [lsof_parser.parse_lsof_line(line) for line in lines]),
+            'parse_lsof_lines': time_call(lambda: list(parse_lsof_lines(lines))),
+            'parse_lsof_lines_endpoints': time_call(lambda: list(parse_lsof_lines(lines, endpoints=True))),
+            'json_dumps_indent': time_call(lambda: json.dumps(records, indent=2)),
+            'json_dumps_ndjson': time_call(lambda: [json.dumps(record) for record in records]),
+        }
+        del records
+
+        with tempfile.TemporaryDirectory() as tmp:
+            dump = os.path.join(tmp, 'lsof.txt')
+            write_lsof_dump(dump, size, args.seed, args.long_names)
+            timings['main_end_to_end'] = time_main(dump)
+
+        results['sizes'][str(size)] = {
+            name: {'seconds': round(seconds, 6), 'us_per_line': round(seconds / size * 1e6, 3)}
+            for name, seconds in timings.items()
+        }
+        print(f"{size} lines")
+        for name, seconds in timings.items():
+            print(f"  {name:<28} {seconds:9.4f}s {seconds / size * 1e6:8.2f} us/line")
+
+    return results
+
+def git_commit():
+    """Return the current git commit of the checkout, or None outside a repository"""
+    try:
+        result = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)))
+    except FileNotFoundError:
+        return None
+    return result.stdout.strip() or None
+
+def compare_results(baseline, current):
+    """Print the change of every timing against a baseline results file"""
+    print(f"Compared with {baseline.get('commit')} ({baseline.get('timestamp')})")
+    for size, timings in current['sizes'].items():
+        base_timings = baseline.get('sizes', {}).get(size)
+        if not base_timings:
+            continue
+        print(f"{size} lines")
+        for name, timing in timings.items():
+            base = base_timings.get(name)
+            if base and base['seconds']:
+                change = (timing['seconds'] / base['seconds'] - 1) * 100
+                print(f"  {name:<28} {base['seconds']:9.4f}s -> {timing['seconds']:9.4f}s ({change:+.1f}%)")
+
+def main():
+    """Run the selected benchmark and print the timings"""
+    parser = argparse.ArgumentParser(description="Benchmark the lsof parser collection backends and parsers")
+    parser.add_argument('bench', nargs='?', choices=['suite', 'generate', 'backends', 'parsers', 'memory', 'input', 'resolver'],
+                        default='suite', help="what to run (default: suite)")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000],
+                        help="line counts for the suite (default: 10000 100000 1000000)")
+    parser.add_argument('--lines', type=int, default=10000, help="lines to write with generate")
+    parser.add_argument('--seed', type=int, default=0, help="random seed for the synthetic output")
+    parser.add_argument('--long-names', action='store_true', help="do not cut commands to 9 characters")
+    parser.add_argument('--output', metavar='FILE', help="write suite results as JSON to FILE")
+    parser.add_argument('--compare', metavar='FILE', help="compare suite results with an earlier results file")
+    parser.add_argument('--sockets', type=int, default=20000, help="synthetic sockets to generate")
+    parser.add_argument('--processes', type=int, default=200, help="synthetic processes to spread them over")
+    parser.add_argument('--rounds', type=int, default=15, help="interleaved rounds for the parsers benchmark")
+    parser.add_argument('--live', action='store_true', help="also time `lsof -i` and /proc on this host")
+    parser.add_argument('--rows', type=int, nargs='+', default=[100000, 1000000],
+                        help="row counts for the memory benchmark (default: 100000 1000000)")
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8],
+                        help="worker counts for the input benchmark (default: 1 2 4 8)")
+    parser.add_argument('--lookup-latency', type=float, default=0.05,
+                        help="seconds the stub resolver takes per address (default: %(default)s)")
+    parser.add_argument('--deadline', type=float, default=1.0,
+                        help="resolver deadline per snapshot (default: %(default)s)")
+    args = parser.parse_args()
+
+    if args.bench == 'generate':
+        print(LSOF_HEADER)
+        for line in generate_lsof_lines(args.lines, args.seed, args.long_names):
+            print(line)
+    elif args.bench == 'input':
+        bench_input(args)
+    elif args.bench == 'resolver':
+        bench_resolver(args)
+    elif args.bench == 'memory':
+        bench_memory(args)
+    elif args.bench == 'parsers':
+        bench_parsers(args)
+    elif args.bench == 'backends':
+        bench_backends(args)
+    else:
+        results = bench_suite(args)
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump(results, f, indent=2)
+            print(f"Results written to {args.output}")
+        if args.compare:
+            with open(args.compare, 'r') as f:
+                compare_results(json.load(f), results)
+
+if __name__ == "__main__":
+    main()
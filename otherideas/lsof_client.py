@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+"""
+Query a running lsof_parser_v2.py --daemon over its Unix socket
+Usage: python3 lsof_client.py SOCKET [--where FIELD=VALUE] [--group-by FIELD] [--top N] [--count]
+
+Only imports what it needs to talk to the socket, so a call costs
+interpreter startup plus one round trip instead of a full lsof run.
+"""
+
+import sys
+import json
+import socket
+import argparse
+
+def query(socket_path, where=(), group_by=None, top=None, count=False, timeout=10.0):
+    """Send one query to the daemon and return its response dictionary"""
+    request = {'where': list(where), 'group_by': group_by, 'top': top, 'count': count}
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.settimeout(timeout)
+        client.connect(socket_path)
+        client.sendall(json.dumps(request).encode('utf-8') + b'\n')
+        with client.makefile('rb') as reply:
+            return json.loads(reply.readline())
+
+def main():
+    """Run one query against the daemon and print the result as JSON"""
+    parser = argparse.ArgumentParser(description="Query a running lsof_parser_v2.py --daemon")
+    parser.add_argument('socket', help="socket path given to --daemon")
+    parser.add_argument('--where', action='append', default=[], metavar='FIELD=VALUE',
+                        help="only keep connections where FIELD equals VALUE (repeatable)")
+    parser.add_argument('--group-by', metavar='FIELD', help="print connection counts per value of FIELD")
+    parser.add_argument('--top', type=int, metavar='N', help="only print the N largest groups (or the first N connections)")
+    parser.add_argument('--count', action='store_true', help="print the number of matching connections")
+    args = parser.parse_args()
+
+    try:
+        response = query(args.socket, args.where, args.group_by, args.top, args.count)
+    except (OSError, ValueError) as e:
+        print(f"Error: cannot query daemon at {args.socket}: {e}", file=sys.stderr)
+        sys.exit(1)
+
+    if 'error' in response:
+        print(f"Error: {response['error']}", file=sys.stderr)
+        sys.exit(1)
+    print(json.dumps(response['result'], indent=2))
+
+if __name__ == "__main__":
+    main()
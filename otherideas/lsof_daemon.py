@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+Keep a connection snapshot in memory and answer queries over a Unix socket
+Usage: python3 lsof_parser_v2.py --daemon /run/lsof.sock [--refresh 5] [collection options]
+       python3 lsof_client.py /run/lsof.sock [--where FIELD=VALUE] [--group-by FIELD] [--top N] [--count]
+
+A background thread re-collects every --refresh seconds and swaps in the new
+snapshot with its query index in one assignment. Each client connection is
+served on its own thread from whatever snapshot is current, so concurrent
+clients share one collection and the hash indexes built for it.
+
+Protocol: the client sends one JSON object per line with optional where,
+group_by, top and count keys (the --where/--group-by/--top/--count options)
+and gets one JSON line back: {"result": ..., "collected_at": ...} or
+{"error": "..."}.
+"""
+
+import os
+import sys
+import json
+import stat
+import time
+import signal
+import threading
+import socketserver
+
+from lsof_query import ConnectionIndex, run_query
+
+class SnapshotHolder:
+    """The current snapshot, replaced as a whole by the refresh thread"""
+
+    def __init__(self, collect, refresh):
+        self.collect = collect
+        self.refresh = refresh
+        # (ConnectionIndex, collected_at), swapped in one assignment
+        self.current = None
+
+    def update(self):
+        """Collect a new snapshot and make it current"""
+        index = ConnectionIndex(list(self.collect()))
+        self.current = (index, time.time())
+
+    def refresh_forever(self, stop):
+        """Update every self.refresh seconds until stop is set, keeping the old snapshot on failure"""
+        while not stop.wait(self.refresh):
+            try:
+                self.update()
+            except (Exception, SystemExit) as e:
+                # get_lsof_output() exits on failure; clients keep getting the previous snapshot
+                print(f"Warning: refresh failed, serving previous snapshot: {e}", file=sys.stderr)
+
+def check_request(request):
+    """Raise ValueError unless every request key has the JSON type run_query() expects"""
+    where = request.get('where', [])
+    if not isinstance(where, list) or not all(isinstance(condition, str) for condition in where):
+        raise ValueError("where must be a list of FIELD=VALUE strings")
+    group_by = request.get('group_by')
+    if group_by is not None and not isinstance(group_by, str):
+        raise ValueError("group_by must be a string")
+    top = request.get('top')
+    if top is not None and (not isinstance(top, int) or isinstance(top, bool)):
+        raise ValueError("top must be an integer")
+    if not isinstance(request.get('count', False), bool):
+        raise ValueError("count must be true or false")
+
+def answer(request, holder):
+    """Return the response dictionary for one request"""
+    index, collected_at = holder.current
+    try:
+        check_request(request)
+        result = run_query(index, request.get('where', ()), request.get('group_by'),
+                           request.get('top'), request.get('count', False))
+    except (KeyError, ValueError, TypeError) as e:
+        return {'error': e.args[0] if e.args else str(e)}
+    return {'result': result, 'collected_at': collected_at}
+
+class QueryHandler(socketserver.StreamRequestHandler):
+    """Answer newline-delimited JSON queries until the client hangs up"""
+
+    def handle(self):
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+                if not isinstance(request, dict):
+                    raise ValueError("request must be a JSON object")
+            except ValueError as e:
+                response = {'error': f"Bad request: {e}"}
+            else:
+                response = answer(request, self.server.holder)
+            self.wfile.write(json.dumps(response).encode('utf-8') + b'\n')
+            self.wfile.flush()
+
+class QueryServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+    # The default backlog of 5 makes bursts of health checks fail with EAGAIN
+    request_queue_size = 128
+
+def serve_daemon(collect, socket_path, refresh=5.0):
+    """Collect once, then serve queries on socket_path while refreshing in the background"""
+    # A socket file left behind by a previous run would make bind() fail; anything else is not ours to remove
+    try:
+        existing = os.lstat(socket_path)
+    except FileNotFoundError:
+        existing = None
+    if existing is not None and not stat.S_ISSOCK(existing.st_mode):
+        print(f"Error: {socket_path} exists and is not a socket, refusing to remove it", file=sys.stderr)
+        sys.exit(1)
+
+    holder = SnapshotHolder(collect, refresh)
+    holder.update()
+
+    if existing is not None:
+        os.unlink(socket_path)
+
+    server = QueryServer(socket_path, QueryHandler)
+    server.holder = holder
+    stop = threading.Event()
+    threading.Thread(target=holder.refresh_forever, args=(stop,), daemon=True).start()
+
+    # Service managers stop us with SIGTERM; exit through the finally below so the socket file is removed
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    print(f"Serving queries on {socket_path}, refreshing every {refresh}s", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop.set()
+        server.server_close()
+        os.unlink(socket_path)
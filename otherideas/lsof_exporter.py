@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+Serve connection counts as OpenMetrics for Prometheus
+Usage: python3 lsof_parser_v2.py --metrics-port 9469 [--metrics-address 127.0.0.1] [--metrics-ttl 15]
+
+GET /metrics returns per-state, per-process and per-remote-port connection
+gauges plus the duration of the collection they were computed from. A
+snapshot is reused for --metrics-ttl seconds and concurrent scrapes that
+arrive while it is being refreshed wait for that one collection instead of
+each starting their own lsof run.
+"""
+
+import sys
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from lsof_parser_v2 import split_endpoint
+
+CONTENT_TYPE = 'application/openmetrics-text; version=1.0.0; charset=utf-8'
+
+class SnapshotCache:
+    """Hold the last collection for ttl seconds and share it between callers"""
+
+    def __init__(self, collect, ttl=15.0):
+        self.collect = collect
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._collected_at = None
+
+    def get(self):
+        """Return (connections, collected_at, duration), collecting again when the snapshot is stale"""
+        with self._lock:
+            # Scrapers queued behind a refresh find a fresh snapshot when they get the lock
+            if self._snapshot is None or time.monotonic() - self._collected_at >= self.ttl:
+                start = time.monotonic()
+                connections = list(self.collect())
+                duration = time.monotonic() - start
+                self._snapshot = (connections, time.time(), duration)
+                self._collected_at = time.monotonic()
+            return self._snapshot
+
+def escape_label(value):
+    """Escape a label value for the OpenMetrics text format"""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def format_family(name, help_text, samples):
+    """Return the lines of one gauge family from {((label, value), ...): number}"""
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} gauge"]
+    for labels, value in sorted(samples.items(), key=lambda item: [str(part) for part in item[0]]):
+        label_text = ','.join(f'{label}="{escape_label(label_value)}"' for label, label_value in labels)
+        lines.append(f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}")
+    return lines
+
+def count_by(connections, key):
+    """Count connections per label tuple returned by key, skipping None"""
+    counts = {}
+    for connection in connections:
+        labels = key(connection)
+        if labels is not None:
+            counts[labels] = counts.get(labels, 0) + 1
+    return counts
+
+def remote_port_labels(connection):
+    """Label tuple for the remote port gauge, or None for sockets without a peer"""
+    if connection['remote_address'] is None:
+        return None
+    port = split_endpoint(connection['remote_address'])[1]
+    return (('protocol', connection['protocol'] or connection['node']), ('remote_port', port))
+
+def render_metrics(connections, collected_at, duration):
+    """Render a snapshot as an OpenMetrics text exposition"""
+    lines = []
+    lines += format_family(
+        'lsof_connections', "Internet sockets by protocol and TCP state",
+        count_by(connections, lambda c: (('protocol', c['protocol'] or c['node']), ('state', c['state'] or 'NONE'))))
+    lines += format_family(
+        'lsof_process_connections', "Internet sockets held by each process",
+        count_by(connections, lambda c: (('command', c['command']), ('pid', c['pid']), ('user', c['user']))))
+    lines += format_family(
+        'lsof_remote_port_connections', "Connected sockets by remote port",
+        count_by(connections, remote_port_labels))
+    lines += format_family(
+        'lsof_collection_duration_seconds', "Time taken by the collection behind this snapshot",
+        {(): round(duration, 6)})
+    lines += format_family(
+        'lsof_collection_timestamp_seconds', "Unix time the snapshot was collected",
+        {(): round(collected_at, 3)})
+    lines.append('# EOF')
+    return '\n'.join(lines) + '\n'
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """Answer GET /metrics from the server's snapshot cache"""
+
+    def do_GET(self):
+        if self.path.split('?', 1)[0] not in ('/metrics', '/'):
+            self.send_error(404)
+            return
+
+        try:
+            body = render_metrics(*self.server.cache.get()).encode('utf-8')
+        except (Exception, SystemExit) as e:
+            # get_lsof_output() exits on failure; keep serving and let the scrape fail instead
+            self.send_error(503, f"collection failed: {e}")
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Scrapes every few seconds would flood stderr
+        pass
+
+def serve_metrics(collect, address='127.0.0.1', port=9469, ttl=15.0):
+    """Serve /metrics until interrupted"""
+    server = ThreadingHTTPServer((address, port), MetricsHandler)
+    server.daemon_threads = True
+    server.cache = SnapshotCache(collect, ttl)
+
+    print(f"Serving metrics on http://{address}:{server.server_address[1]}/metrics", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
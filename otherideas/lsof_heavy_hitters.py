@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+Track the busiest remote peers and commands over long runs in fixed memory
+Usage: python3 lsof_parser_v2.py --heavy-hitters INTERVAL [--top N] [--sketch-error 0.001] [--spike-factor 3]
+
+Every INTERVAL seconds the connections opened since the last snapshot are
+counted per remote host (the host part of remote_address, so the ephemeral
+ports of inbound clients do not split one peer into thousands) and per
+command. Counting uses sketches whose size depends only on --sketch-error
+and --sketch-delta, never on how many distinct peers show up:
+
+- Space-Saving keeps the top 1/error keys, once for the whole run and once
+  per interval; every reported count overestimates by at most its error.
+- Count-Min holds the whole-run count of any key, which gives the average
+  per interval that a spike is measured against.
+
+One NDJSON record is written per interval with the interval's and the run's
+top talkers and every key whose rate jumped to --spike-factor times its
+average.
+"""
+
+import sys
+import json
+import math
+import time
+import heapq
+from array import array
+from datetime import datetime
+
+from lsof_parser_v2 import get_connections, connection_key, split_endpoint
+
+# Keys tracked per connection
+TRACKED_FIELDS = ('remote_host', 'command')
+
+class CountMinSketch:
+    """Approximate counts of any key: overestimates by at most error * total with probability 1 - delta"""
+
+    def __init__(self, error=0.001, delta=0.01):
+        self.width = math.ceil(math.e / error)
+        self.depth = math.ceil(math.log(1 / delta))
+        self.table = array('Q', bytes(8 * self.width * self.depth))
+        self.total = 0
+
+    def _cells(self, key):
+        for row in range(self.depth):
+            yield row * self.width + hash((row, key)) % self.width
+
+    def add(self, key, count=1):
+        for cell in self._cells(key):
+            self.table[cell] += count
+        self.total += count
+
+    def estimate(self, key):
+        return min(self.table[cell] for cell in self._cells(key))
+
+class SpaceSaving:
+    """Top-k counter in O(k) memory; each count overestimates by at most the returned error"""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.counts = {}
+        self.errors = {}
+        # Min-heap of (count, key); entries go stale as counts grow and are fixed up when popped
+        self._heap = []
+
+    def add(self, key, count=1):
+        if key in self.counts:
+            self.counts[key] += count
+            return
+        if len(self.counts) < self.capacity:
+            self.counts[key] = count
+            self.errors[key] = 0
+            heapq.heappush(self._heap, (count, key))
+            return
+
+        # Replace the key with the smallest count; the newcomer inherits it as its error
+        while True:
+            smallest, victim = heapq.heappop(self._heap)
+            if self.counts[victim] == smallest:
+                break
+            heapq.heappush(self._heap, (self.counts[victim], victim))
+        del self.counts[victim], self.errors[victim]
+        self.counts[key] = smallest + count
+        self.errors[key] = smallest
+        heapq.heappush(self._heap, (self.counts[key], key))
+
+    def top(self, n):
+        """Return [(key, count, error), ...] for the n largest counts"""
+        largest = heapq.nlargest(n, self.counts.items(), key=lambda item: item[1])
+        return [(key, count, self.errors[key]) for key, count in largest]
+
+class HeavyHitters:
+    """Whole-run and per-interval heavy hitters plus spike detection for one field"""
+
+    def __init__(self, error=0.001, delta=0.01):
+        self.capacity = math.ceil(1 / error)
+        self.overall = SpaceSaving(self.capacity)
+        self.interval = SpaceSaving(self.capacity)
+        self.sketch = CountMinSketch(error, delta)
+        self.intervals = 0
+
+    def add(self, key):
+        self.overall.add(key)
+        self.interval.add(key)
+        self.sketch.add(key)
+
+    def close_interval(self, top=10, spike_factor=3.0, min_count=5):
+        """Return this interval's report and start the next one"""
+        self.intervals += 1
+        current = self.interval.top(top)
+
+        spikes = []
+        if self.intervals > 1:
+            for key, count, _ in current:
+                # Average per earlier interval, from the run total minus this interval
+                average = (self.sketch.estimate(key) - count) / (self.intervals - 1)
+                if count >= min_count and count > spike_factor * max(average, 1):
+                    spikes.append({'value': key, 'count': count, 'average': round(average, 2)})
+
+        report = {
+            'interval': [{'value': key, 'count': count, 'error': error} for key, count, error in current],
+            'overall': [{'value': key, 'count': count, 'error': error} for key, count, error in self.overall.top(top)],
+            'spikes': spikes,
+        }
+        self.interval = SpaceSaving(self.capacity)
+        return report
+
+def tracked_value(connection, field):
+    """Return the value a connection is counted under, or None if it has none"""
+    if field == 'remote_host':
+        if not connection['remote_address']:
+            return None
+        return split_endpoint(connection['remote_address'])[0]
+    return connection[field]
+
+def watch_heavy_hitters(args, out=None):
+    """Collect every args.heavy_hitters seconds and write one heavy-hitter report per interval"""
+    out = out or sys.stdout
+    trackers = {field: HeavyHitters(args.sketch_error, args.sketch_delta) for field in TRACKED_FIELDS}
+    previous = set()
+
+    while True:
+        opened = 0
+        current = set()
+        failed_hosts = set()
+        for connection in get_connections(args, failed_hosts):
+            key = connection_key(connection)
+            current.add(key)
+            # Only connections that were not there last time count towards the rate
+            if key in previous:
+                continue
+            opened += 1
+            for field, tracker in trackers.items():
+                value = tracked_value(connection, field)
+                if value is not None:
+                    tracker.add(value)
+
+        # Keep a failed host's connections, so they do not all count as new once it answers again
+        current.update(key for key in previous if key[0] in failed_hosts)
+
+        record = {'timestamp': datetime.now().isoformat(), 'opened': opened, 'connections': len(current)}
+        for field, tracker in trackers.items():
+            record[field] = tracker.close_interval(args.top or 10, args.spike_factor)
+        out.write(json.dumps(record) + '\n')
+        out.flush()
+
+        previous = current
+        time.sleep(args.heavy_hitters)
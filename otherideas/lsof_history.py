@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+"""
+Keep a history of connection snapshots in SQLite and query it by time
+Usage: python3 lsof_parser_v2.py --history DB [--watch INTERVAL]
+       python3 lsof_history.py DB query --from 02:00 --to 02:15 [--remote-host X] [--pid N] [--state S]
+       python3 lsof_history.py DB compact [--older-than SECONDS] [--retain SECONDS]
+
+Every snapshot is written in one transaction. A connection unchanged since
+the previous snapshot only has the last_seen of its open interval moved
+forward; new or changed connections get a row whose first_seen and last_seen
+are the snapshot time. The database therefore grows with connection churn
+rather than with the number of snapshots. Compaction merges the per-snapshot
+rows that earlier versions wrote into intervals, and retention drops
+intervals that ended before the cutoff.
+"""
+
+import sys
+import json
+import time
+import sqlite3
+import argparse
+from datetime import datetime
+
+from lsof_parser_v2 import split_endpoint
+
+# Connection fields stored per interval; remote_host is derived from remote_address
+COLUMNS = (
+    'host', 'command', 'pid', 'user', 'fd', 'type', 'device', 'size_off', 'node',
+    'protocol', 'local_address', 'remote_address', 'remote_host', 'state', 'raw_name',
+)
+
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS snapshots (
+    id INTEGER PRIMARY KEY,
+    taken_at REAL NOT NULL,
+    connection_count INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS snapshots_taken_at ON snapshots (taken_at);
+
+CREATE TABLE IF NOT EXISTS connections (
+    id INTEGER PRIMARY KEY,
+    first_seen REAL NOT NULL,
+    last_seen REAL NOT NULL,
+    {', '.join(COLUMNS)}
+);
+CREATE INDEX IF NOT EXISTS connections_first_seen ON connections (first_seen);
+CREATE INDEX IF NOT EXISTS connections_last_seen ON connections (last_seen);
+CREATE INDEX IF NOT EXISTS connections_pid ON connections (pid, first_seen);
+CREATE INDEX IF NOT EXISTS connections_remote_host ON connections (remote_host, first_seen);
+CREATE INDEX IF NOT EXISTS connections_state ON connections (state, first_seen);
+"""
+
+# Query filters that map straight onto an indexed column
+FILTER_COLUMNS = ('pid', 'remote_host', 'state', 'command', 'user', 'host')
+
+def parse_time(value):
+    """Parse a Unix timestamp, an ISO date/time or a HH:MM[:SS] time of today"""
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except ValueError:
+        pass
+    try:
+        clock = datetime.strptime(value, '%H:%M:%S' if value.count(':') == 2 else '%H:%M').time()
+    except ValueError:
+        raise ValueError(f"Cannot parse time: {value}")
+    return datetime.combine(datetime.now().date(), clock).timestamp()
+
+class HistoryStore:
+    """Store of connection snapshots as intervals in a SQLite database"""
+
+    def __init__(self, path):
+        self.db = sqlite3.connect(path)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.executescript(SCHEMA)
+        # Stored fields -> ids of the intervals still open at snapshot time _open_at
+        self._open = {}
+        self._open_at = None
+
+    def close(self):
+        self.db.close()
+
+    def _open_intervals(self):
+        """Return the stored fields -> ids of intervals that were seen in the latest snapshot"""
+        (latest,) = self.db.execute('SELECT MAX(taken_at) FROM snapshots').fetchone()
+        if latest != self._open_at:
+            # Another writer (or the first snapshot of this process): read the open intervals back
+            self._open = {}
+            cursor = self.db.execute(f"SELECT id, {', '.join(COLUMNS)} FROM connections WHERE last_seen = ?", (latest,))
+            for row_id, *values in cursor:
+                self._open.setdefault(tuple(values), []).append(row_id)
+            self._open_at = latest
+        return self._open
+
+    def record_snapshot(self, connections, taken_at=None):
+        """Store one snapshot in a single transaction and return the number of connections
+
+        Connections whose stored fields all match an interval open in the
+        previous snapshot extend it; the others start a new interval.
+        """
+        taken_at = time.time() if taken_at is None else taken_at
+        previous = self._open_intervals()
+        current, extended, inserts = {}, [], []
+        for connection in connections:
+            values = []
+            for column in COLUMNS:
+                if column == 'remote_host' and column not in connection:
+                    remote = connection['remote_address']
+                    values.append(split_endpoint(remote)[0] if remote else None)
+                else:
+                    values.append(connection.get(column))
+            values = tuple(values)
+
+            ids = previous.get(values)
+            if ids:
+                row_id = ids.pop()
+                extended.append((taken_at, row_id))
+                current.setdefault(values, []).append(row_id)
+            else:
+                inserts.append(values)
+
+        # Entries were taken out of the cached intervals above; reload them if the write fails
+        self._open_at = None
+        with self.db:
+            self.db.execute('INSERT INTO snapshots (taken_at, connection_count) VALUES (?, ?)',
+                            (taken_at, len(extended) + len(inserts)))
+            self.db.executemany('UPDATE connections SET last_seen = ? WHERE id = ?', extended)
+            for values in inserts:
+                cursor = self.db.execute(
+                    f"INSERT INTO connections (first_seen, last_seen, {', '.join(COLUMNS)}) "
+                    f"VALUES ({', '.join('?' * (len(COLUMNS) + 2))})", (taken_at, taken_at) + values)
+                current.setdefault(values, []).append(cursor.lastrowid)
+        self._open, self._open_at = current, taken_at
+        return len(extended) + len(inserts)
+
+    def query(self, start=None, end=None, **criteria):
+        """Return connections alive at any point between start and end that match every criterion"""
+        clauses, params = [], []
+        if start is not None:
+            clauses.append('last_seen >= ?')
+            params.append(start)
+        if end is not None:
+            clauses.append('first_seen <= ?')
+            params.append(end)
+        for column, value in criteria.items():
+            if column not in FILTER_COLUMNS:
+                raise KeyError(f"Unknown history filter: {column}")
+            clauses.append(f"{column} = ?")
+            params.append(value)
+
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+        cursor = self.db.execute(
+            f"SELECT first_seen, last_seen, {', '.join(COLUMNS)} FROM connections {where} ORDER BY first_seen, id",
+            params)
+
+        results = []
+        for first_seen, last_seen, *values in cursor:
+            record = {'first_seen': datetime.fromtimestamp(first_seen).isoformat(),
+                      'last_seen': datetime.fromtimestamp(last_seen).isoformat()}
+            record.update((column, value) for column, value in zip(COLUMNS, values) if value is not None or column != 'host')
+            results.append(record)
+        return results
+
+    def compact(self, older_than=0.0, now=None):
+        """Merge intervals of unchanged connections that started before now - older_than
+
+        record_snapshot() already extends open intervals, so this only finds
+        work in databases written one row per snapshot by earlier versions.
+
+        Two rows are merged when every stored field is equal and the second
+        starts at the snapshot right after the first one ends, so a connection
+        that disappeared for a snapshot keeps two intervals. Returns the number
+        of rows removed.
+        """
+        now = time.time() if now is None else now
+        cutoff = now - older_than
+
+        # Snapshot time -> time of the following snapshot
+        times = [taken_at for (taken_at,) in self.db.execute('SELECT taken_at FROM snapshots ORDER BY taken_at')]
+        next_snapshot = dict(zip(times, times[1:]))
+
+        groups = {}
+        cursor = self.db.execute(
+            f"SELECT id, first_seen, last_seen, {', '.join(COLUMNS)} FROM connections WHERE first_seen <= ?",
+            (cutoff,))
+        for row_id, first_seen, last_seen, *values in cursor:
+            groups.setdefault(tuple(values), []).append([first_seen, last_seen, row_id])
+
+        updates, deletes = [], []
+        for intervals in groups.values():
+            if len(intervals) < 2:
+                continue
+            intervals.sort()
+            current = intervals[0]
+            changed = False
+            for interval in intervals[1:]:
+                if next_snapshot.get(current[1]) == interval[0] or interval[0] <= current[1]:
+                    current[1] = max(current[1], interval[1])
+                    deletes.append((interval[2],))
+                    changed = True
+                else:
+                    if changed:
+                        updates.append((current[1], current[2]))
+                    current, changed = interval, False
+            if changed:
+                updates.append((current[1], current[2]))
+
+        with self.db:
+            self.db.executemany('UPDATE connections SET last_seen = ? WHERE id = ?', updates)
+            self.db.executemany('DELETE FROM connections WHERE id = ?', deletes)
+        return len(deletes)
+
+    def expire(self, retain, now=None):
+        """Delete intervals that ended and snapshots taken more than retain seconds ago"""
+        cutoff = (time.time() if now is None else now) - retain
+        with self.db:
+            removed = self.db.execute('DELETE FROM connections WHERE last_seen < ?', (cutoff,)).rowcount
+            self.db.execute('DELETE FROM snapshots WHERE taken_at < ?', (cutoff,))
+        return removed
+
+def parse_args(argv=None):
+    """Parse command line arguments"""
+    parser = argparse.ArgumentParser(description="Query and maintain the connection history database")
+    parser.add_argument('database', help="SQLite file written by lsof_parser_v2.py --history")
+    commands = parser.add_subparsers(dest='action', required=True)
+
+    query = commands.add_parser('query', help="print connections alive in a time range as JSON")
+    query.add_argument('--from', dest='start', help="start of the range (Unix time, ISO date/time or HH:MM)")
+    query.add_argument('--to', dest='end', help="end of the range (Unix time, ISO date/time or HH:MM)")
+    query.add_argument('--pid', type=int)
+    query.add_argument('--remote-host')
+    query.add_argument('--state')
+    query.add_argument('--command')
+    query.add_argument('--user')
+    query.add_argument('--host', help="host tag written by multi-host collection")
+
+    compact = commands.add_parser('compact', help="merge unchanged connections into intervals and apply retention")
+    compact.add_argument('--older-than', type=float, default=0.0, metavar='SECONDS',
+                         help="only merge rows that started at least this long ago (default: %(default)s)")
+    compact.add_argument('--retain', type=float, metavar='SECONDS',
+                         help="delete history that ended more than this long ago")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    """Run a history query or maintenance command"""
+    args = parse_args(argv)
+    store = HistoryStore(args.database)
+
+    try:
+        if args.action == 'query':
+            criteria = {column: getattr(args, column) for column in FILTER_COLUMNS if getattr(args, column) is not None}
+            try:
+                start = parse_time(args.start) if args.start else None
+                end = parse_time(args.end) if args.end else None
+            except ValueError as e:
+                print(f"Error: {e}", file=sys.stderr)
+                sys.exit(1)
+            print(json.dumps(store.query(start, end, **criteria), indent=2))
+        else:
+            merged = store.compact(args.older_than)
+            expired = store.expire(args.retain) if args.retain is not None else 0
+            print(f"Merged {merged} rows, expired {expired} rows", file=sys.stderr)
+    finally:
+        store.close()
+
+if __name__ == "__main__":
+    main()
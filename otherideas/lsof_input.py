@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+Parse saved `lsof -i` dumps offline
+Usage: python3 lsof_parser_v2.py --input FILE [--workers N]
+
+The dump is memory-mapped and cut into line-aligned chunks which are parsed
+in a process pool. Records come back in the original line order and lines
+that cannot be parsed are reported with their line number in the file, the
+same way main() reports them for live lsof output.
+
+Rebuilding one dictionary per record in the parent costs about as much as
+parsing it, so workers never send dictionaries back. write_lsof_file() has
+the workers serialize their chunk to JSON text that the parent only writes
+out; parse_lsof_file() has them send plain value tuples. At most two chunks
+per worker are in flight, so memory stays bounded on large dumps.
+"""
+
+import os
+import sys
+import json
+import mmap
+from itertools import islice
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from lsof_parser_v2 import parse_lsof_lines, print_parse_warning, ENDPOINT_FIELDS
+from lsof_table import FIELDS
+
+# Bytes of the dump handed to one worker at a time
+CHUNK_SIZE = 4 * 1024 * 1024
+
+# Chunks submitted per worker before the oldest result is consumed
+CHUNKS_IN_FLIGHT = 2
+
+def chunk_offsets(path, chunk_size=CHUNK_SIZE):
+    """Return (start, end) byte ranges of path that begin and end on line boundaries"""
+    size = os.path.getsize(path)
+    if size == 0:
+        return []
+
+    offsets = []
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        start = 0
+        while start < size:
+            end = data.find(b'\n', min(start + chunk_size, size) - 1)
+            end = size if end == -1 else end + 1
+            offsets.append((start, end))
+            start = end
+    return offsets
+
+def parse_chunk(task):
+    """Parse one chunk of the dump; returns (line count, payload, [(line index, line), ...])
+
+    The payload is a list of value tuples in FIELDS (+ ENDPOINT_FIELDS) order,
+    or with output 'ndjson' / 'json' the chunk's records already serialized
+    the way write_ndjson() / write_json_array() would write them.
+    """
+    path, start, end, structured, output = task
+    line_count, records, failures = parse_chunk_records(path, start, end, structured)
+
+    if output == 'ndjson':
+        payload = ''.join(json.dumps(record) + '\n' for record in records)
+    elif output == 'json':
+        payload = ',\n  '.join(json.dumps(record, indent=2).replace('\n', '\n  ') for record in records)
+    else:
+        payload = [tuple(record.values()) for record in records]
+    return line_count, payload, failures
+
+def parse_chunk_records(path, start, end, structured):
+    """Parse the lines between two byte offsets; returns (line count, records, failures)"""
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        lines = data[start:end].decode('utf-8', errors='replace').split('\n')
+    if lines[-1] == '':
+        lines.pop()
+
+    failures = []
+    records = list(parse_lsof_lines(lines, lambda line_num, line: failures.append((line_num, line)), structured))
+    return len(lines), records, failures
+
+def run_chunks(path, workers, structured, output, chunk_size):
+    """Yield (line count, payload, failures) for every chunk in file order"""
+    tasks = [(path, start, end, structured, output) for start, end in chunk_offsets(path, chunk_size)]
+    workers = workers or os.cpu_count() or 1
+
+    if workers == 1 or len(tasks) <= 1:
+        yield from map(parse_chunk, tasks)
+        return
+
+    tasks = iter(tasks)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # Keep every worker busy without queueing (and buffering the results of) the whole file
+        pending = deque(executor.submit(parse_chunk, task) for task in islice(tasks, CHUNKS_IN_FLIGHT * workers))
+        try:
+            while pending:
+                result = pending.popleft().result()
+                pending.extend(executor.submit(parse_chunk, task) for task in islice(tasks, 1))
+                yield result
+        finally:
+            for future in pending:
+                future.cancel()
+
+def checked_payloads(results):
+    """Report the failures of each chunk with their line number in the file and yield its payload"""
+    lines_before = 0
+    for line_count, payload, failures in results:
+        for line_num, line in failures:
+            print_parse_warning(lines_before + line_num, line)
+        yield payload
+        lines_before += line_count
+
+def parse_lsof_file(path, workers=None, structured=False, chunk_size=CHUNK_SIZE):
+    """Yield parsed connections from an `lsof -i` dump in file order, parsing chunks in parallel"""
+    fields = FIELDS + ENDPOINT_FIELDS if structured else FIELDS
+    for rows in checked_payloads(run_chunks(path, workers, structured, None, chunk_size)):
+        for row in rows:
+            yield dict(zip(fields, row))
+
+def write_lsof_file(path, output='json', workers=None, structured=False, chunk_size=CHUNK_SIZE, out=None):
+    """Write an `lsof -i` dump as a JSON array ('json') or NDJSON ('ndjson'), serialized in the workers
+
+    The output is identical to write_json_array() / write_ndjson() over
+    parse_lsof_file(), but the parent process only concatenates text.
+    """
+    out = out or sys.stdout
+    separator = '[\n  '
+    for payload in checked_payloads(run_chunks(path, workers, structured, output, chunk_size)):
+        if not payload:
+            continue
+        if output == 'json':
+            out.write(separator)
+            separator = ',\n  '
+        out.write(payload)
+        out.flush()
+    if output == 'json':
+        out.write('[]\n' if separator.startswith('[') else '\n]\n')
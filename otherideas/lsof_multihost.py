@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Collect lsof output from many hosts at once
+Usage: python3 lsof_parser_v2.py --host web1 --host web2 [--command-template "ssh {host} lsof -i -n -P"]
+
+Each host's command runs as an asyncio subprocess and its output is parsed
+with parse_lsof_line() line by line as it arrives. A semaphore caps how many
+commands run at the same time and every host has its own timeout, so the
+whole collection takes about as long as the slowest host. A host that times
+out or fails contributes no connections rather than the part of its output
+read so far, which would look like a complete snapshot with sockets closed.
+"""
+
+import os
+import sys
+import time
+import signal
+import shlex
+import asyncio
+
+from lsof_parser_v2 import parse_lsof_line, print_parse_warning
+
+DEFAULT_COMMAND_TEMPLATE = "ssh -o BatchMode=yes {host} lsof -i -n -P"
+
+def build_command(template, host):
+    """Turn a command template into an argument list for one host"""
+    return [arg.replace('{host}', host) for arg in shlex.split(template)]
+
+async def collect_host(host, template, semaphore, timeout):
+    """Run the command for one host and return its result dictionary"""
+    result = {'host': host, 'status': 'ok', 'error': None, 'duration': None, 'connections': [], 'discarded': 0}
+
+    async with semaphore:
+        start = time.monotonic()
+        try:
+            process = await asyncio.create_subprocess_exec(
+                *build_command(template, host),
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+                # Own process group, so a timeout also kills whatever the wrapper started
+                start_new_session=True,
+            )
+        except OSError as e:
+            result.update(status='error', error=str(e))
+            return result
+
+        async def read_output():
+            # Drain stderr alongside stdout so a chatty ssh cannot fill the pipe and stall us
+            stderr_reader = asyncio.ensure_future(process.stderr.read())
+            line_num = 0
+            async for raw in process.stdout:
+                line_num += 1
+                line = raw.decode('utf-8', errors='replace').strip()
+
+                # Skip empty and header lines
+                if not line or (line.startswith('COMMAND') and 'PID' in line):
+                    continue
+
+                parsed = parse_lsof_line(line)
+                if parsed:
+                    parsed['host'] = host
+                    result['connections'].append(parsed)
+                else:
+                    print_parse_warning(line_num, f"[{host}] {line}")
+
+            return await process.wait(), await stderr_reader
+
+        try:
+            returncode, stderr = await asyncio.wait_for(read_output(), timeout)
+            # lsof also exits with 1 after partial errors, so that only fails a host that produced no
+            # connections; stderr (e.g. ssh's known_hosts notice) only explains the failure
+            if returncode not in (0, 1) or (returncode == 1 and not result['connections']):
+                result.update(status='error', error=stderr.decode('utf-8', errors='replace').strip()
+                              or f"exited with code {returncode}")
+        except asyncio.TimeoutError:
+            try:
+                os.killpg(process.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+            await process.wait()
+            result.update(status='timeout', error=f"no result within {timeout}s")
+        finally:
+            result['duration'] = round(time.monotonic() - start, 3)
+
+    if result['status'] != 'ok':
+        result['discarded'] = len(result['connections'])
+        result['connections'] = []
+    return result
+
+async def collect_hosts_async(hosts, template=DEFAULT_COMMAND_TEMPLATE, concurrency=16, timeout=30.0):
+    """Collect every host concurrently and return the results in host order"""
+    semaphore = asyncio.Semaphore(concurrency)
+    return await asyncio.gather(*(collect_host(host, template, semaphore, timeout) for host in hosts))
+
+def collect_hosts(hosts, template=DEFAULT_COMMAND_TEMPLATE, concurrency=16, timeout=30.0):
+    """Collect every host and return (merged connections tagged with host, per-host results)"""
+    results = asyncio.run(collect_hosts_async(hosts, template, concurrency, timeout))
+
+    connections = []
+    for result in results:
+        connections.extend(result['connections'])
+    return connections, results
+
+def get_multihost_connections(hosts, template=DEFAULT_COMMAND_TEMPLATE, concurrency=16, timeout=30.0,
+                              failed_hosts=None):
+    """Collect every host, report failed hosts on stderr and return the merged connections
+
+    The names of hosts that failed are added to the failed_hosts set if one is given.
+    """
+    connections, results = collect_hosts(hosts, template, concurrency, timeout)
+
+    for result in results:
+        if result['status'] != 'ok':
+            print(f"Warning: {result['host']}: {result['status']}: {result['error']}"
+                  f" (discarded {result['discarded']} partial connections)", file=sys.stderr)
+            if failed_hosts is not None:
+                failed_hosts.add(result['host'])
+    return connections
+
+def read_hosts_file(path):
+    """Read one host per line, ignoring blank lines and # comments"""
+    hosts = []
+    with open(path, 'r') as f:
+        for line in f:
+            line = line.split('#', 1)[0].strip()
+            if line:
+                hosts.append(line)
+    return hosts
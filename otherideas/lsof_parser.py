@@ -30,6 +30,8 @@ def get_lsof_output():
         print("Error: lsof command not found", file=sys.stderr)
         print("Install lsof: sudo apt install lsof", file=sys.stderr)
         sys.exit(1)
+
+def parse_lsof_line(line):
     """Parse a single lsof output line into a dictionary"""
     # Split by whitespace, but be careful with the NAME field which can contain spaces
     parts = line.split()
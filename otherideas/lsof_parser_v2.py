@@ -1,7 +1,7 @@
 #!/usr/bin/env python3
 """
 Parse lsof network output and convert to JSON format
-Usage: python3 lsof_parser.py
+Usage: python3 lsof_parser_v2.py [options]   (see --help)
 """
 
 import sys
@@ -9,17 +9,54 @@ import json
 import re
 import subprocess
 import os
+import pwd
+import argparse
+import time
+from functools import lru_cache
+from datetime import datetime
 
-def get_lsof_output():
+LSOF_COMMAND = ['lsof', '-i']
+
+# Machine readable variant: prefix-tagged fields, NUL separated, one process or file set per line
+# (see "OUTPUT FOR OTHER PROGRAMS" in lsof(8))
+# p=PID c=command u=UID L=login f=FD a=access t=type d=device s=size o=offset P=protocol n=name T=TCP info
+LSOF_FIELDS_COMMAND = ['lsof', '-i', '-F0pcuLfatdsoPnT']
+
+# A whole file set in the order lsof writes its fields; fields we did not ask for are skipped
+LSOF_FILE_SET = re.compile(
+    r'f([^\0]*)\0(?:a([^\0]*)\0)?(?:l[^\0]*\0)?(?:t([^\0]*)\0)?(?:G[^\0]*\0)?(?:d([^\0]*)\0)?'
+    r'(?:D[^\0]*\0)?(?:s([^\0]*)\0)?(?:o([^\0]*)\0)?(?:i[^\0]*\0)?(?:k[^\0]*\0)?'
+    r'(?:P([^\0]*)\0)?(?:n([^\0]*)\0)?(?:TST=([^\0]*)\0)?(?:T[^\0]*\0)*\n?\Z'
+)
+
+# Filters that collection backends apply while enumerating sockets
+COLLECTION_FILTERS = ('port', 'pid', 'user', 'protocol', 'state')
+
+# Endpoint fields added by parse_lsof_lines() and add_endpoint_fields()
+ENDPOINT_FIELDS = ('local_host', 'local_port', 'remote_host', 'remote_port')
+
+_root_warning_shown = False
+
+def warn_if_not_root():
+    """Warn once that lsof cannot see every process without root privileges"""
+    global _root_warning_shown
+    
+    # Check if we're running as root or with sudo
+    if os.geteuid() != 0 and not _root_warning_shown:
+        _root_warning_shown = True
+        print("Warning: Running without root privileges. Some processes may not be visible.", file=sys.stderr)
+        print("For complete results, run with: sudo python3 lsof_parser.py", file=sys.stderr)
+
+def get_lsof_output(cmd=LSOF_COMMAND):
     """Run lsof command and return output lines"""
     try:
-        # Check if we're running as root or with sudo
-        if os.geteuid() != 0:
-            print("Warning: Running without root privileges. Some processes may not be visible.", file=sys.stderr)
-            print("For complete results, run with: sudo python3 lsof_parser.py", file=sys.stderr)
+        warn_if_not_root()
         
-        # Run lsof command
-        result = subprocess.run(['lsof', '-i'], capture_output=True, text=True, check=True)
+        # Run lsof command; it exits with 1 and prints nothing when no socket matches its selectors
+        result = subprocess.run(cmd, capture_output=True, text=True)
+        if result.returncode == 1 and not result.stdout.strip():
+            return []
+        result.check_returncode()
         return result.stdout.strip().split('\n')
     
     except subprocess.CalledProcessError as e:
@@ -31,6 +68,29 @@ def get_lsof_output():
         print("Install lsof: sudo apt install lsof", file=sys.stderr)
         sys.exit(1)
 
+def iter_lsof_output(cmd=LSOF_COMMAND):
+    """Run lsof command and yield output lines as they arrive on the pipe"""
+    warn_if_not_root()
+    
+    try:
+        process = subprocess.Popen(cmd, stdout=subprocess.PIPE, text=True)
+    except FileNotFoundError:
+        print("Error: lsof command not found", file=sys.stderr)
+        print("Install lsof: sudo apt install lsof", file=sys.stderr)
+        sys.exit(1)
+    
+    seen_output = False
+    with process:
+        for line in process.stdout:
+            seen_output = True
+            yield line
+    
+    if process.returncode != 0 and not (process.returncode == 1 and not seen_output):
+        error = subprocess.CalledProcessError(process.returncode, cmd)
+        print(f"Error running lsof: {error}", file=sys.stderr)
+        print("Make sure lsof is installed: sudo apt install lsof", file=sys.stderr)
+        sys.exit(1)
+
 def parse_lsof_line(line):
     """Parse a single lsof output line into a dictionary"""
     # Split by whitespace, but be careful with the NAME field which can contain spaces
@@ -52,6 +112,10 @@ def parse_lsof_line(line):
     # The NAME field is everything after the 8th column
     name = ' '.join(parts[8:]) if len(parts) > 8 else ''
     
+    return build_connection(command, pid, user, fd, type_field, device, size_off, node, name)
+
+def build_connection(command, pid, user, fd, type_field, device, size_off, node, name):
+    """Build a connection dictionary from the lsof columns"""
     # Parse the NAME field to extract network information
     protocol = None
     local_address = None
@@ -102,13 +166,237 @@ def parse_lsof_line(line):
         'raw_name': name
     }
 
-def main():
-    """Main function to run lsof, parse output and convert to JSON"""
-    connections = []
+def split_endpoint(address):
+    """Split an lsof address like 10.0.0.1:443, [::1]:8080 or *:ssh into (host, port)
+
+    IPv6 brackets are removed and numeric ports become integers.
+    """
+    if not address:
+        return None, None
+    
+    host, sep, port = address.rpartition(':')
+    if not sep:
+        return address, None
+    if host.startswith('[') and host.endswith(']'):
+        host = host[1:-1]
+    return host, int(port) if port.isdigit() else port
+
+def add_endpoint_fields(connection):
+    """Add structured local/remote host and port fields to a connection dictionary"""
+    connection['local_host'], connection['local_port'] = split_endpoint(connection['local_address'])
+    connection['remote_host'], connection['remote_port'] = split_endpoint(connection['remote_address'])
+    return connection
+
+def print_parse_warning(line_num, line):
+    """Report a line that could not be parsed"""
+    print(f"Warning: Could not parse line {line_num}: {line}", file=sys.stderr)
+
+def parse_lsof_lines(lines, on_error=print_parse_warning, endpoints=False):
+    """Parse lsof column output lines in bulk
+
+    Yields the same dictionaries as parse_lsof_line(), about a quarter faster
+    per line: each line is split once with maxsplit so NAME is never
+    re-joined, NAME is taken apart with partition() calls only, and the PID
+    and protocol conversions are looked up once per distinct value. Lines
+    whose NAME does not have the usual local[->remote][ (STATE)] shape go
+    through parse_lsof_line(). Header and empty lines are skipped and
+    on_error(line_num, line) is called for lines that cannot be parsed.
+
+    With endpoints, local_host, local_port, remote_host and remote_port are
+    added as well (see add_endpoint_fields()). That pass costs more than the
+    parsing saves, so it is only faster than parse_lsof_line() followed by
+    add_endpoint_fields(), not than parse_lsof_line() alone.
+    """
+    protocols = {}
+    pids = {}
+    
+    for line_num, line in enumerate(lines, 1):
+        parts = line.split(None, 8)
+        
+        if len(parts) == 9:
+            command, pid, user, fd, type_field, device, size_off, node, name = parts
+            name = name.rstrip()
+            
+            state = None
+            addresses = name
+            if name.endswith(')'):
+                addresses, paren, state = name[:-1].rpartition(' (')
+            local_address, arrow, remote_address = addresses.partition('->')
+            
+            # Anything unusual (header, extra spaces, state without a peer, ...) takes the general path
+            usual = ((arrow or state is None or state == 'LISTEN') and pid != 'PID'
+                     and ' ' not in addresses and '(' not in addresses)
+        else:
+            usual = False
+        
+        if not usual:
+            line = line.strip()
+            if not line or (line.startswith('COMMAND') and 'PID' in line):
+                continue
+            connection = parse_lsof_line(line)
+            if connection is None:
+                on_error(line_num, line)
+                continue
+            yield add_endpoint_fields(connection) if endpoints else connection
+            continue
+        
+        pid_value = pids.get(pid)
+        if pid_value is None:
+            pid_value = pids[pid] = int(pid) if pid.isdigit() else pid
+        
+        protocol = protocols.get(node, False)
+        if protocol is False:
+            upper = node.upper()
+            protocol = protocols[node] = 'TCP' if 'TCP' in upper else 'UDP' if 'UDP' in upper else None
+        
+        connection = {
+            'command': command,
+            'pid': pid_value,
+            'user': user,
+            'fd': fd,
+            'type': type_field,
+            'device': device,
+            'size_off': size_off,
+            'node': node,
+            'protocol': protocol,
+            'local_address': local_address,
+            'remote_address': remote_address if arrow else None,
+            'state': state,
+            'raw_name': name
+        }
+        yield add_endpoint_fields(connection) if endpoints else connection
+
+def parse_lsof_fields(lines):
+    """Parse `lsof -F0` field output into the same dictionaries as parse_lsof_line()
+
+    Each output line is one NUL-separated process set or file set, so every
+    record is built in a single pass without splitting on whitespace, and
+    commands, devices and names containing spaces or empty columns survive.
+    COMMAND is not truncated to lsof's nine column characters.
+    """
+    process = {}
+    
+    for line in lines:
+        if line.startswith('p'):
+            # Process set: PID, command, UID and login name
+            process = {field[0]: field[1:] for field in line.rstrip('\0\n').split('\0')}
+        elif line.startswith('f'):
+            yield build_field_connection(process, line)
+
+def build_field_connection(process, line):
+    """Build a connection dictionary from a `lsof -F0` process set and file set line"""
+    match = LSOF_FILE_SET.match(line)
+    if match:
+        fd, access, type_field, device, size, offset, node, name, state = match.groups()
+    else:
+        # Fields out of lsof's usual order: fall back to a tag lookup
+        file = {field[0]: field[1:] for field in line.split('\0') if field}
+        fd, access, type_field, device = file.get('f', ''), file.get('a'), file.get('t'), file.get('d')
+        size, offset, node, name = file.get('s'), file.get('o'), file.get('P'), file.get('n')
+        state = next((field[4:] for field in line.split('\0') if field.startswith('TST=')), None)
     
-    # Get lsof output
-    lines = get_lsof_output()
+    pid = process.get('p', '')
+    name = name or ''
+    node = node or ''
+    local_address, arrow, remote_address = name.partition('->')
     
+    return {
+        'command': process.get('c', ''),
+        'pid': int(pid) if pid.isdigit() else pid,
+        'user': process.get('L') or process.get('u', ''),
+        'fd': fd + (access or '').strip(),
+        'type': type_field or '',
+        'device': device or '',
+        'size_off': size or offset or '',
+        'node': node,
+        'protocol': node.upper() if node.upper() in ('TCP', 'UDP') else None,
+        'local_address': local_address or None,
+        'remote_address': remote_address if arrow else None,
+        'state': state,
+        'raw_name': f"{name} ({state})" if state else name
+    }
+
+def parse_args(argv=None):
+    """Parse command line arguments"""
+    parser = argparse.ArgumentParser(description="Parse lsof network output and convert to JSON format")
+    parser.add_argument('--backend', choices=['lsof', 'proc'], default='lsof',
+                        help="collect with `lsof -i` (default) or read /proc/net and /proc/<pid>/fd directly")
+    parser.add_argument('--proc-root', default='/proc',
+                        help="proc filesystem to read with --backend proc (default: /proc)")
+    parser.add_argument('--input', metavar='FILE',
+                        help="parse a saved `lsof -i` dump instead of running lsof")
+    parser.add_argument('--workers', type=int,
+                        help="processes used to parse --input (default: one per CPU)")
+    parser.add_argument('--host', action='append', default=[], dest='hosts', metavar='HOST',
+                        help="collect from HOST with --command-template (repeatable); output is tagged with host")
+    parser.add_argument('--hosts-file', metavar='FILE',
+                        help="read hosts to collect from, one per line")
+    parser.add_argument('--command-template', default="ssh -o BatchMode=yes {host} lsof -i -n -P",
+                        help="command run per host, {host} is replaced (default: %(default)s)")
+    parser.add_argument('--concurrency', type=int, default=16,
+                        help="hosts collected at the same time (default: %(default)s)")
+    parser.add_argument('--host-timeout', type=float, default=30.0,
+                        help="seconds before a host's command is killed (default: %(default)s)")
+    parser.add_argument('--port', type=int,
+                        help="only collect sockets with PORT at either end (lsof -i :PORT)")
+    parser.add_argument('--pid', type=int,
+                        help="only collect sockets of process PID (lsof -p)")
+    parser.add_argument('--user',
+                        help="only collect sockets of login USER (lsof -u)")
+    parser.add_argument('--protocol', type=str.upper, choices=['TCP', 'UDP'],
+                        help="only collect TCP or UDP sockets (lsof -iTCP)")
+    parser.add_argument('--state', type=str.upper,
+                        help="only collect TCP sockets in STATE, e.g. LISTEN (lsof -sTCP:STATE)")
+    parser.add_argument('--numeric', action='store_true',
+                        help="run lsof with -n -P so it never blocks on host or service name lookups")
+    parser.add_argument('--resolve', action='store_true',
+                        help="collect numerically, then add remote_name, local_service and remote_service in-process")
+    parser.add_argument('--resolve-deadline', type=float, default=2.0, metavar='SECONDS',
+                        help="longest a snapshot waits for reverse lookups; later answers are cached (default: %(default)s)")
+    parser.add_argument('--resolve-ttl', type=float, default=300.0, metavar='SECONDS',
+                        help="seconds resolved names are cached (default: %(default)s)")
+    parser.add_argument('--parser', choices=['columns', 'fields'], default='columns',
+                        help="parse the default column output or machine readable `lsof -F0` output")
+    parser.add_argument('--structured', action='store_true',
+                        help="add local_host, local_port, remote_host and remote_port fields")
+    parser.add_argument('--stream', action='store_true',
+                        help="parse lsof output as it arrives and write newline-delimited JSON")
+    parser.add_argument('--compact', action='store_true',
+                        help="hold parsed connections in a dictionary-encoded column table instead of a list of dicts")
+    parser.add_argument('--where', action='append', default=[], metavar='FIELD=VALUE',
+                        help="only keep connections where FIELD equals VALUE (repeatable, e.g. state=LISTEN local_port=443)")
+    parser.add_argument('--group-by', metavar='FIELD',
+                        help="print connection counts per value of FIELD (e.g. remote_host, user)")
+    parser.add_argument('--top', type=int, metavar='N',
+                        help="only print the N largest groups (or the first N connections)")
+    parser.add_argument('--count', action='store_true',
+                        help="print the number of matching connections")
+    parser.add_argument('--watch', type=float, metavar='INTERVAL',
+                        help="re-collect every INTERVAL seconds and write opened/closed/state_changed events as NDJSON")
+    parser.add_argument('--metrics-port', type=int, metavar='PORT',
+                        help="serve OpenMetrics connection gauges on PORT at /metrics instead of printing JSON")
+    parser.add_argument('--metrics-address', default='127.0.0.1',
+                        help="address the metrics endpoint listens on (default: %(default)s)")
+    parser.add_argument('--metrics-ttl', type=float, default=15.0, metavar='SECONDS',
+                        help="seconds a collection is reused for scrapes (default: %(default)s)")
+    parser.add_argument('--heavy-hitters', type=float, metavar='INTERVAL',
+                        help="re-collect every INTERVAL seconds and write the top remote hosts and commands by new connections")
+    parser.add_argument('--sketch-error', type=float, default=0.001, metavar='EPSILON',
+                        help="heavy-hitter count error as a share of all connections counted (default: %(default)s)")
+    parser.add_argument('--sketch-delta', type=float, default=0.01, metavar='DELTA',
+                        help="probability a Count-Min estimate exceeds that error (default: %(default)s)")
+    parser.add_argument('--spike-factor', type=float, default=3.0, metavar='FACTOR',
+                        help="report a key whose connections in an interval exceed FACTOR times its average (default: %(default)s)")
+    parser.add_argument('--daemon', metavar='SOCKET',
+                        help="keep a snapshot in memory and answer lsof_client.py queries on the Unix socket SOCKET")
+    parser.add_argument('--refresh', type=float, default=5.0, metavar='SECONDS',
+                        help="seconds between snapshots in --daemon mode (default: %(default)s)")
+    parser.add_argument('--history', metavar='DB',
+                        help="also store each collected snapshot in the SQLite history DB (see lsof_history.py)")
+    return parser.parse_args(argv)
+
+def get_lsof_connections(lines):
+    """Yield a parsed dictionary for every connection line of lsof output"""
     # Parse each line
     for line_num, line in enumerate(lines, 1):
         line = line.strip()
@@ -124,12 +412,263 @@ def main():
         # Parse the line
         parsed = parse_lsof_line(line)
         if parsed:
-            connections.append(parsed)
+            yield parsed
+        else:
+            print_parse_warning(line_num, line)
+
+def collection_filters(args):
+    """Return the --port/--pid/--user/--protocol/--state filters that were given"""
+    filters = {name: getattr(args, name) for name in COLLECTION_FILTERS if getattr(args, name) is not None}
+    # States only exist for TCP
+    if 'state' in filters:
+        filters.setdefault('protocol', 'TCP')
+    return filters
+
+@lru_cache(maxsize=None)
+def user_names(user):
+    """Return the USER column values that match --user: the value given plus its login name or UID
+
+    lsof prints the login name where it knows one and the numeric UID
+    otherwise, so --user 0 has to match "root" and --user root "0".
+    """
+    names = {user}
+    try:
+        if user.isdigit():
+            names.add(pwd.getpwuid(int(user)).pw_name)
         else:
-            print(f"Warning: Could not parse line {line_num}: {line}", file=sys.stderr)
+            names.add(str(pwd.getpwnam(user).pw_uid))
+    except KeyError:
+        pass
+    return frozenset(names)
+
+def matches_filters(connection, filters):
+    """Check a parsed connection against collection_filters()"""
+    for name, value in filters.items():
+        if name == 'port':
+            ports = [split_endpoint(address)[1] for address in (connection['local_address'], connection['remote_address']) if address]
+            if value not in ports:
+                return False
+        elif name == 'protocol':
+            if (connection['protocol'] or connection['node']) != value:
+                return False
+        elif name == 'user':
+            if connection['user'] not in user_names(value):
+                return False
+        elif connection[name] != value:
+            return False
+    return True
+
+def lsof_selectors(filters):
+    """Translate collection filters into lsof selection options, ANDed together with -a"""
+    selectors = ['-a', f"-i{filters.get('protocol', '')}" + (f":{filters['port']}" if 'port' in filters else '')]
+    if 'state' in filters:
+        selectors.append(f"-sTCP:{filters['state']}")
+    if 'pid' in filters:
+        selectors += ['-p', str(filters['pid'])]
+    if 'user' in filters:
+        selectors += ['-u', filters['user']]
+    return selectors
+
+def lsof_command(args, base=LSOF_COMMAND):
+    """Return the lsof command line for the options given"""
+    cmd = list(base)
+    filters = collection_filters(args)
+    if filters:
+        # Let lsof select the sockets instead of listing every one and dropping most of them here
+        position = cmd.index('-i')
+        cmd[position:position + 1] = lsof_selectors(filters)
+    if args.numeric or args.resolve:
+        # Without these lsof does a reverse DNS and a services lookup for every socket
+        cmd += ['-n', '-P']
+    elif 'port' in filters:
+        # Ports have to stay numeric for matches_filters() to recognise them
+        cmd.append('-P')
+    return cmd
+
+def get_connections(args, failed_hosts=None):
+    """Yield parsed connections from the backend selected on the command line
+
+    With --host, the hosts that returned no snapshot are added to failed_hosts.
+    """
+    connections = collect_connections(args, failed_hosts)
+    filters = collection_filters(args)
+    if filters:
+        # Backends narrow the collection themselves where they can; this catches the rest (--input, --host)
+        connections = (connection for connection in connections if matches_filters(connection, filters))
+    if args.resolve:
+        from lsof_resolver import resolve_connections, shared_resolver
+        return resolve_connections(connections, shared_resolver(args.resolve_deadline, args.resolve_ttl))
+    return connections
+
+def collect_connections(args, failed_hosts=None):
+    """Yield parsed connections from the collection backend selected on the command line"""
+    if args.input:
+        from lsof_input import parse_lsof_file
+        return parse_lsof_file(args.input, args.workers, args.structured)
+    if args.hosts or args.hosts_file:
+        from lsof_multihost import get_multihost_connections, read_hosts_file
+        hosts = args.hosts + (read_hosts_file(args.hosts_file) if args.hosts_file else [])
+        connections = get_multihost_connections(hosts, args.command_template, args.concurrency, args.host_timeout,
+                                                failed_hosts)
+    elif args.backend == 'proc':
+        from lsof_procfs import get_proc_connections
+        connections = get_proc_connections(args.proc_root, collection_filters(args))
+    elif args.parser == 'fields':
+        read_output = iter_lsof_output if args.stream else get_lsof_output
+        connections = parse_lsof_fields(read_output(lsof_command(args, LSOF_FIELDS_COMMAND)))
+    else:
+        read_output = iter_lsof_output if args.stream else get_lsof_output
+        lines = read_output(lsof_command(args))
+        if args.structured:
+            return parse_lsof_lines(lines, endpoints=True)
+        return get_lsof_connections(lines)
+    
+    if args.structured:
+        return map(add_endpoint_fields, connections)
+    return connections
+
+def write_ndjson(connections, out=None):
+    """Write one JSON document per connection, flushing so readers see each record at once"""
+    out = out or sys.stdout
+    for connection in connections:
+        out.write(json.dumps(connection) + '\n')
+        out.flush()
+
+def write_json_array(connections, out=None):
+    """Write connections as an indented JSON array one record at a time
+
+    The output is identical to print(json.dumps(list(connections), indent=2))
+    without first building the whole document in memory.
+    """
+    out = out or sys.stdout
+    separator = '[\n  '
+    for connection in connections:
+        out.write(separator + json.dumps(connection, indent=2).replace('\n', '\n  '))
+        separator = ',\n  '
+    out.write('[]\n' if separator.startswith('[') else '\n]\n')
+
+def connection_key(connection):
+    """Identify a connection across snapshots"""
+    return (connection.get('host'), connection['pid'], connection['fd'], connection['local_address'], connection['remote_address'])
+
+def diff_snapshots(previous, current):
+    """Yield (event, connection, previous_state) for the differences between two snapshots
+
+    Snapshots map connection_key() to the connection dictionary. Comparing the
+    (key, state) pairs as hashed sets means only connections that changed are
+    visited in Python, so the work per tick follows churn, not table size.
+    """
+    previous_states = {key: connection['state'] for key, connection in previous.items()}
+    current_states = {key: connection['state'] for key, connection in current.items()}
+    
+    for key, state in current_states.items() - previous_states.items():
+        if key in previous_states:
+            yield 'state_changed', current[key], previous_states[key]
+        else:
+            yield 'opened', current[key], None
+    
+    for key in previous_states.keys() - current_states.keys():
+        yield 'closed', previous[key], None
+
+def watch(args, out=None):
+    """Collect every args.watch seconds and write only the connection events"""
+    out = out or sys.stdout
+    previous = {}
+    store = None
+    if args.history:
+        from lsof_history import HistoryStore
+        store = HistoryStore(args.history)
+    
+    while True:
+        failed_hosts = set()
+        current = {connection_key(connection): connection for connection in get_connections(args, failed_hosts)}
+        # A host that did not answer keeps its last connections instead of reporting them all closed
+        current.update((key, connection) for key, connection in previous.items() if key[0] in failed_hosts)
+        timestamp = datetime.now().isoformat()
+        if store:
+            store.record_snapshot(current.values())
+        
+        for event, connection, previous_state in diff_snapshots(previous, current):
+            record = {'event': event, 'timestamp': timestamp}
+            record.update(connection)
+            if event == 'state_changed':
+                record['previous_state'] = previous_state
+            out.write(json.dumps(record) + '\n')
+        out.flush()
+        
+        previous = current
+        time.sleep(args.watch)
+
+def main(argv=None):
+    """Main function to run lsof, parse output and convert to JSON"""
+    args = parse_args(argv)
+    
+    if args.watch:
+        try:
+            watch(args)
+        except KeyboardInterrupt:
+            pass
+        return
+    
+    if args.heavy_hitters:
+        from lsof_heavy_hitters import watch_heavy_hitters
+        try:
+            watch_heavy_hitters(args)
+        except KeyboardInterrupt:
+            pass
+        return
+    
+    if args.daemon:
+        from lsof_daemon import serve_daemon
+        serve_daemon(lambda: get_connections(args), args.daemon, args.refresh)
+        return
+    
+    if args.metrics_port is not None:
+        from lsof_exporter import serve_metrics
+        serve_metrics(lambda: get_connections(args), args.metrics_address, args.metrics_port, args.metrics_ttl)
+        return
+    
+    if args.input and not (collection_filters(args) or args.resolve or args.compact or args.history
+                           or args.where or args.group_by or args.top or args.count):
+        # Nothing to do with the records here, so the workers serialize them as well
+        from lsof_input import write_lsof_file
+        write_lsof_file(args.input, 'ndjson' if args.stream else 'json', args.workers, args.structured)
+        return
+    
+    if args.stream:
+        write_ndjson(get_connections(args))
+        return
+    
+    if args.compact:
+        from lsof_table import ConnectionTable
+        extra_fields = ENDPOINT_FIELDS if args.structured else ()
+        if args.hosts or args.hosts_file:
+            extra_fields += ('host',)
+        if args.resolve:
+            from lsof_resolver import RESOLVED_FIELDS
+            extra_fields += RESOLVED_FIELDS
+        connections = ConnectionTable(get_connections(args), extra_fields)
+    else:
+        connections = list(get_connections(args))
+    
+    if args.history:
+        from lsof_history import HistoryStore
+        store = HistoryStore(args.history)
+        store.record_snapshot(connections)
+        store.close()
+    
+    if args.where or args.group_by or args.top or args.count:
+        from lsof_query import run_query
+        try:
+            result = run_query(connections, args.where, args.group_by, args.top, args.count)
+        except (KeyError, ValueError) as e:
+            print(f"Error: {e.args[0]}", file=sys.stderr)
+            sys.exit(1)
+        print(json.dumps(result, indent=2))
+        return
     
     # Output as JSON
-    print(json.dumps(connections, indent=2))
+    write_json_array(connections)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+"""
+Collect internet sockets straight from /proc instead of running `lsof -i`
+Usage: python3 lsof_parser_v2.py --backend proc
+
+Reads /proc/net/{tcp,tcp6,udp,udp6} and joins the socket inodes to their
+owning processes through /proc/<pid>/fd. The records have the same layout as
+the ones parse_lsof_line() builds from `lsof -i -n -P` output.
+"""
+
+import os
+import pwd
+import socket
+
+from lsof_parser_v2 import build_connection, warn_if_not_root
+
+# /proc/net table -> (NODE column, TYPE column)
+PROC_NET_TABLES = {
+    'tcp': ('TCP', 'IPv4'),
+    'tcp6': ('TCP', 'IPv6'),
+    'udp': ('UDP', 'IPv4'),
+    'udp6': ('UDP', 'IPv6'),
+}
+
+# Kernel TCP state codes, named the way lsof prints them
+TCP_STATES = {
+    '01': 'ESTABLISHED',
+    '02': 'SYN_SENT',
+    '03': 'SYN_RECV',
+    '04': 'FIN_WAIT1',
+    '05': 'FIN_WAIT2',
+    '06': 'TIME_WAIT',
+    '07': 'CLOSED',
+    '08': 'CLOSE_WAIT',
+    '09': 'LAST_ACK',
+    '0A': 'LISTEN',
+    '0B': 'CLOSING',
+}
+
+# State name -> kernel code, for filtering the raw tables
+STATE_CODES = {name: code for code, name in TCP_STATES.items()}
+
+# lsof truncates COMMAND to this many characters unless +c is given
+LSOF_COMMAND_WIDTH = 9
+
+def decode_address(hex_address, family):
+    """Decode a /proc/net address like 0100007F:0016 into lsof's host:port form"""
+    hex_host, hex_port = hex_address.split(':')
+    port = int(hex_port, 16)
+    raw = bytes.fromhex(hex_host)
+
+    # The kernel prints each 32-bit word in host (little endian) byte order
+    raw = b''.join(raw[i:i + 4][::-1] for i in range(0, len(raw), 4))
+
+    if not any(raw):
+        host = '*'
+    elif family == 'IPv6':
+        host = f"[{socket.inet_ntop(socket.AF_INET6, raw)}]"
+    else:
+        host = socket.inet_ntop(socket.AF_INET, raw)
+
+    return host, port
+
+def read_socket_table(proc_root, table, filters=None, inodes=None):
+    """Read one /proc/net table and return {inode: (node, type, name)}
+
+    filters may hold 'port' and 'state' (see collection_filters()) and
+    inodes restricts the result to a set of socket inodes; rows that do not
+    match are dropped before their addresses are decoded.
+    """
+    node, type_field = PROC_NET_TABLES[table]
+    filters = filters or {}
+    # Match the raw hex columns so filtered-out rows cost one comparison
+    port_hex = f":{filters['port']:04X}" if 'port' in filters else None
+    state_code = STATE_CODES.get(filters['state'], filters['state']) if 'state' in filters else None
+    sockets = {}
+
+    try:
+        with open(os.path.join(proc_root, 'net', table), 'r') as f:
+            next(f, None)  # Skip header line
+            for line in f:
+                parts = line.split()
+                if len(parts) < 10:
+                    continue
+
+                inode = parts[9]
+                # Sockets without an inode (e.g. TIME_WAIT) have no owning process
+                if inode == '0' or (inodes is not None and inode not in inodes):
+                    continue
+                if port_hex and not (parts[1].endswith(port_hex) or parts[2].endswith(port_hex)):
+                    continue
+                if state_code and parts[3] != state_code:
+                    continue
+
+                local_host, local_port = decode_address(parts[1], type_field)
+                remote_host, remote_port = decode_address(parts[2], type_field)
+                name = f"{local_host}:{local_port}"
+
+                if node == 'TCP':
+                    state = TCP_STATES.get(parts[3], parts[3])
+                    if remote_port:
+                        name += f"->{remote_host}:{remote_port}"
+                    name += f" ({state})"
+                elif remote_port:
+                    # Connected UDP socket
+                    name += f"->{remote_host}:{remote_port}"
+
+                sockets[inode] = (node, type_field, name)
+    except FileNotFoundError:
+        pass
+
+    return sockets
+
+def iter_socket_owners(proc_root, inodes, pid=None, uid=None):
+    """Yield (pid, fd, inode) for every process fd that refers to a known socket
+
+    With pid only that process is looked at; with uid only processes owned
+    by that user have their fd directory listed. inodes=None yields every
+    socket fd.
+    """
+    if pid is not None:
+        pids = [str(pid)]
+    else:
+        # lsof lists processes in pid order
+        pids = sorted((entry for entry in os.listdir(proc_root) if entry.isdigit()), key=int)
+    for entry in pids:
+        if uid is not None:
+            try:
+                if os.stat(os.path.join(proc_root, entry)).st_uid != uid:
+                    continue
+            except OSError:
+                continue
+
+        fd_dir = os.path.join(proc_root, entry, 'fd')
+        try:
+            fds = os.listdir(fd_dir)
+        except OSError:
+            # Process exited or we lack permission to look at it
+            continue
+
+        for fd in sorted(fds, key=int):
+            try:
+                target = os.readlink(os.path.join(fd_dir, fd))
+            except OSError:
+                continue
+
+            if target.startswith('socket:['):
+                inode = target[8:-1]
+                if inodes is None or inode in inodes:
+                    yield entry, fd, inode
+
+def read_process_info(proc_root, pid, user_cache):
+    """Return (command, user) for a pid the way lsof prints them"""
+    try:
+        with open(os.path.join(proc_root, pid, 'comm'), 'r') as f:
+            command = f.read().strip()[:LSOF_COMMAND_WIDTH]
+    except OSError:
+        command = '?'
+
+    try:
+        uid = os.stat(os.path.join(proc_root, pid)).st_uid
+    except OSError:
+        return command, '?'
+
+    user = user_cache.get(uid)
+    if user is None:
+        try:
+            user = pwd.getpwuid(uid).pw_name
+        except KeyError:
+            user = str(uid)
+        user_cache[uid] = user
+
+    return command, user
+
+def get_proc_connections(proc_root='/proc', filters=None):
+    """Yield connection dictionaries read from /proc, like parse_lsof_line() returns
+
+    filters (see collection_filters()) are applied while reading: only the
+    matching protocol's tables are opened, port and state are checked on the
+    raw table rows, and only the matching pid's or user's fd directories are
+    walked. Nothing is walked at all when no socket is left.
+    """
+    if proc_root == '/proc':
+        warn_if_not_root()
+    filters = filters or {}
+
+    # For one process its own few sockets are cheaper to find first than the whole tables are to decode
+    owned = None
+    if 'pid' in filters:
+        owned = {inode for _, _, inode in iter_socket_owners(proc_root, None, filters['pid'])}
+        if not owned:
+            return
+
+    sockets = {}
+    for table, (node, _) in PROC_NET_TABLES.items():
+        if filters.get('protocol', node) == node:
+            sockets.update(read_socket_table(proc_root, table, filters, owned))
+    if not sockets:
+        return
+
+    uid = None
+    if 'user' in filters:
+        try:
+            uid = pwd.getpwnam(filters['user']).pw_uid
+        except KeyError:
+            if not filters['user'].isdigit():
+                return
+            uid = int(filters['user'])
+
+    process_info = {}
+    user_cache = {}
+    for pid, fd, inode in iter_socket_owners(proc_root, sockets, filters.get('pid'), uid):
+        info = process_info.get(pid)
+        if info is None:
+            info = process_info[pid] = read_process_info(proc_root, pid, user_cache)
+
+        node, type_field, name = sockets[inode]
+        # lsof shows the socket inode in the DEVICE column; sockets are always opened read/write
+        yield build_connection(info[0], pid, info[1], f"{fd}u", type_field, inode, '0t0', node, name)
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Filter, group and count parsed lsof connections
+Usage: python3 lsof_parser_v2.py --where state=ESTABLISHED --group-by user [--top N] [--count]
+
+    from lsof_query import ConnectionIndex
+    index = ConnectionIndex(connections)
+    index.filter(state='LISTEN', local_port=443)
+    index.top('remote_host', 10, state='ESTABLISHED')
+
+Hash indexes on pid, user, state, protocol and remote host are built the
+first time a field is queried and reused afterwards, so repeated queries in
+one session do not rescan the table.
+"""
+
+from lsof_parser_v2 import split_endpoint
+
+# Fields that get a value -> row numbers index
+INDEXED_FIELDS = ('pid', 'user', 'state', 'protocol', 'remote_host')
+
+# Fields computed from the address strings when the records do not carry them
+ENDPOINT_SOURCES = {
+    'local_host': ('local_address', 0),
+    'local_port': ('local_address', 1),
+    'remote_host': ('remote_address', 0),
+    'remote_port': ('remote_address', 1),
+}
+
+def field_value(connection, field):
+    """Return a field of a connection, deriving endpoint fields from the addresses"""
+    if field in connection:
+        return connection[field]
+    if field in ENDPOINT_SOURCES:
+        source, part = ENDPOINT_SOURCES[field]
+        return split_endpoint(connection[source])[part]
+    raise KeyError(f"Unknown connection field: {field}")
+
+def parse_condition(condition):
+    """Parse a FIELD=VALUE command line condition; numeric values become integers"""
+    field, sep, value = condition.partition('=')
+    if not sep or not field:
+        raise ValueError(f"Expected FIELD=VALUE, got: {condition}")
+    return field, int(value) if value.isdigit() else value
+
+class ConnectionIndex:
+    """Query layer over a list (or ConnectionTable) of parsed connections"""
+
+    def __init__(self, connections):
+        self.connections = connections if hasattr(connections, '__getitem__') else list(connections)
+        self._indexes = {}
+
+    def __len__(self):
+        return len(self.connections)
+
+    def index(self, field):
+        """Return the {value: [row numbers]} index for field, building it on first use"""
+        index = self._indexes.get(field)
+        if index is None:
+            # Built aside and published whole, so a concurrent reader never sees it half filled
+            index = {}
+            for row, connection in enumerate(self.connections):
+                index.setdefault(field_value(connection, field), []).append(row)
+            self._indexes[field] = index
+        return index
+
+    def _rows(self, criteria):
+        """Return the sorted row numbers matching every field=value criterion"""
+        indexed = [(field, value) for field, value in criteria.items() if field in INDEXED_FIELDS]
+        scanned = [(field, value) for field, value in criteria.items() if field not in INDEXED_FIELDS]
+
+        if indexed:
+            # Intersect from the smallest candidate list
+            candidates = sorted((self.index(field).get(value, []) for field, value in indexed), key=len)
+            rows = set(candidates[0])
+            for other in candidates[1:]:
+                rows.intersection_update(other)
+            rows = sorted(rows)
+        else:
+            rows = range(len(self.connections))
+
+        if scanned:
+            rows = [row for row in rows
+                    if all(field_value(self.connections[row], field) == value for field, value in scanned)]
+        return rows
+
+    def filter(self, **criteria):
+        """Return the connections matching every field=value criterion"""
+        return [self.connections[row] for row in self._rows(criteria)]
+
+    def count(self, **criteria):
+        """Count the connections matching every field=value criterion"""
+        if not criteria:
+            return len(self.connections)
+        return len(self._rows(criteria))
+
+    def group_by(self, field, **criteria):
+        """Return {value of field: connection count} over the matching connections"""
+        if not criteria and field in INDEXED_FIELDS:
+            return {value: len(rows) for value, rows in self.index(field).items()}
+
+        counts = {}
+        for row in self._rows(criteria):
+            value = field_value(self.connections[row], field)
+            counts[value] = counts.get(value, 0) + 1
+        return counts
+
+    def top(self, field, n=10, **criteria):
+        """Return the n most common values of field as [(value, count), ...]"""
+        counts = self.group_by(field, **criteria)
+        return sorted(counts.items(), key=lambda item: (-item[1], str(item[0])))[:n]
+
+def run_query(connections, conditions=(), group_by=None, top=None, count=False):
+    """Run a query built from command line options and return a JSON-serialisable result
+
+    connections may be a ConnectionIndex, whose indexes are then reused.
+    """
+    index = connections if isinstance(connections, ConnectionIndex) else ConnectionIndex(connections)
+    criteria = dict(parse_condition(condition) for condition in conditions)
+
+    if group_by:
+        groups = index.top(group_by, top if top else len(index), **criteria)
+        return [{group_by: value, 'count': number} for value, number in groups]
+    if count:
+        return {'count': index.count(**criteria)}
+
+    matches = index.filter(**criteria)
+    return matches[:top] if top else matches
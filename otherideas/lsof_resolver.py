@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+Resolve peer addresses and ports of parsed connections in-process
+Usage: python3 lsof_parser_v2.py --resolve [--resolve-deadline 2.0] [--resolve-ttl 300]
+
+lsof is run with -n -P so it never waits on DNS itself. Afterwards every
+distinct remote host is looked up concurrently in a thread pool; whatever has
+not answered by the deadline is left unresolved for this snapshot while the
+lookup carries on in the background, is not waited on again and lands in the
+cache for a later snapshot.
+Answers (including failures) are kept in an LRU cache with a TTL.
+
+The lookup function is a parameter, so a stub can stand in for DNS:
+
+    resolver = Resolver(lookup={'10.0.0.5': 'db1.internal'}.get)
+"""
+
+import time
+import socket
+import queue
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, wait
+
+from lsof_parser_v2 import split_endpoint
+
+# Fields added to each connection by resolve_connections()
+RESOLVED_FIELDS = ('remote_name', 'local_service', 'remote_service')
+
+def reverse_lookup(address):
+    """Return the PTR name of an address, or None if it has none"""
+    try:
+        return socket.gethostbyaddr(address)[0]
+    except (socket.herror, socket.gaierror, OSError):
+        return None
+
+class TTLCache:
+    """Least recently used cache whose entries also expire after ttl seconds"""
+
+    def __init__(self, maxsize=4096, ttl=300.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return (found, value) for key"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return False, None
+            value, expires = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                return False, None
+            self._entries.move_to_end(key)
+            return True, value
+
+    def put(self, key, value):
+        """Store value for key, evicting the least recently used entry when full"""
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+class Resolver:
+    """Concurrent, cached reverse lookups bounded by a per-call deadline"""
+
+    def __init__(self, lookup=reverse_lookup, deadline=2.0, ttl=300.0, cache_size=4096, workers=32):
+        self.lookup = lookup
+        self.deadline = deadline
+        self.cache = TTLCache(cache_size, ttl)
+        self._queue = queue.Queue()
+        self._pending = {}
+        self._lock = threading.Lock()
+        # Daemon threads, unlike a ThreadPoolExecutor's, do not hold up interpreter exit on a hung lookup
+        for number in range(workers):
+            threading.Thread(target=self._work, name=f"resolver-{number}", daemon=True).start()
+
+    def _work(self):
+        """Run queued lookups until the process exits"""
+        while True:
+            address, future = self._queue.get()
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(self.lookup(address))
+            except Exception as e:
+                future.set_exception(e)
+
+    def _finish(self, address, future):
+        """Cache the answer of a finished lookup"""
+        try:
+            self.cache.put(address, future.result())
+        except Exception:
+            self.cache.put(address, None)
+        with self._lock:
+            self._pending.pop(address, None)
+
+    def resolve(self, addresses):
+        """Return {address: name or None}, waiting at most self.deadline for uncached addresses"""
+        names = {}
+        futures = {}
+        for address in set(addresses):
+            found, name = self.cache.get(address)
+            if found:
+                names[address] = name
+                continue
+            with self._lock:
+                # A lookup that already missed an earlier deadline is neither repeated nor waited on again
+                if address in self._pending:
+                    names[address] = None
+                    continue
+                future = self._pending[address] = Future()
+            future.add_done_callback(lambda f, address=address: self._finish(address, f))
+            self._queue.put((address, future))
+            futures[future] = address
+
+        if futures:
+            done, _ = wait(futures, timeout=self.deadline)
+            for future, address in futures.items():
+                names[address] = future.result() if future in done and not future.exception() else None
+        return names
+
+_service_names = {}
+
+def service_name(port, protocol):
+    """Return the /etc/services name of a port, or None"""
+    key = (port, protocol)
+    if key not in _service_names:
+        try:
+            _service_names[key] = socket.getservbyport(port, protocol.lower())
+        except (OSError, TypeError):
+            _service_names[key] = None
+    return _service_names[key]
+
+def resolve_connections(connections, resolver):
+    """Return the connections as a list with remote_name, local_service and remote_service added"""
+    connections = list(connections)
+    remote_hosts = {}
+    for connection in connections:
+        if connection['remote_address']:
+            host = split_endpoint(connection['remote_address'])[0]
+            if host and host != '*':
+                remote_hosts[connection['remote_address']] = host
+
+    names = resolver.resolve(remote_hosts.values())
+    for connection in connections:
+        protocol = connection['protocol'] or ''
+        local_port = split_endpoint(connection['local_address'])[1] if connection['local_address'] else None
+        remote_port = split_endpoint(connection['remote_address'])[1] if connection['remote_address'] else None
+        connection['remote_name'] = names.get(remote_hosts.get(connection['remote_address']))
+        connection['local_service'] = service_name(local_port, protocol) if isinstance(local_port, int) else None
+        connection['remote_service'] = service_name(remote_port, protocol) if isinstance(remote_port, int) else None
+    return connections
+
+_resolvers = {}
+
+def shared_resolver(deadline=2.0, ttl=300.0):
+    """Return one Resolver per setting so --watch and the exporter keep their cache between snapshots"""
+    key = (deadline, ttl)
+    if key not in _resolvers:
+        _resolvers[key] = Resolver(deadline=deadline, ttl=ttl)
+    return _resolvers[key]
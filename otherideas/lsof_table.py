@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+Compact columnar storage for parsed lsof connections
+
+A ConnectionTable keeps one array of small integer codes per field instead of
+one dictionary per connection. Values that repeat across sockets (command,
+user, state, addresses, ...) are dictionary-encoded so each distinct string
+is stored once. Rows are handed back as the same dictionaries that
+parse_lsof_line() returns, so JSON output is unchanged.
+"""
+
+from array import array
+
+# Fields stored as codes into a per-field list of distinct values
+ENCODED_FIELDS = (
+    'command', 'pid', 'user', 'fd', 'type', 'size_off', 'node',
+    'protocol', 'local_address', 'remote_address', 'state',
+)
+
+# Order of the keys in a connection dictionary
+FIELDS = (
+    'command', 'pid', 'user', 'fd', 'type', 'device', 'size_off', 'node',
+    'protocol', 'local_address', 'remote_address', 'state', 'raw_name',
+)
+
+def rebuild_name(local_address, remote_address, state):
+    """Rebuild the lsof NAME column from the parsed address fields"""
+    if local_address is None:
+        return ''
+    name = local_address
+    if remote_address is not None:
+        name += f"->{remote_address}"
+    if state is not None:
+        name += f" ({state})"
+    return name
+
+class ConnectionTable:
+    """Dictionary-encoded column store of connection records"""
+
+    def __init__(self, connections=(), extra_fields=()):
+        # Extra fields (e.g. the structured endpoint fields) are encoded and returned after the usual ones
+        self._encoded_fields = ENCODED_FIELDS + tuple(extra_fields)
+        self._row_fields = FIELDS + tuple(extra_fields)
+        self._values = {field: [] for field in self._encoded_fields}
+        self._codes = {field: {} for field in self._encoded_fields}
+        self._columns = {field: array('I') for field in self._encoded_fields}
+        # Socket inodes are unique per row, so they are kept as plain integers
+        self._devices = array('Q')
+        self._odd_devices = {}
+        # NAME is rebuilt from the address fields; only rows where that differs keep their own copy
+        self._raw_names = {}
+        self.extend(connections)
+
+    def __len__(self):
+        return len(self._devices)
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def __getitem__(self, index):
+        """Return row index as a connection dictionary"""
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("connection index out of range")
+
+        row = {field: self._values[field][self._columns[field][index]] for field in self._encoded_fields}
+        row['device'] = self._odd_devices[index] if index in self._odd_devices else str(self._devices[index])
+        row['raw_name'] = self._raw_names.get(index)
+        if row['raw_name'] is None:
+            row['raw_name'] = rebuild_name(row['local_address'], row['remote_address'], row['state'])
+        return {field: row[field] for field in self._row_fields}
+
+    def _encode(self, field, value):
+        """Return the code for value in field, adding it to the dictionary if new"""
+        codes = self._codes[field]
+        code = codes.get(value)
+        if code is None:
+            code = codes[value] = len(self._values[field])
+            self._values[field].append(value)
+        return code
+
+    def append(self, connection):
+        """Add one connection dictionary to the table"""
+        index = len(self)
+
+        for field in self._encoded_fields:
+            self._columns[field].append(self._encode(field, connection[field]))
+
+        device = connection['device']
+        if device.isdigit() and str(int(device)) == device:
+            self._devices.append(int(device))
+        else:
+            self._devices.append(0)
+            self._odd_devices[index] = device
+
+        raw_name = connection['raw_name']
+        if raw_name != rebuild_name(connection['local_address'], connection['remote_address'], connection['state']):
+            self._raw_names[index] = raw_name
+
+    def extend(self, connections):
+        """Add every connection dictionary from an iterable"""
+        for connection in connections:
+            self.append(connection)
+
+    def column(self, field):
+        """Yield the decoded values of one field in row order"""
+        if field in self._columns:
+            values = self._values[field]
+            for code in self._columns[field]:
+                yield values[code]
+        else:
+            for row in self:
+                yield row[field]
+
+    def distinct(self, field):
+        """Return the distinct values seen for a dictionary-encoded field"""
+        return list(self._values[field])
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Tests for lsof_daemon's query server on a temporary Unix socket
+Usage: python3 -m pytest otherideas/test_lsof_daemon.py   (or python3 -m unittest test_lsof_daemon)
+"""
+
+import os
+import json
+import socket
+import tempfile
+import threading
+import unittest
+
+from lsof_parser_v2 import parse_lsof_line
+from lsof_daemon import QueryHandler, QueryServer, SnapshotHolder, serve_daemon
+
+LINES = [
+    "curl 4242 app 5u IPv4 123 0t0 TCP 10.0.0.1:50000->10.1.2.3:443 (ESTABLISHED)",
+    "nginx 100 www 6u IPv4 124 0t0 TCP *:443 (LISTEN)",
+]
+
+class QueryServerTest(unittest.TestCase):
+
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.socket_path = os.path.join(temp_dir.name, 'lsof.sock')
+
+        holder = SnapshotHolder(lambda: [parse_lsof_line(line) for line in LINES], refresh=60)
+        holder.update()
+        server = QueryServer(self.socket_path, QueryHandler)
+        server.holder = holder
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+
+    def send(self, *requests):
+        """Send requests on one connection and return the decoded reply lines"""
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+            client.settimeout(5)
+            client.connect(self.socket_path)
+            with client.makefile('rwb') as stream:
+                replies = []
+                for request in requests:
+                    stream.write(json.dumps(request).encode('utf-8') + b'\n')
+                    stream.flush()
+                    replies.append(json.loads(stream.readline()))
+                return replies
+
+    def test_query(self):
+        (reply,) = self.send({'where': ['state=LISTEN'], 'count': True})
+        self.assertEqual(reply['result'], {'count': 1})
+
+    def test_wrong_types_get_an_error_and_keep_the_connection(self):
+        bad = [{'where': [1]}, {'where': 'state=LISTEN'}, {'group_by': ['user']}, {'top': [1]}, {'count': 'yes'}]
+        replies = self.send(*bad, {'count': True})
+        for request, reply in zip(bad, replies):
+            self.assertEqual(list(reply), ['error'], request)
+        self.assertEqual(replies[-1]['result'], {'count': 2})
+
+class ServeDaemonTest(unittest.TestCase):
+
+    def test_refuses_to_remove_a_file_that_is_not_a_socket(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, 'lsof.sock')
+            with open(path, 'w') as f:
+                f.write('keep\n')
+
+            collected = []
+            with self.assertRaises(SystemExit):
+                serve_daemon(lambda: collected.append(True) or [], path)
+            self.assertEqual(collected, [])
+            with open(path) as f:
+                self.assertEqual(f.read(), 'keep\n')
+
+if __name__ == "__main__":
+    unittest.main()
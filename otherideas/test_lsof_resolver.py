@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+Tests for lsof_resolver with a stub lookup in place of DNS
+Usage: python3 -m pytest otherideas/test_lsof_resolver.py   (or python3 -m unittest test_lsof_resolver)
+"""
+
+import time
+import threading
+import unittest
+from unittest import mock
+
+from lsof_parser_v2 import parse_lsof_line
+from lsof_resolver import Resolver, TTLCache, resolve_connections
+
+class StubLookup:
+    """Reverse lookup answering from a dictionary, counting calls and optionally blocking until released"""
+
+    def __init__(self, names, block=False):
+        self.names = names
+        self.calls = []
+        self.released = threading.Event()
+        if not block:
+            self.released.set()
+
+    def __call__(self, address):
+        self.calls.append(address)
+        self.released.wait(5)
+        if address == 'raise':
+            raise OSError("lookup failed")
+        return self.names.get(address)
+
+def wait_until(condition, timeout=2.0):
+    """Poll condition() until it is true or timeout passes"""
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.005)
+    return condition()
+
+class TTLCacheTest(unittest.TestCase):
+
+    def test_entries_expire_after_ttl(self):
+        cache = TTLCache(ttl=10)
+        with mock.patch('lsof_resolver.time.monotonic', return_value=100.0):
+            cache.put('10.0.0.5', 'db1.internal')
+        with mock.patch('lsof_resolver.time.monotonic', return_value=109.0):
+            self.assertEqual(cache.get('10.0.0.5'), (True, 'db1.internal'))
+        with mock.patch('lsof_resolver.time.monotonic', return_value=111.0):
+            self.assertEqual(cache.get('10.0.0.5'), (False, None))
+        self.assertEqual(len(cache), 0)
+
+    def test_least_recently_used_entry_is_evicted(self):
+        cache = TTLCache(maxsize=2)
+        cache.put('a', 'a.example')
+        cache.put('b', 'b.example')
+        cache.get('a')
+        cache.put('c', 'c.example')
+        self.assertEqual(cache.get('b'), (False, None))
+        self.assertEqual(cache.get('a'), (True, 'a.example'))
+        self.assertEqual(cache.get('c'), (True, 'c.example'))
+
+class ResolverTest(unittest.TestCase):
+
+    def test_answers_are_cached(self):
+        lookup = StubLookup({'10.0.0.5': 'db1.internal'})
+        resolver = Resolver(lookup=lookup, deadline=1.0, workers=2)
+        self.assertEqual(resolver.resolve(['10.0.0.5']), {'10.0.0.5': 'db1.internal'})
+        self.assertTrue(wait_until(lambda: len(resolver.cache) == 1))
+        self.assertEqual(resolver.resolve(['10.0.0.5']), {'10.0.0.5': 'db1.internal'})
+        self.assertEqual(lookup.calls, ['10.0.0.5'])
+
+    def test_negative_answers_are_cached(self):
+        lookup = StubLookup({})
+        resolver = Resolver(lookup=lookup, deadline=1.0, workers=2)
+        self.assertEqual(resolver.resolve(['10.0.0.9', 'raise']), {'10.0.0.9': None, 'raise': None})
+        self.assertTrue(wait_until(lambda: len(resolver.cache) == 2))
+        self.assertEqual(resolver.resolve(['10.0.0.9', 'raise']), {'10.0.0.9': None, 'raise': None})
+        self.assertEqual(sorted(lookup.calls), ['10.0.0.9', 'raise'])
+
+    def test_expired_answers_are_looked_up_again(self):
+        lookup = StubLookup({'10.0.0.5': 'db1.internal'})
+        resolver = Resolver(lookup=lookup, deadline=1.0, ttl=10, workers=2)
+        with mock.patch('lsof_resolver.time.monotonic', return_value=100.0):
+            resolver.resolve(['10.0.0.5'])
+            self.assertTrue(wait_until(lambda: len(resolver.cache) == 1))
+        with mock.patch('lsof_resolver.time.monotonic', return_value=111.0):
+            resolver.resolve(['10.0.0.5'])
+        self.assertEqual(lookup.calls, ['10.0.0.5', '10.0.0.5'])
+
+    def test_in_flight_lookups_are_not_repeated(self):
+        lookup = StubLookup({'10.0.0.5': 'db1.internal'}, block=True)
+        resolver = Resolver(lookup=lookup, deadline=0.05, workers=4)
+        self.assertEqual(resolver.resolve(['10.0.0.5', '10.0.0.5']), {'10.0.0.5': None})
+        self.assertEqual(resolver.resolve(['10.0.0.5']), {'10.0.0.5': None})
+        self.assertEqual(lookup.calls, ['10.0.0.5'])
+
+        # The lookup that missed the deadline still lands in the cache for the next call
+        lookup.released.set()
+        self.assertTrue(wait_until(lambda: len(resolver.cache) == 1))
+        self.assertEqual(resolver.resolve(['10.0.0.5']), {'10.0.0.5': 'db1.internal'})
+        self.assertEqual(lookup.calls, ['10.0.0.5'])
+
+    def test_deadline_leaves_connections_numeric(self):
+        lookup = StubLookup({'10.1.2.3': 'slow.example'}, block=True)
+        resolver = Resolver(lookup=lookup, deadline=0.1, workers=2)
+        connections = [parse_lsof_line("curl 4242 app 5u IPv4 123 0t0 TCP 10.0.0.1:50000->10.1.2.3:443 (ESTABLISHED)")]
+
+        start = time.monotonic()
+        resolved = resolve_connections(connections, resolver)
+        elapsed = time.monotonic() - start
+        lookup.released.set()
+
+        self.assertLess(elapsed, 1.0)
+        self.assertIsNone(resolved[0]['remote_name'])
+        self.assertEqual(resolved[0]['remote_address'], '10.1.2.3:443')
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Certificate Information
+
+Reads the expiry date and DNS names of a PEM certificate without starting
+openssl: the first certificate of the file is decoded as DER and only the
+validity and subjectAltName fields are walked.
+
+Usage: python3 cert_info.py path/to/fullchain.pem
+"""
+
+import sys
+import base64
+from datetime import datetime, timezone
+
+# DER encoding of the subjectAltName extension OID (2.5.29.17)
+SUBJECT_ALT_NAME_OID = bytes.fromhex('0603551d11')
+
+
+def _read_tlv(data, offset):
+    """Return (tag, value start, value end) of the DER element at offset"""
+    tag = data[offset]
+    length = data[offset + 1]
+    offset += 2
+    if length & 0x80:
+        size = length & 0x7f
+        length = int.from_bytes(data[offset:offset + size], 'big')
+        offset += size
+    return tag, offset, offset + length
+
+
+def _children(data, start, end):
+    """Yield (tag, value start, value end) for each element inside a constructed value"""
+    offset = start
+    while offset < end:
+        tag, value_start, value_end = _read_tlv(data, offset)
+        yield tag, value_start, value_end
+        offset = value_end
+
+
+def _parse_time(tag, value):
+    """Parse a DER UTCTime (0x17) or GeneralizedTime (0x18)"""
+    text = value.decode('ascii').rstrip('Z')
+    if tag == 0x17:
+        # Two-digit years: 50-99 are 19xx, 00-49 are 20xx (RFC 5280)
+        year = int(text[:2])
+        text = f"{19 if year >= 50 else 20}{text}"
+    return datetime.strptime(text[:14], '%Y%m%d%H%M%S').replace(tzinfo=timezone.utc)
+
+
+def read_pem_certificate(path):
+    """Return the DER bytes of the first certificate in a PEM file"""
+    with open(path, 'r') as f:
+        pem = f.read()
+    begin = pem.index('-----BEGIN CERTIFICATE-----') + len('-----BEGIN CERTIFICATE-----')
+    end = pem.index('-----END CERTIFICATE-----', begin)
+    return base64.b64decode(''.join(pem[begin:end].split()))
+
+
+def certificate_info(path):
+    """Return (not_after, dns_names) of the first certificate in a PEM file"""
+    der = read_pem_certificate(path)
+    _, cert_start, cert_end = _read_tlv(der, 0)
+    _, tbs_start, tbs_end = next(_children(der, cert_start, cert_end))
+    fields = list(_children(der, tbs_start, tbs_end))
+
+    # The version field is optional; without it validity moves up by one
+    if fields[0][0] == 0xa0:
+        fields = fields[1:]
+    _, validity_start, validity_end = fields[3]
+    (_, _, _), (after_tag, after_start, after_end) = _children(der, validity_start, validity_end)
+    not_after = _parse_time(after_tag, der[after_start:after_end])
+
+    dns_names = []
+    for tag, start, end in fields:
+        if tag != 0xa3:
+            continue
+        _, extensions_start, extensions_end = _read_tlv(der, start)
+        for _, ext_start, ext_end in _children(der, extensions_start, extensions_end):
+            if der[ext_start:ext_start + len(SUBJECT_ALT_NAME_OID)] != SUBJECT_ALT_NAME_OID:
+                continue
+            # The value is the last element: an OCTET STRING wrapping a SEQUENCE of GeneralNames
+            *_, (_, value_start, value_end) = _children(der, ext_start, ext_end)
+            _, names_start, names_end = _read_tlv(der, value_start)
+            for name_tag, name_start, name_end in _children(der, names_start, names_end):
+                if name_tag == 0x82:  # dNSName
+                    dns_names.append(der[name_start:name_end].decode('ascii'))
+
+    return not_after, dns_names
+
+
+def days_remaining(path, now=None):
+    """Return the days left until the certificate in path expires"""
+    not_after, _ = certificate_info(path)
+    now = now or datetime.now(timezone.utc)
+    return (not_after - now).total_seconds() / 86400
+
+
+def main():
+    """Print the expiry date and names of a certificate"""
+    if len(sys.argv) != 2:
+        print("Usage: python3 cert_info.py path/to/fullchain.pem", file=sys.stderr)
+        sys.exit(1)
+
+    not_after, dns_names = certificate_info(sys.argv[1])
+    print(f"notAfter: {not_after.isoformat()}")
+    print(f"Days remaining: {days_remaining(sys.argv[1]):.1f}")
+    print(f"DNS names: {', '.join(dns_names)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Certbot Launcher
+
+Runs Certbot inside its virtual environment with the DNS plugins' fixed
+propagation sleep replaced by an active check: once the _acme-challenge TXT
+records are created, the zone's authoritative nameservers are polled
+(dns_propagation.wait_for_txt) and validation starts as soon as all of them
+serve the records. If the nameservers cannot be found, the plugin's
+configured propagation seconds are slept as before. With --timings, the
+time spent waiting is appended to a file as a JSON line.
+
+Usage: ~/certbot-venv/bin/python certbot_launcher.py [--deadline 300] [--nameserver IP[:PORT]] [--timings FILE] -- certonly ...
+"""
+
+import sys
+import json
+import time
+import logging
+import argparse
+
+from dns_propagation import wait_for_txt, parse_server
+
+logger = logging.getLogger('certbot_launcher')
+
+
+def install_propagation_check(deadline, nameservers=None, timings=None):
+    """Patch Certbot's DNSAuthenticator to poll for the TXT records instead of sleeping
+
+    Returns False if Certbot's DNS plugin base class cannot be imported.
+    """
+    try:
+        from certbot.plugins import dns_common
+    except ImportError:
+        return False
+
+    original_perform = dns_common.DNSAuthenticator.perform
+    real_sleep = time.sleep
+
+    def perform(self, achalls):
+        records = []
+        perform_one = self._perform
+
+        def recording(domain, validation_name, validation):
+            records.append((validation_name, validation))
+            return perform_one(domain, validation_name, validation)
+
+        def wait(seconds):
+            servers = {name: nameservers for name, _ in records} if nameservers else None
+            start, started = time.time(), time.monotonic()
+            try:
+                outcome = 'ok'
+                if not wait_for_txt(records, servers, deadline, log=logger.info, sleep=real_sleep):
+                    outcome = 'timeout'
+                    logger.warning("Continuing with validation although DNS propagation was not confirmed")
+            except (LookupError, OSError) as e:
+                outcome = 'fallback'
+                logger.warning(f"DNS propagation check unavailable ({e}) - waiting {seconds} seconds instead")
+                real_sleep(seconds)
+            if timings:
+                span = {'phase': 'dns_propagation', 'start': start,
+                        'duration': time.monotonic() - started, 'outcome': outcome}
+                with open(timings, 'a') as f:
+                    f.write(json.dumps(span) + '\n')
+
+        # dns_common either imports sleep by name or calls time.sleep
+        target, attribute = (dns_common, 'sleep') if hasattr(dns_common, 'sleep') else (time, 'sleep')
+        self._perform = recording
+        setattr(target, attribute, wait)
+        try:
+            return original_perform(self, achalls)
+        finally:
+            setattr(target, attribute, real_sleep)
+            del self._perform
+
+    dns_common.DNSAuthenticator.perform = perform
+    return True
+
+
+def main():
+    """Install the propagation check and hand the remaining arguments to Certbot"""
+    argv = sys.argv[1:]
+    certbot_args = []
+    if '--' in argv:
+        split = argv.index('--')
+        argv, certbot_args = argv[:split], argv[split + 1:]
+
+    parser = argparse.ArgumentParser(description="Run Certbot with active DNS propagation checks",
+                                     usage="%(prog)s [options] -- CERTBOT_ARGS")
+    parser.add_argument('--deadline', type=float, default=300.0,
+                        help="seconds to wait for the TXT records before validating anyway (default: %(default)s)")
+    parser.add_argument('--nameserver', action='append', type=parse_server, metavar='IP[:PORT]',
+                        help="nameserver to poll instead of the zone's NS records (repeatable)")
+    parser.add_argument('--timings', metavar='FILE', help="append the propagation wait to FILE as a JSON line")
+    args = parser.parse_args(argv)
+
+    if not install_propagation_check(args.deadline, args.nameserver, args.timings):
+        print("Warning: Certbot DNS plugins not found - using their fixed propagation delay", file=sys.stderr)
+
+    from certbot.main import main as certbot_main
+    sys.exit(certbot_main(certbot_args))
+
+
+if __name__ == "__main__":
+    main()
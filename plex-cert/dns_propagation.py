@@ -0,0 +1,306 @@
+#!/usr/bin/env python3
+"""
+DNS Propagation Check
+
+Waits until every authoritative nameserver of a zone answers the
+_acme-challenge TXT record with the expected value, polling with exponential
+backoff up to a deadline. Used by certbot_launcher.py in place of Certbot's
+fixed --dns-azure-propagation-seconds sleep.
+
+Only the standard library is used: queries are plain DNS over UDP, sent
+straight to the authoritative servers without recursion, so a cached answer
+from a resolver cannot make the record look present or missing.
+
+Usage: python3 dns_propagation.py check _acme-challenge.plex.example.com VALUE [--server IP[:PORT]]
+       python3 dns_propagation.py stub --port 5353 _acme-challenge.plex.example.com VALUE [--delay 5]
+"""
+
+import sys
+import time
+import random
+import socket
+import struct
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+TYPE_NS = 2
+TYPE_TXT = 16
+CLASS_IN = 1
+
+
+def encode_name(name):
+    """Encode a domain name as DNS labels"""
+    encoded = b''
+    for label in name.rstrip('.').split('.'):
+        encoded += bytes([len(label)]) + label.encode('ascii')
+    return encoded + b'\0'
+
+
+def build_query(name, rtype, recursion=True, query_id=None):
+    """Return (query id, wire format query) for one question"""
+    query_id = random.getrandbits(16) if query_id is None else query_id
+    flags = 0x0100 if recursion else 0
+    header = struct.pack('!HHHHHH', query_id, flags, 1, 0, 0, 0)
+    return query_id, header + encode_name(name) + struct.pack('!HH', rtype, CLASS_IN)
+
+
+def read_name(message, offset):
+    """Return (name, offset after the name), following compression pointers"""
+    labels = []
+    end = None
+    for _ in range(128):
+        length = message[offset]
+        if length & 0xc0 == 0xc0:
+            if end is None:
+                end = offset + 2
+            offset = ((length & 0x3f) << 8) | message[offset + 1]
+            continue
+        offset += 1
+        if length == 0:
+            break
+        labels.append(message[offset:offset + length].decode('ascii', errors='replace'))
+        offset += length
+    return '.'.join(labels), end if end is not None else offset
+
+
+def parse_response(message):
+    """Return (query id, rcode, [(section, name, type, data), ...]) of a DNS response
+
+    TXT data is the joined character strings, NS data the server name, other
+    types the raw rdata.
+    """
+    query_id, flags, questions, answers, authorities, additionals = struct.unpack('!HHHHHH', message[:12])
+    offset = 12
+    for _ in range(questions):
+        _, offset = read_name(message, offset)
+        offset += 4
+
+    records = []
+    for section, count in (('answer', answers), ('authority', authorities), ('additional', additionals)):
+        for _ in range(count):
+            name, offset = read_name(message, offset)
+            rtype, _, _, length = struct.unpack('!HHIH', message[offset:offset + 10])
+            offset += 10
+            rdata = message[offset:offset + length]
+            if rtype == TYPE_TXT:
+                strings, position = [], 0
+                while position < len(rdata):
+                    size = rdata[position]
+                    strings.append(rdata[position + 1:position + 1 + size].decode('utf-8', errors='replace'))
+                    position += 1 + size
+                data = ''.join(strings)
+            elif rtype == TYPE_NS:
+                data = read_name(message, offset)[0]
+            else:
+                data = rdata
+            records.append((section, name.lower(), rtype, data))
+            offset += length
+    return query_id, flags & 0xf, records
+
+
+def query(server, name, rtype, recursion=True, timeout=2.0):
+    """Send one UDP query to server ((host, port)) and return its parsed response"""
+    query_id, packet = build_query(name, rtype, recursion)
+    family = socket.AF_INET6 if ':' in server[0] else socket.AF_INET
+    with socket.socket(family, socket.SOCK_DGRAM) as sock:
+        sock.settimeout(timeout)
+        sock.sendto(packet, server)
+        while True:
+            message, _ = sock.recvfrom(4096)
+            response = parse_response(message)
+            # Ignore stray datagrams that do not answer this query
+            if response[0] == query_id:
+                return response
+
+
+def system_resolvers(path='/etc/resolv.conf'):
+    """Return the recursive resolvers from resolv.conf as (host, 53) pairs"""
+    servers = []
+    try:
+        with open(path, 'r') as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) >= 2 and parts[0] == 'nameserver':
+                    servers.append((parts[1].split('%')[0], 53))
+    except OSError:
+        pass
+    return servers or [('1.1.1.1', 53)]
+
+
+def find_authoritative_servers(name, resolvers=None, timeout=2.0):
+    """Return (zone, [(ip, 53), ...]) of the nameservers authoritative for name
+
+    Walks up from name until a recursive resolver returns NS records, then
+    resolves each server name to its addresses.
+    """
+    resolvers = resolvers or system_resolvers()
+    labels = name.rstrip('.').split('.')
+    for start in range(len(labels) - 1):
+        zone = '.'.join(labels[start:])
+        for resolver in resolvers:
+            try:
+                _, rcode, records = query(resolver, zone, TYPE_NS, timeout=timeout)
+            except OSError:
+                continue
+            ns_names = [data for section, owner, rtype, data in records
+                        if section == 'answer' and rtype == TYPE_NS and owner == zone.lower()]
+            if ns_names:
+                servers = []
+                for ns_name in ns_names:
+                    try:
+                        for info in socket.getaddrinfo(ns_name, 53, type=socket.SOCK_DGRAM):
+                            if (info[4][0], 53) not in servers:
+                                servers.append((info[4][0], 53))
+                    except socket.gaierror:
+                        continue
+                if not servers:
+                    raise LookupError(f"None of the {zone} nameservers resolve: {', '.join(ns_names)}")
+                return zone, servers
+            break
+    raise LookupError(f"No authoritative nameservers found for {name}")
+
+
+def txt_values(server, name, timeout=2.0):
+    """Return the TXT values a server holds for name, without recursion"""
+    _, _, records = query(server, name, TYPE_TXT, recursion=False, timeout=timeout)
+    return {data for section, owner, rtype, data in records
+            if section == 'answer' and rtype == TYPE_TXT and owner == name.rstrip('.').lower()}
+
+
+def wait_for_txt(records, servers=None, deadline=300.0, initial_delay=1.0, max_delay=15.0,
+                 log=print, sleep=time.sleep):
+    """Poll until every server returns every (name, value) TXT record, or the deadline passes
+
+    servers maps each name to its nameservers; by default they are looked up
+    with find_authoritative_servers(). Returns True once all servers agree
+    and False when the deadline is reached first. Raises LookupError when
+    there is no server to ask, so callers fall back to a fixed wait.
+    """
+    started = time.monotonic()
+    if servers is None:
+        servers = {}
+        for name, _ in records:
+            zone, servers[name] = find_authoritative_servers(name)
+            log(f"Checking {name} on the {zone} nameservers: {', '.join(host for host, _ in servers[name])}")
+
+    checks = [(name, value, server) for name, value in records for server in servers[name]]
+    if not checks:
+        raise LookupError("No nameservers to check for DNS propagation")
+    delay = initial_delay
+    with ThreadPoolExecutor(max_workers=min(16, max(1, len(checks)))) as executor:
+        while True:
+            def check(item):
+                name, value, server = item
+                try:
+                    return value in txt_values(server, name)
+                except OSError:
+                    return False
+
+            results = list(executor.map(check, checks))
+            waiting = [f"{name} @ {server[0]}" for (name, _, server), seen in zip(checks, results) if not seen]
+            elapsed = time.monotonic() - started
+            if not waiting:
+                log(f"TXT records visible on all {len(checks)} nameserver queries after {elapsed:.1f}s")
+                return True
+            if elapsed >= deadline:
+                log(f"Gave up waiting for DNS propagation after {elapsed:.1f}s, still missing: {', '.join(waiting)}")
+                return False
+
+            # The last wait is cut short so the final check happens right at the deadline
+            wait = min(delay, deadline - elapsed)
+            log(f"Waiting for DNS propagation ({len(waiting)} of {len(checks)} missing), retrying in {wait:.1f}s")
+            sleep(wait)
+            delay = min(delay * 2, max_delay)
+
+
+class StubDNSServer:
+    """Minimal authoritative UDP server answering TXT queries from a dictionary, for local testing"""
+
+    def __init__(self, records, host='127.0.0.1', port=0, delay=0.0):
+        self.records = {name.rstrip('.').lower(): value for name, value in records.items()}
+        self.delay = delay
+        self.started = time.monotonic()
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind((host, port))
+        self.address = self.sock.getsockname()
+
+    def answer(self, message):
+        """Build the response to one query"""
+        query_id = struct.unpack('!H', message[:2])[0]
+        name, offset = read_name(message, 12)
+        rtype = struct.unpack('!H', message[offset:offset + 2])[0]
+        question = message[12:offset + 4]
+
+        value = self.records.get(name.lower())
+        # Records "propagate" delay seconds after the server starts
+        visible = value is not None and time.monotonic() - self.started >= self.delay
+        answer = b''
+        if visible and rtype == TYPE_TXT:
+            data = value.encode()
+            rdata = bytes([len(data)]) + data
+            answer = b'\xc0\x0c' + struct.pack('!HHIH', TYPE_TXT, CLASS_IN, 60, len(rdata)) + rdata
+        header = struct.pack('!HHHHHH', query_id, 0x8400, 1, 1 if answer else 0, 0, 0)
+        return header + question + answer
+
+    def serve_forever(self):
+        while True:
+            message, client = self.sock.recvfrom(4096)
+            self.sock.sendto(self.answer(message), client)
+
+    def start(self):
+        """Serve on a daemon thread and return self"""
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+def parse_server(text):
+    """Parse IP or IP:PORT (IPv6 as [IP]:PORT)"""
+    if text.startswith('['):
+        host, _, port = text[1:].partition(']:')
+    elif text.count(':') == 1:
+        host, _, port = text.partition(':')
+    else:
+        host, port = text, ''
+    return host, int(port) if port else 53
+
+
+def main():
+    """Check a TXT record's propagation or run a stub server"""
+    parser = argparse.ArgumentParser(description="Wait for an _acme-challenge TXT record on the authoritative nameservers")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    check = commands.add_parser('check', help="poll until the record is visible")
+    check.add_argument('name')
+    check.add_argument('value')
+    check.add_argument('--server', action='append', type=parse_server, metavar='IP[:PORT]',
+                       help="nameserver to poll instead of the zone's NS records (repeatable)")
+    check.add_argument('--deadline', type=float, default=300.0, help="seconds before giving up (default: %(default)s)")
+
+    stub = commands.add_parser('stub', help="serve one TXT record locally for testing")
+    stub.add_argument('name')
+    stub.add_argument('value')
+    stub.add_argument('--port', type=int, default=5353)
+    stub.add_argument('--delay', type=float, default=0.0, help="seconds before the record becomes visible")
+    args = parser.parse_args()
+
+    if args.command == 'stub':
+        server = StubDNSServer({args.name: args.value}, port=args.port, delay=args.delay)
+        print(f"Serving {args.name} TXT on {server.address[0]}:{server.address[1]}", file=sys.stderr)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        return
+
+    servers = {args.name: args.server} if args.server else None
+    try:
+        found = wait_for_txt([(args.name, args.value)], servers, args.deadline)
+    except LookupError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
+    sys.exit(0 if found else 1)
+
+
+if __name__ == "__main__":
+    main()
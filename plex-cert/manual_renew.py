@@ -4,54 +4,27 @@ Manual Certificate Renewal Script
 
 This script guides you through manual certificate renewal when Azure DNS automation fails.
 It uses certbot with manual DNS challenge and helps convert to PFX format.
+
+The steps are checkpointed (see renew_pipeline.py): if the PFX conversion
+fails after the DNS challenge succeeded, running the script again only
+repeats the conversion.
 """
 
-import os
 import sys
-import json
 import subprocess
 import shutil
-import logging
-from pathlib import Path
-from datetime import datetime
+
+from pfx_export import x509 as cryptography_x509
+from renew_pipeline import CertRenewerBase
 
 
-class ManualCertRenewer:
+class ManualCertRenewer(CertRenewerBase):
+    log_prefix = "manual_renewal"
+    checkpoint_prefix = "manual-"
+    
     def __init__(self):
-        self.script_dir = Path(__file__).parent.absolute()
-        self.config_file = self.script_dir / "config" / "settings.json"
-        
-        # Setup logging
-        log_dir = self.script_dir / "logs"
-        log_dir.mkdir(exist_ok=True)
-        log_file = log_dir / f"manual_renewal_{datetime.now().strftime('%Y%m%d_%H%M%S')}.log"
-        
-        logging.basicConfig(
-            level=logging.INFO,
-            format='%(asctime)s - %(levelname)s - %(message)s',
-            handlers=[
-                logging.FileHandler(log_file),
-                logging.StreamHandler(sys.stdout)
-            ]
-        )
-        self.logger = logging.getLogger(__name__)
-        
-        # Load configuration
-        self.config = self._load_config()
-        
-    def _load_config(self):
-        """Load configuration from settings.json"""
-        try:
-            with open(self.config_file, 'r') as f:
-                config = json.load(f)
-            self.logger.info(f"Configuration loaded from {self.config_file}")
-            return config
-        except FileNotFoundError:
-            self.logger.error(f"Configuration file not found: {self.config_file}")
-            sys.exit(1)
-        except json.JSONDecodeError as e:
-            self.logger.error(f"Invalid JSON in configuration file: {e}")
-            sys.exit(1)
+        super().__init__()
+        self.manual_dir = self.script_dir / "certs" / "manual"
     
     def _check_prerequisites(self):
         """Check if all required dependencies exist"""
@@ -63,8 +36,8 @@ class ManualCertRenewer:
             self.logger.info("On Ubuntu/Debian: sudo apt install certbot")
             sys.exit(1)
         
-        # Check if OpenSSL is available
-        if not shutil.which('openssl'):
+        # OpenSSL is only needed when the cryptography package is not installed
+        if cryptography_x509 is None and not shutil.which('openssl'):
             self.logger.error("OpenSSL not found. Please install OpenSSL.")
             sys.exit(1)
         
@@ -77,25 +50,21 @@ class ManualCertRenewer:
         
         self.logger.info("Prerequisites check passed")
     
-    def _create_directories(self):
-        """Create necessary directories for certificates"""
-        directories = [
-            self.script_dir / "certs" / "manual" / "config",
-            self.script_dir / "certs" / "manual" / "work", 
-            self.script_dir / "certs" / "manual" / "logs"
-        ]
-        
-        for directory in directories:
-            directory.mkdir(parents=True, exist_ok=True)
-            self.logger.info(f"Created directory: {directory}")
+    def _directories(self):
+        """Return the directories Certbot uses for manual certificates"""
+        return [self.manual_dir / "config", self.manual_dir / "work", self.manual_dir / "logs"]
+    
+    def _live_dir(self, name):
+        return self.manual_dir / "config" / "live" / name
+    
+    def _pfx_path(self, name):
+        return self.script_dir / "certs" / f"{name}-manual.pfx"
     
     def _run_manual_certbot(self):
         """Run Certbot with manual DNS challenge"""
         self.logger.info(f"Starting manual certificate process for domain: {self.config['domain']}")
         
-        config_dir = self.script_dir / "certs" / "manual" / "config"
-        work_dir = self.script_dir / "certs" / "manual" / "work"
-        logs_dir = self.script_dir / "certs" / "manual" / "logs"
+        config_dir, work_dir, logs_dir = self._directories()
         
         cmd = [
             'certbot',
@@ -122,54 +91,6 @@ class ManualCertRenewer:
             self.logger.error(f"Certbot failed with exit code {e.returncode}")
             raise
     
-    def _convert_to_pfx(self):
-        """Convert certificate to PFX format"""
-        domain = self.config['domain']
-        cert_live_dir = self.script_dir / "certs" / "manual" / "config" / "live" / domain
-        pfx_output = self.script_dir / "certs" / f"{domain}-manual.pfx"
-        
-        self.logger.info("Converting certificate to PFX format...")
-        self.logger.info(f"Looking for certificates in: {cert_live_dir}")
-        
-        if not cert_live_dir.exists():
-            self.logger.error(f"Certificate directory not found: {cert_live_dir}")
-            raise FileNotFoundError("Certificate directory not found")
-        
-        # Get PFX password from config or use empty password
-        pfx_password = self.config.get('pfx_password', '')
-        if not pfx_password:
-            self.logger.info("No PFX password configured - using empty password")
-        
-        cmd = [
-            'openssl', 'pkcs12', '-export',
-            '-out', str(pfx_output),
-            '-inkey', str(cert_live_dir / 'privkey.pem'),
-            '-in', str(cert_live_dir / 'fullchain.pem'),
-            '-certfile', str(cert_live_dir / 'fullchain.pem'),
-            '-name', domain,
-            '-passout', f'pass:{pfx_password}'
-        ]
-        
-        try:
-            subprocess.run(cmd, check=True)
-            self.logger.info(f"PFX file created: {pfx_output}")
-            
-            # Verify the PFX file
-            verify_cmd = [
-                'openssl', 'pkcs12',
-                '-in', str(pfx_output),
-                '-info', '-nodes', '-noout',
-                '-passin', f'pass:{pfx_password}'
-            ]
-            subprocess.run(verify_cmd, check=True, capture_output=True)
-            self.logger.info("PFX file verified successfully")
-            
-            return pfx_output
-            
-        except subprocess.CalledProcessError as e:
-            self.logger.error(f"PFX conversion failed with exit code {e.returncode}")
-            raise
-    
     def renew_certificate(self):
         """Main method to manually renew the certificate"""
         try:
@@ -189,8 +110,14 @@ class ManualCertRenewer:
             
             self._check_prerequisites()
             self._create_directories()
-            self._run_manual_certbot()
-            pfx_file = self._convert_to_pfx()
+            
+            domain = self.config['domain']
+            pipeline = self._pipeline(domain)
+            next_stage = pipeline.incomplete()
+            if next_stage:
+                self.logger.info(f"Resuming the unfinished renewal at {next_stage}")
+            pipeline.run(self._certificate_stages([domain], self._run_manual_certbot))
+            pfx_file = self._pfx_path(domain)
             
             self.logger.info("Certificate renewal completed successfully!")
             self.logger.info(f"PFX file ready for Plex: {pfx_file}")
@@ -200,7 +127,10 @@ class ManualCertRenewer:
             print("="*60)
             print(f"PFX file location: {pfx_file}")
             print("\nNext steps:")
-            print("1. Copy the PFX file to your Plex server")
+            if self.config.get('deploy', {}).get('targets'):
+                print("1. The PFX file was deployed to the servers listed under \"deploy\"")
+            else:
+                print("1. Copy the PFX file to your Plex server")
             print("2. Import it in Plex Settings > Network > Custom certificate location")
             print("3. Restart Plex Media Server")
             print("="*60)
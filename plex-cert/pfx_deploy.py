@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+"""
+PFX Deployment
+
+Copies a PFX file to every configured Plex server at the same time. Each
+target names a transport ("local" for a path on this machine or a mounted
+share, "sftp" for a server reached with the OpenSSH sftp/ssh clients), a
+destination path and, optionally, a restart command run after the file
+changed. The file is uploaded under a temporary name and renamed over the
+old one, so Plex never reads a partial file, and targets that already hold
+the same file (by SHA-256) are skipped. A target whose restart command
+failed after an upload is listed in <file>.pfx.deploy.json, and its restart
+is retried on the next deploy even though the file already matches.
+
+Targets are listed in settings.json:
+
+    "deploy": {
+        "workers": 16,
+        "targets": [
+            {"name": "nas", "transport": "local", "path": "/mnt/plex/plex.pfx"},
+            {"name": "den", "transport": "sftp", "host": "den.lan", "user": "plex",
+             "path": "/var/lib/plexmediaserver/plex.pfx",
+             "restart": "sudo systemctl restart plexmediaserver"}
+        ]
+    }
+
+A target may set "certificate" to the certificate it receives; by default it
+receives the first configured one.
+
+Usage: python3 pfx_deploy.py [--certificate NAME] [--pfx FILE] [--workers N]
+"""
+
+import sys
+import json
+import time
+import shlex
+import uuid
+import hashlib
+import argparse
+import tempfile
+import threading
+import subprocess
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+from pfx_export import atomic_write
+
+
+def sha256_file(path):
+    """Return the SHA-256 of a file, or None if it does not exist"""
+    try:
+        return hashlib.sha256(Path(path).read_bytes()).hexdigest()
+    except FileNotFoundError:
+        return None
+
+
+class LocalTransport:
+    """Deploy to a path on this machine, e.g. a mounted share"""
+
+    def __init__(self, target):
+        self.path = Path(target['path']).expanduser()
+        self.timeout = float(target.get('timeout', 120))
+
+    def checksum(self):
+        return sha256_file(self.path)
+
+    def upload(self, data):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        atomic_write(self.path, data)
+
+    def run(self, command):
+        args = shlex.split(command) if isinstance(command, str) else command
+        subprocess.run(args, check=True, capture_output=True, timeout=self.timeout)
+
+
+class SFTPTransport:
+    """Deploy over SFTP with the OpenSSH clients; restart commands run through ssh
+
+    Authentication must work without prompts (keys or an agent). The final
+    rename uses OpenSSH's posix-rename, which replaces the old file in one step.
+    """
+
+    def __init__(self, target):
+        self.host = target['host'] if not target.get('user') else f"{target['user']}@{target['host']}"
+        self.path = target['path']
+        self.port = str(target.get('port', 22))
+        self.timeout = float(target.get('timeout', 120))
+        self.options = ['-o', 'BatchMode=yes', '-o', f"ConnectTimeout={int(min(self.timeout, 30))}"]
+        if target.get('identity_file'):
+            self.options += ['-i', str(Path(target['identity_file']).expanduser())]
+
+    def _sftp(self, commands, check=True):
+        """Run sftp batch commands; a leading '-' lets a command fail without aborting the batch"""
+        return subprocess.run(['sftp', '-q', '-P', self.port] + self.options + ['-b', '-', self.host],
+                              input='\n'.join(commands) + '\n', text=True, capture_output=True,
+                              check=check, timeout=self.timeout)
+
+    def checksum(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            local = Path(temp_dir) / 'current.pfx'
+            self._sftp([f'get "{self.path}" "{local}"'], check=False)
+            return sha256_file(local)
+
+    def upload(self, data):
+        temp_path = f"{self.path}.{uuid.uuid4().hex[:8]}.tmp"
+        with tempfile.TemporaryDirectory() as temp_dir:
+            local = Path(temp_dir) / 'upload.pfx'
+            atomic_write(local, data)
+            try:
+                self._sftp([f'put "{local}" "{temp_path}"',
+                            f'chmod 600 "{temp_path}"',
+                            f'rename "{temp_path}" "{self.path}"'])
+            except subprocess.CalledProcessError as e:
+                self._sftp([f'-rm "{temp_path}"'], check=False)
+                raise RuntimeError(f"sftp upload to {self.host} failed: {e.stderr.strip() or e}") from None
+
+    def run(self, command):
+        command = command if isinstance(command, str) else ' '.join(map(shlex.quote, command))
+        subprocess.run(['ssh', '-p', self.port] + self.options + [self.host, command],
+                       check=True, capture_output=True, timeout=self.timeout)
+
+
+# Transport name in settings.json -> class; add an entry to support another protocol
+TRANSPORTS = {
+    'local': LocalTransport,
+    'sftp': SFTPTransport,
+}
+
+
+def make_transport(target):
+    """Create the transport a target names"""
+    name = target.get('transport', 'local')
+    if name not in TRANSPORTS:
+        raise ValueError(f"Unknown deploy transport '{name}' (available: {', '.join(TRANSPORTS)})")
+    return TRANSPORTS[name](target)
+
+
+def target_key(target):
+    """Identify the file a target writes, independent of its display name"""
+    return json.dumps([target.get('transport', 'local'), target.get('user'), target.get('host'), target['path']])
+
+
+def pending_restarts_path(pfx_path):
+    """Return the file listing targets that still owe a restart for pfx_path"""
+    pfx_path = Path(pfx_path)
+    return pfx_path.with_name(pfx_path.name + '.deploy.json')
+
+
+class PendingRestarts:
+    """Targets that received the PFX but whose restart command has not succeeded yet"""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.lock = threading.Lock()
+        try:
+            with open(self.path, 'r') as f:
+                self.keys = set(json.load(f).get('restart_pending', []))
+        except (OSError, ValueError, AttributeError):
+            self.keys = set()
+
+    def __contains__(self, key):
+        return key in self.keys
+
+    def mark(self, key, pending):
+        """Add or remove key and save the file if that changed it"""
+        with self.lock:
+            if (key in self.keys) == pending:
+                return
+            if pending:
+                self.keys.add(key)
+            else:
+                self.keys.discard(key)
+            atomic_write(self.path, (json.dumps({'restart_pending': sorted(self.keys)}, indent=4) + '\n').encode(),
+                         mode=0o644)
+
+
+def deploy_target(target, data, digest, pending=None):
+    """Copy data to one target unless it already has it, then run its restart command
+
+    Returns 'deployed', 'unchanged', or 'restarted' when the file was already
+    in place but the restart after an earlier upload had not succeeded.
+    """
+    transport = make_transport(target)
+    key = target_key(target)
+    restart = target.get('restart')
+
+    if transport.checksum() == digest:
+        if not (restart and pending is not None and key in pending):
+            return 'unchanged'
+        result = 'restarted'
+    else:
+        if restart and pending is not None:
+            # Recorded before the upload, so a failed or interrupted restart is not forgotten once the file matches
+            pending.mark(key, True)
+        transport.upload(data)
+        result = 'deployed'
+
+    if restart:
+        transport.run(restart)
+        if pending is not None:
+            pending.mark(key, False)
+    return result
+
+
+def deploy_pfx(pfx_path, targets, workers=16, log=print):
+    """Deploy one PFX file to all targets concurrently
+
+    Returns [(target name, 'deployed' / 'unchanged' / 'restarted' / the exception, seconds)].
+    """
+    data = Path(pfx_path).read_bytes()
+    digest = hashlib.sha256(data).hexdigest()
+    pending = PendingRestarts(pending_restarts_path(pfx_path))
+
+    def deploy_one(target):
+        name = target.get('name') or target.get('host') or target['path']
+        started = time.monotonic()
+        try:
+            result = deploy_target(target, data, digest, pending)
+        except Exception as e:
+            result = e
+        elapsed = time.monotonic() - started
+        if isinstance(result, Exception):
+            log(f"Deploy to {name} failed after {elapsed:.1f}s: {result}")
+        else:
+            log(f"Deploy to {name}: {result} ({elapsed:.1f}s)")
+        return name, result, elapsed
+
+    if not targets:
+        return []
+    # One thread per target up to workers, so total time tracks the slowest server rather than the count
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(targets)))) as executor:
+        return list(executor.map(deploy_one, targets))
+
+
+def default_certificate(config):
+    """Return the name of the first configured certificate, which targets receive by default"""
+    if config.get('domains'):
+        first = config['domains'][0]
+        return first if isinstance(first, str) else first[0]
+    return config.get('domain')
+
+
+def targets_for(config, name):
+    """Return the deploy targets that receive the certificate called name"""
+    default = default_certificate(config)
+    return [target for target in config.get('deploy', {}).get('targets', [])
+            if target.get('certificate', default) == name]
+
+
+def main():
+    """Deploy PFX files from the certs directory to the targets in settings.json"""
+    script_dir = Path(__file__).parent.absolute()
+    parser = argparse.ArgumentParser(description="Copy PFX files to the configured Plex servers")
+    parser.add_argument('--config', default=str(script_dir / "config" / "settings.json"),
+                        help="settings file (default: %(default)s)")
+    parser.add_argument('--certificate', metavar='NAME', help="only deploy this certificate")
+    parser.add_argument('--pfx', metavar='FILE', help="PFX file to deploy (default: certs/NAME.pfx)")
+    parser.add_argument('--workers', type=int, help="targets deployed at the same time")
+    args = parser.parse_args()
+
+    try:
+        with open(args.config, 'r') as f:
+            config = json.load(f)
+    except (OSError, json.JSONDecodeError) as e:
+        print(f"Error: cannot read {args.config}: {e}", file=sys.stderr)
+        sys.exit(1)
+
+    default = default_certificate(config)
+    names = sorted({target.get('certificate', default) for target in config.get('deploy', {}).get('targets', [])})
+    if args.certificate:
+        names = [args.certificate]
+    workers = args.workers or int(config.get('deploy', {}).get('workers', 16))
+
+    failed = False
+    for name in names:
+        targets = targets_for(config, name)
+        pfx_path = Path(args.pfx) if args.pfx else script_dir / "certs" / f"{name}.pfx"
+        if not targets:
+            print(f"Warning: no deploy targets for {name}", file=sys.stderr)
+            continue
+        if not pfx_path.exists():
+            print(f"Error: {pfx_path} not found", file=sys.stderr)
+            failed = True
+            continue
+        for _, result, _ in deploy_pfx(pfx_path, targets, workers):
+            failed = failed or isinstance(result, Exception)
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
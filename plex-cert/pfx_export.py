@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+"""
+PFX Export
+
+Builds and verifies the PKCS#12 (PFX) file Plex imports, in-process with the
+cryptography package. The file is written atomically next to its final path
+and a hash of the key, chain, name and password is kept beside it
+(<file>.pfx.sha256), so an unchanged certificate is not rebuilt.
+
+Without the cryptography package, or with a release older than 39 that
+lacks the APIs used here, openssl is used instead, with the password passed
+through the environment rather than on the command line.
+
+Usage: python3 pfx_export.py LIVE_DIR [LIVE_DIR ...] --out-dir certs [--password-env PFX_PASSWORD]
+       (each LIVE_DIR is a Certbot live/<name> directory, or a live directory holding several)
+"""
+
+import os
+import sys
+import hashlib
+import argparse
+import tempfile
+import subprocess
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from cryptography import x509
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.exceptions import UnsupportedAlgorithm
+    from cryptography.hazmat.primitives.serialization import pkcs12
+    # load_pem_x509_certificates and unsafe_skip_rsa_key_validation arrived in 39, the PKCS12 encryption builder in 38
+    if not hasattr(x509, 'load_pem_x509_certificates') or not hasattr(serialization.PrivateFormat, 'PKCS12'):
+        raise ImportError("cryptography 39 or newer is required")
+except ImportError:
+    x509 = None
+
+# PBKDF2 rounds for the PFX encryption and MAC, as OpenSSL uses
+PKCS12_KDF_ROUNDS = 2048
+
+
+def input_hash(key_pem, chain_pem, name, password):
+    """Return a hash of everything that ends up in the PFX"""
+    digest = hashlib.sha256()
+    for part in (key_pem, chain_pem, name.encode(), password.encode()):
+        digest.update(len(part).to_bytes(8, 'big'))
+        digest.update(part)
+    return digest.hexdigest()
+
+
+def atomic_write(path, data, mode=0o600):
+    """Write data to path through a temporary file in the same directory and rename it into place"""
+    path = Path(path)
+    fd, temp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(temp_path, mode)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+
+def build_pfx(key_pem, chain_pem, name, password):
+    """Return PFX bytes holding the key, the leaf certificate and the rest of the chain"""
+    if x509 is not None:
+        try:
+            return _build_pfx_cryptography(key_pem, chain_pem, name, password)
+        except (AttributeError, TypeError, UnsupportedAlgorithm):
+            # A cryptography build that lacks one of the APIs or algorithms used; openssl can still export
+            pass
+    return _build_pfx_openssl(key_pem, chain_pem, name, password)
+
+
+def verify_pfx(data, password, chain_pem):
+    """Check that the PFX opens with password and holds the chain's leaf certificate and its key"""
+    if x509 is not None:
+        try:
+            return _verify_pfx_cryptography(data, password, chain_pem)
+        except (AttributeError, TypeError, UnsupportedAlgorithm):
+            pass
+    return _verify_pfx_openssl(data, password)
+
+
+def _build_pfx_cryptography(key_pem, chain_pem, name, password):
+    """Export in-process with the cryptography package"""
+    # The RSA consistency check is the slowest step and verify_pfx() runs it again on the result anyway
+    key = serialization.load_pem_private_key(key_pem, password=None, unsafe_skip_rsa_key_validation=True)
+    certificates = x509.load_pem_x509_certificates(chain_pem)
+    if password:
+        # Same algorithms and iteration count `openssl pkcs12 -export` (OpenSSL 3) uses by default
+        encryption = (serialization.PrivateFormat.PKCS12.encryption_builder()
+                      .kdf_rounds(PKCS12_KDF_ROUNDS)
+                      .key_cert_algorithm(pkcs12.PBES.PBESv2SHA256AndAES256CBC)
+                      .hmac_hash(hashes.SHA256())
+                      .build(password.encode()))
+    else:
+        encryption = serialization.NoEncryption()
+    return pkcs12.serialize_key_and_certificates(name.encode(), key, certificates[0], certificates[1:], encryption)
+
+
+def _verify_pfx_cryptography(data, password, chain_pem):
+    """Verify in-process with the cryptography package"""
+    bundle = pkcs12.load_pkcs12(data, password.encode() if password else None)
+    leaf = x509.load_pem_x509_certificates(chain_pem)[0]
+    if bundle.key is None or bundle.cert is None:
+        raise ValueError("PFX is missing the private key or certificate")
+    if bundle.cert.certificate != leaf:
+        raise ValueError("PFX certificate does not match fullchain.pem")
+
+    public_format = dict(encoding=serialization.Encoding.DER,
+                         format=serialization.PublicFormat.SubjectPublicKeyInfo)
+    if bundle.key.public_key().public_bytes(**public_format) != leaf.public_key().public_bytes(**public_format):
+        raise ValueError("PFX private key does not match its certificate")
+
+
+def _run_openssl(args, password, stdin=None):
+    """Run openssl with the password in the environment instead of argv"""
+    env = dict(os.environ, PFX_EXPORT_PASSWORD=password)
+    return subprocess.run(['openssl'] + args, input=stdin, env=env, check=True, capture_output=True).stdout
+
+
+def _build_pfx_openssl(key_pem, chain_pem, name, password):
+    """Fallback export through openssl pkcs12 reading the key and chain from a private temporary directory"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        key_path = Path(temp_dir) / 'privkey.pem'
+        with open(os.open(key_path, os.O_WRONLY | os.O_CREAT, 0o600), 'wb') as f:
+            f.write(key_pem)
+        return _run_openssl(['pkcs12', '-export', '-inkey', str(key_path), '-name', name,
+                             '-passout', 'env:PFX_EXPORT_PASSWORD'], password, stdin=chain_pem)
+
+
+def _verify_pfx_openssl(data, password):
+    """Fallback verification through openssl pkcs12 -info"""
+    _run_openssl(['pkcs12', '-info', '-nodes', '-noout', '-passin', 'env:PFX_EXPORT_PASSWORD'], password, stdin=data)
+
+
+def export_pfx(live_dir, pfx_path, name, password=''):
+    """Build, verify and atomically write pfx_path from a Certbot live directory
+
+    Returns True if the file was written and False if its inputs were
+    unchanged since the last export.
+    """
+    live_dir, pfx_path = Path(live_dir), Path(pfx_path)
+    key_pem = (live_dir / 'privkey.pem').read_bytes()
+    chain_pem = (live_dir / 'fullchain.pem').read_bytes()
+
+    digest = input_hash(key_pem, chain_pem, name, password)
+    hash_path = pfx_path.with_name(pfx_path.name + '.sha256')
+    if pfx_path.exists() and hash_path.exists() and hash_path.read_text().strip() == digest:
+        return False
+
+    data = build_pfx(key_pem, chain_pem, name, password)
+    verify_pfx(data, password, chain_pem)
+    atomic_write(pfx_path, data)
+    atomic_write(hash_path, (digest + '\n').encode(), mode=0o644)
+    return True
+
+
+def find_live_dirs(paths):
+    """Expand each path to the Certbot live/<name> directories it holds"""
+    live_dirs = []
+    for path in map(Path, paths):
+        if (path / 'fullchain.pem').exists():
+            live_dirs.append(path)
+        else:
+            live_dirs.extend(sorted(child for child in path.iterdir() if (child / 'fullchain.pem').exists()))
+    return live_dirs
+
+
+def export_many(live_dirs, out_dir, password='', workers=4, suffix=''):
+    """Export every live directory to out_dir/<name><suffix>.pfx in parallel
+
+    Returns [(name, pfx path, True if written / False if unchanged / the exception)].
+    """
+    Path(out_dir).mkdir(parents=True, exist_ok=True)
+
+    def export_one(live_dir):
+        name = Path(live_dir).name
+        pfx_path = Path(out_dir) / f"{name}{suffix}.pfx"
+        try:
+            return name, pfx_path, export_pfx(live_dir, pfx_path, name, password)
+        except Exception as e:
+            return name, pfx_path, e
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(export_one, live_dirs))
+
+
+def main():
+    """Convert one or more Certbot live directories to PFX files"""
+    parser = argparse.ArgumentParser(description="Convert Certbot certificates to verified PFX files")
+    parser.add_argument('live_dirs', nargs='+', metavar='LIVE_DIR',
+                        help="a Certbot live/<name> directory, or a live directory holding several")
+    parser.add_argument('--out-dir', required=True, help="directory the PFX files are written to")
+    parser.add_argument('--password-env', metavar='VAR',
+                        help="environment variable holding the PFX password (default: empty password)")
+    parser.add_argument('--workers', type=int, default=4, help="certificates converted at the same time")
+    args = parser.parse_args()
+
+    password = os.environ.get(args.password_env, '') if args.password_env else ''
+    failed = False
+    for name, pfx_path, result in export_many(find_live_dirs(args.live_dirs), args.out_dir, password, args.workers):
+        if isinstance(result, Exception):
+            print(f"Error: {name}: {result}", file=sys.stderr)
+            failed = True
+        else:
+            print(f"{pfx_path}: {'written' if result else 'unchanged'}")
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
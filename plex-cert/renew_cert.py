@@ -4,8 +4,9 @@ Plex Certificate Renewal Script
 
 Automates SSL certificate renewal for Plex servers using Certbot with Azure DNS challenge.
 Converts certificates to PFX format for easy import into Plex.
+Settings, scheduling, metrics and resuming are described in README.md.
 
-Usage: python3 renew_cert.py
+Usage: python3 renew_cert.py [--force] [--schedule] [--download-wheels DIR]
 """
 
 import os
@@ -14,48 +15,42 @@ import json
 import subprocess
 import shutil
 import logging
+import argparse
+import hashlib
+import platform
 from pathlib import Path
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 
+from cert_info import certificate_info
+from pfx_export import x509 as cryptography_x509
+from renew_pipeline import CertRenewerBase
+from renew_scheduler import RenewalLock, RenewalState, RenewalScheduler, retry_delay
+from renew_metrics import PhaseTimer, write_run, write_textfile
 
-class PlexCertRenewer:
+# Packages installed into the Certbot virtual environment
+CERTBOT_PACKAGES = ['certbot>=2.0,<3.0', 'certbot-dns-azure']
+
+# Written into the virtual environment after a successful install
+VENV_STAMP = ".plex-cert-stamp.json"
+
+
+class DomainLogAdapter(logging.LoggerAdapter):
+    """Prefix messages with the certificate name so parallel renewals can be told apart"""
+    
+    def process(self, msg, kwargs):
+        return f"[{self.extra['domain']}] {msg}", kwargs
+
+
+class PlexCertRenewer(CertRenewerBase):
     def __init__(self):
-        self.script_dir = Path(__file__).parent.absolute()
-        self.config_file = self.script_dir / "config" / "settings.json"
+        super().__init__()
         self.azure_credentials = self.script_dir / "secrets" / "azure.ini"
         self.venv_path = Path.home() / "certbot-venv"
-        
-        # Setup logging
-        log_dir = self.script_dir / "logs"
-        log_dir.mkdir(exist_ok=True)
-        log_file = log_dir / f"renewal_{datetime.now().strftime('%Y%m%d_%H%M%S')}.log"
-        
-        logging.basicConfig(
-            level=logging.INFO,
-            format='%(asctime)s - %(levelname)s - %(message)s',
-            handlers=[
-                logging.FileHandler(log_file),
-                logging.StreamHandler(sys.stdout)
-            ]
-        )
-        self.logger = logging.getLogger(__name__)
-        
-        # Load configuration
-        self.config = self._load_config()
-        
-    def _load_config(self):
-        """Load configuration from settings.json"""
-        try:
-            with open(self.config_file, 'r') as f:
-                config = json.load(f)
-            self.logger.info(f"Configuration loaded from {self.config_file}")
-            return config
-        except FileNotFoundError:
-            self.logger.error(f"Configuration file not found: {self.config_file}")
-            sys.exit(1)
-        except json.JSONDecodeError as e:
-            self.logger.error(f"Invalid JSON in configuration file: {e}")
-            sys.exit(1)
+        self.lock_file = self.script_dir / "certs" / ".renew.lock"
+        self.state_file = self.script_dir / "certs" / "renewal_state.json"
+        self.timings_dir = self.log_dir / "timings"
     
     def _check_prerequisites(self):
         """Check if all required files and dependencies exist"""
@@ -67,69 +62,211 @@ class PlexCertRenewer:
             self.logger.error("Please create the azure.ini file with your Azure DNS credentials")
             sys.exit(1)
         
-        # Check if OpenSSL is available
-        if not shutil.which('openssl'):
+        # OpenSSL is only needed when the cryptography package is not installed
+        if cryptography_x509 is None and not shutil.which('openssl'):
             self.logger.error("OpenSSL not found. Please install OpenSSL.")
             sys.exit(1)
         
         # Check required config fields
-        required_fields = ['domain', 'email']
-        for field in required_fields:
-            if not self.config.get(field):
-                self.logger.error(f"Required configuration field '{field}' is missing or empty")
-                sys.exit(1)
+        if not self.config.get('domain') and not self.config.get('domains'):
+            self.logger.error("Required configuration field 'domain' (or 'domains') is missing or empty")
+            sys.exit(1)
+        if not self.config.get('email'):
+            self.logger.error("Required configuration field 'email' is missing or empty")
+            sys.exit(1)
         
         self.logger.info("Prerequisites check passed")
     
-    def _setup_venv(self):
-        """Create and setup Python virtual environment for Certbot"""
-        self.logger.info("Setting up Certbot virtual environment...")
+    def _certificate_groups(self):
+        """Return the certificates to renew as lists of hostnames, the first naming the certificate"""
+        if not self.config.get('domains'):
+            return [[self.config['domain']]]
+        
+        groups = []
+        for entry in self.config['domains']:
+            groups.append([entry] if isinstance(entry, str) else list(entry))
+        return groups
+    
+    def _certbot_dirs(self, name):
+        """Return the Certbot config, work and logs directories for one certificate
         
+        Certbot locks these directories while it runs, so certificates renewed
+        in parallel each get their own. A single "domain" keeps the original
+        shared layout.
+        """
+        base = self.script_dir / "certs" / "letsencrypt"
+        if self.config.get('domains'):
+            base = base / name
+        return base / "config", base / "work", base / "logs"
+    
+    def _live_dir(self, name):
+        """Return Certbot's live directory of one certificate"""
+        return self._certbot_dirs(name)[0] / "live" / name
+    
+    def _pfx_path(self, name):
+        return self.script_dir / "certs" / f"{name}.pfx"
+    
+    def _fullchain_path(self, name):
+        """Return the live fullchain.pem of one certificate"""
+        return self._live_dir(name) / "fullchain.pem"
+    
+    def _certificate_expiry(self, name):
+        """Return the notAfter date of the live certificate, or None if there is none"""
+        try:
+            return certificate_info(self._fullchain_path(name))[0]
+        except (OSError, ValueError, IndexError):
+            return None
+    
+    def _needs_renewal(self, group):
+        """Return (due, reason) for one certificate from its checkpoint and live fullchain.pem"""
+        next_stage = self._pipeline(group[0]).incomplete()
+        if next_stage:
+            return True, f"resuming an unfinished renewal at {next_stage}"
+        
+        fullchain = self._fullchain_path(group[0])
+        if not fullchain.exists():
+            return True, "no certificate yet"
+        
+        try:
+            not_after, dns_names = certificate_info(fullchain)
+        except (OSError, ValueError, IndexError) as e:
+            return True, f"cannot read {fullchain}: {e}"
+        
+        missing = [hostname for hostname in group if hostname not in dns_names]
+        if missing:
+            return True, f"certificate does not cover {', '.join(missing)}"
+        
+        days_left = (not_after - datetime.now(timezone.utc)).total_seconds() / 86400
+        window = float(self.config.get('renew_before_days', 30))
+        if days_left <= window:
+            return True, f"expires in {days_left:.1f} days"
+        return False, f"valid for {days_left:.1f} more days (renewal window is {window:g} days)"
+    
+    def _domain_logger(self, name):
+        """Return a logger that also writes to this certificate's own log file"""
+        logger = logging.getLogger(f"{__name__}.{name}")
+        log_file = self.log_dir / f"renewal_{self.run_stamp}_{name}.log"
+        handler = logging.FileHandler(log_file)
+        handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+        logger.addHandler(handler)
+        return DomainLogAdapter(logger, {'domain': name}), log_file
+    
+    def _venv_fingerprint(self):
+        """Return a hash of everything the installed Certbot environment depends on"""
+        packages = self.config.get('certbot_packages', CERTBOT_PACKAGES)
+        source = {
+            'packages': sorted(packages),
+            'python': sys.version,
+            'executable': os.path.realpath(sys.executable),
+            'machine': platform.machine(),
+        }
+        return hashlib.sha256(json.dumps(source, sort_keys=True).encode()).hexdigest(), packages
+    
+    def _create_venv(self):
+        """Create the virtual environment if it does not exist yet"""
         if self.venv_path.exists():
             self.logger.info("Virtual environment already exists")
         else:
             subprocess.run([sys.executable, '-m', 'venv', str(self.venv_path)], check=True)
             self.logger.info(f"Virtual environment created at {self.venv_path}")
+    
+    def _setup_venv(self):
+        """Create and setup Python virtual environment for Certbot; returns False if pip was skipped"""
+        self.logger.info("Setting up Certbot virtual environment...")
+        
+        fingerprint, packages = self._venv_fingerprint()
+        stamp_file = self.venv_path / VENV_STAMP
+        try:
+            with open(stamp_file, 'r') as f:
+                stamp = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            stamp = {}
+        
+        if stamp.get('fingerprint') == fingerprint and (self.venv_path / "bin" / "certbot").exists():
+            self.logger.info(f"Certbot environment up to date (installed {stamp.get('installed_at')}) - skipping pip")
+            return False
+        
+        self._create_venv()
         
         # Install/upgrade certbot packages
         pip_path = self.venv_path / "bin" / "pip"
-        packages = ['certbot>=2.0,<3.0', 'certbot-dns-azure']
+        cmd = [str(pip_path), 'install', '--upgrade']
+        wheel_dir = self.config.get('wheel_dir')
+        if wheel_dir:
+            # Offline install from a local wheel cache
+            cmd += ['--no-index', '--find-links', str(Path(wheel_dir).expanduser())]
+            self.logger.info(f"Installing Certbot packages from {wheel_dir}...")
+        else:
+            self.logger.info("Installing/upgrading Certbot packages...")
+        subprocess.run(cmd + packages, check=True)
         
-        self.logger.info("Installing/upgrading Certbot packages...")
-        subprocess.run([
-            str(pip_path), 'install', '--upgrade'
-        ] + packages, check=True)
+        # Record what was installed so the next run can skip pip
+        freeze = subprocess.run([str(pip_path), 'freeze'], check=True, capture_output=True, text=True)
+        stamp = {
+            'fingerprint': fingerprint,
+            'packages': packages,
+            'python': sys.version,
+            'installed_at': datetime.now().isoformat(timespec='seconds'),
+            'installed': freeze.stdout.split(),
+        }
+        with open(stamp_file, 'w') as f:
+            json.dump(stamp, f, indent=4)
         
         self.logger.info("Certbot environment setup complete")
+        return True
     
-    def _create_directories(self):
-        """Create necessary directories for Certbot"""
-        directories = [
-            self.script_dir / "certs" / "letsencrypt" / "config",
-            self.script_dir / "certs" / "letsencrypt" / "work", 
-            self.script_dir / "certs" / "letsencrypt" / "logs"
-        ]
+    def download_wheels(self, wheel_dir):
+        """Download the Certbot packages and their dependencies as wheels for offline installs"""
+        self._create_venv()
+        _, packages = self._venv_fingerprint()
+        pip_path = self.venv_path / "bin" / "pip"
         
-        for directory in directories:
-            directory.mkdir(parents=True, exist_ok=True)
-            self.logger.info(f"Created directory: {directory}")
+        self.logger.info(f"Downloading Certbot wheels to {wheel_dir}...")
+        subprocess.run([str(pip_path), 'download', '--dest', str(wheel_dir)] + packages, check=True)
+        self.logger.info(f"Set \"wheel_dir\": \"{wheel_dir}\" in settings.json to install from it")
     
-    def _run_certbot(self):
-        """Run Certbot to obtain the certificate"""
-        self.logger.info(f"Running Certbot for domain: {self.config['domain']}")
+    def _directories(self):
+        """Return the Certbot directories of every configured certificate"""
+        directories = []
+        for group in self._certificate_groups():
+            directories.extend(self._certbot_dirs(group[0]))
+        return directories
+    
+    def _run_certbot(self, group, logger, log_file):
+        """Run Certbot to obtain the certificate for one group of hostnames"""
+        logger.info(f"Running Certbot for domain: {', '.join(group)}")
         
-        certbot_path = self.venv_path / "bin" / "certbot"
-        config_dir = self.script_dir / "certs" / "letsencrypt" / "config"
-        work_dir = self.script_dir / "certs" / "letsencrypt" / "work"
-        logs_dir = self.script_dir / "certs" / "letsencrypt" / "logs"
+        config_dir, work_dir, logs_dir = self._certbot_dirs(group[0])
+        propagation_seconds = str(self.config.get('propagation_seconds', 30))
+        timings_file = work_dir / "timings.jsonl"
         
-        cmd = [
-            str(certbot_path),
+        if self.config.get('propagation_check', True):
+            # Poll the zone's nameservers for the TXT records; the fixed delay is only a fallback
+            cmd = [
+                str(self.venv_path / "bin" / "python"),
+                str(self.script_dir / "certbot_launcher.py"),
+                '--deadline', str(self.config.get('propagation_deadline', 300)),
+                '--timings', str(timings_file),
+            ]
+            for nameserver in self.config.get('propagation_nameservers', []):
+                cmd += ['--nameserver', nameserver]
+            cmd.append('--')
+        else:
+            cmd = [str(self.venv_path / "bin" / "certbot")]
+        
+        cmd += [
             'certonly',
             '--authenticator', 'dns-azure',
             '--dns-azure-credentials', str(self.azure_credentials),
-            '--dns-azure-propagation-seconds', '30',
-            '-d', self.config['domain'],
+            '--dns-azure-propagation-seconds', propagation_seconds,
+            '--cert-name', group[0],
+        ]
+        for hostname in group:
+            cmd += ['-d', hostname]
+        cmd += [
+            # Groups only get here once _needs_renewal() or --force decided they are due; without this
+            # Certbot keeps a lineage outside its own 30-day window and still exits 0
+            '--force-renewal',
             '--non-interactive',
             '--agree-tos',
             '--email', self.config['email'],
@@ -139,89 +276,183 @@ class PlexCertRenewer:
             '-v'
         ]
         
+        previous_expiry = self._certificate_expiry(group[0])
+        timings_file.unlink(missing_ok=True)
         try:
-            subprocess.run(cmd, check=True)
-            self.logger.info("Certificate obtained successfully")
+            # Parallel runs would interleave on the terminal, so Certbot's output goes to the domain's log
+            with open(log_file, 'a') as output:
+                subprocess.run(cmd, check=True, stdout=output, stderr=subprocess.STDOUT)
+            # Certbot exits 0 when it decides not to renew; counting that as a success would re-run it on every wake
+            expiry = self._certificate_expiry(group[0])
+            if expiry is None or expiry == previous_expiry:
+                logger.error(f"Certbot exited without issuing a new certificate (see {log_file})")
+                raise RuntimeError(f"Certbot did not renew the certificate (notAfter is still {previous_expiry})")
+            logger.info("Certificate obtained successfully")
         except subprocess.CalledProcessError as e:
-            self.logger.error(f"Certbot failed with exit code {e.returncode}")
+            logger.error(f"Certbot failed with exit code {e.returncode} (see {log_file})")
             raise
+        finally:
+            # The launcher reports how long Certbot waited for DNS propagation
+            if timings_file.exists():
+                for line in timings_file.read_text().splitlines():
+                    span = json.loads(line)
+                    self.timer.add(span['phase'], span['duration'], span['outcome'], group[0], span['start'])
     
-    def _convert_to_pfx(self):
-        """Convert certificate to PFX format"""
-        domain = self.config['domain']
-        cert_live_dir = self.script_dir / "certs" / "letsencrypt" / "config" / "live" / domain
-        pfx_output = self.script_dir / "certs" / f"{domain}.pfx"
-        
-        self.logger.info("Converting certificate to PFX format...")
-        self.logger.info(f"Looking for certificates in: {cert_live_dir}")
-        
-        if not cert_live_dir.exists():
-            self.logger.error(f"Certificate directory not found: {cert_live_dir}")
-            raise FileNotFoundError("Certificate directory not found")
-        
-        # Get PFX password from config or prompt
-        pfx_password = self.config.get('pfx_password', '')
-        if not pfx_password:
-            self.logger.info("No PFX password configured - using empty password")
-        
-        cmd = [
-            'openssl', 'pkcs12', '-export',
-            '-out', str(pfx_output),
-            '-inkey', str(cert_live_dir / 'privkey.pem'),
-            '-in', str(cert_live_dir / 'fullchain.pem'),
-            '-certfile', str(cert_live_dir / 'fullchain.pem'),
-            '-name', domain,
-            '-passout', f'pass:{pfx_password}'
-        ]
+    def _renew_group(self, group):
+        """Renew one certificate; returns the PFX path, or None if it failed"""
+        logger, log_file = self._domain_logger(group[0])
+        try:
+            stages = self._certificate_stages(group, lambda: self._run_certbot(group, logger, log_file), logger)
+            self._pipeline(group[0], logger).run(stages)
+            return self._pfx_path(group[0])
+        except Exception as e:
+            # One failed certificate must not stop the others
+            logger.error(f"Certificate renewal failed: {e}")
+            return None
+        finally:
+            for handler in logger.logger.handlers[:]:
+                logger.logger.removeHandler(handler)
+                handler.close()
+    
+    def _record_results(self, groups, results):
+        """Store each certificate's outcome, expiry and next allowed attempt in the state file"""
+        state = RenewalState(self.state_file)
+        now = datetime.now(timezone.utc)
+        jitter_hours = float(self.config.get('schedule_jitter_hours', 6))
+        
+        for group, pfx_file in zip(groups, results):
+            name = group[0]
+            if pfx_file is not None:
+                # Keeps a certificate that is still due after renewing from being ordered again right away
+                next_attempt = now + timedelta(hours=float(self.config.get('schedule_min_interval_hours', 12)))
+            else:
+                failures = state.certificate(name).get('failures', 0) + 1
+                next_attempt = now + retry_delay(failures,
+                                                 float(self.config.get('retry_initial_minutes', 10)),
+                                                 float(self.config.get('retry_max_hours', 12)))
+            state.record(name, pfx_file is not None, now, next_attempt, self._certificate_expiry(name), jitter_hours)
         
+        state.save()
+    
+    def renew_due(self, groups):
+        """Run the shared setup once, renew groups in parallel and record the results
+        
+        Returns the PFX path of each group, or None where it failed.
+        """
         try:
-            subprocess.run(cmd, check=True)
-            self.logger.info(f"PFX file created: {pfx_output}")
-            
-            # Verify the PFX file
-            verify_cmd = [
-                'openssl', 'pkcs12',
-                '-in', str(pfx_output),
-                '-info', '-nodes', '-noout',
-                '-passin', f'pass:{pfx_password}'
-            ]
-            subprocess.run(verify_cmd, check=True, capture_output=True)
-            self.logger.info("PFX file verified successfully")
+            # Shared setup runs once for every certificate
+            self.logger.info(f"Domains: {', '.join(' + '.join(group) for group in groups)}")
+            with self.timer.span('setup_venv') as span:
+                if not self._setup_venv():
+                    span['outcome'] = 'skipped'
+            with self.timer.span('create_directories'):
+                self._create_directories()
             
-            return pfx_output
-            
-        except subprocess.CalledProcessError as e:
-            self.logger.error(f"PFX conversion failed with exit code {e.returncode}")
-            raise
+            max_workers = int(self.config.get('max_workers', 4))
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                results = list(executor.map(self._renew_group, groups))
+        except Exception as e:
+            self.logger.error(f"Certificate renewal failed: {e}")
+            results = [None] * len(groups)
+        
+        if None in results:
+            self.timer.outcome = 'failure'
+        self._record_results(groups, results)
+        return results
     
-    def renew_certificate(self):
-        """Main method to renew the certificate"""
+    @contextmanager
+    def _timed_run(self):
+        """Time one renewal run, then write its spans as JSON and as an OpenMetrics textfile"""
+        self.timer = PhaseTimer(self.run_stamp)
+        outcome = None
         try:
-            self.logger.info("Starting certificate renewal process...")
-            self.logger.info(f"Domain: {self.config['domain']}")
-            self.logger.info(f"Email: {self.config['email']}")
+            yield self.timer
+        except BaseException as e:
+            if not (isinstance(e, SystemExit) and e.code in (0, None)):
+                outcome = 'failure'
+            raise
+        finally:
+            self.timer.finish(outcome)
+            spans = ', '.join(f"{span['phase']}{'[' + span['domain'] + ']' if span['domain'] else ''} "
+                              f"{span['duration']:.2f}s" for span in self.timer.to_dict()['spans'])
+            self.logger.info(f"Run took {self.timer.duration:.2f}s: {spans}")
+            try:
+                write_run(self.timer, self.timings_dir)
+                write_textfile(self.timer, self.config.get('metrics_textfile', self.log_dir / "plex_cert.prom"))
+            except OSError as e:
+                self.logger.warning(f"Could not write timings: {e}")
+    
+    def renew_certificate(self, force=False):
+        """Main method to renew the certificates"""
+        with self._timed_run():
+            try:
+                self.logger.info("Starting certificate renewal process...")
+                self.logger.info(f"Email: {self.config['email']}")
+                
+                with self.timer.span('check_prerequisites'):
+                    self._check_prerequisites()
+                groups = []
+                for group in self._certificate_groups():
+                    due, reason = self._needs_renewal(group)
+                    self.logger.info(f"{group[0]}: {reason}{'' if due or force else ' - skipping'}")
+                    if due or force:
+                        groups.append(group)
+                
+                if not groups:
+                    self.logger.info("No certificate is due for renewal")
+                    return
+            except Exception as e:
+                self.logger.error(f"Certificate renewal failed: {e}")
+                sys.exit(1)
             
-            self._check_prerequisites()
-            self._setup_venv()
-            self._create_directories()
-            self._run_certbot()
-            pfx_file = self._convert_to_pfx()
+            results = self.renew_due(groups)
+            failed = [group[0] for group, pfx_file in zip(groups, results) if pfx_file is None]
+            for pfx_file in results:
+                if pfx_file is not None:
+                    self.logger.info(f"PFX file ready for Plex: {pfx_file}")
+            
+            if failed:
+                self.logger.error(f"Certificate renewal failed for: {', '.join(failed)}")
+                sys.exit(1)
             
             self.logger.info("Certificate renewal completed successfully!")
-            self.logger.info(f"PFX file ready for Plex: {pfx_file}")
+            if self.config.get('deploy', {}).get('targets'):
+                return
             self.logger.info("\nNext steps:")
-            self.logger.info("1. Copy the PFX file to your Plex server")
+            self.logger.info("1. Copy the PFX file to your Plex server (or list your servers under \"deploy\")")
             self.logger.info("2. Import it in Plex Settings > Network > Custom certificate location")
-            
-        except Exception as e:
-            self.logger.error(f"Certificate renewal failed: {e}")
-            sys.exit(1)
+    
+    def run_scheduler(self):
+        """Stay running and renew each certificate when it becomes due"""
+        self._check_prerequisites()
+        RenewalScheduler(self).run()
 
 
 def main():
     """Main entry point"""
+    parser = argparse.ArgumentParser(description="Renew Plex certificates with Certbot and Azure DNS")
+    parser.add_argument('--force', action='store_true',
+                        help="renew even if the certificate is outside the renewal window")
+    parser.add_argument('--schedule', action='store_true',
+                        help="keep running and renew each certificate when it enters its renewal window")
+    parser.add_argument('--download-wheels', metavar='DIR',
+                        help="download the Certbot packages into DIR for offline installs and exit")
+    args = parser.parse_args()
+    
     renewer = PlexCertRenewer()
-    renewer.renew_certificate()
+    try:
+        lock = RenewalLock(renewer.lock_file).acquire()
+    except RuntimeError as e:
+        renewer.logger.error(str(e))
+        sys.exit(1)
+    
+    with lock:
+        if args.download_wheels:
+            renewer.download_wheels(args.download_wheels)
+        elif args.schedule:
+            renewer.run_scheduler()
+        else:
+            renewer.renew_certificate(force=args.force)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+"""
+Renewal Metrics
+
+Times each phase of a renewal run as a span (phase, certificate, start,
+duration, outcome). Every run is written to logs/timings/run_<stamp>.json and
+to an OpenMetrics textfile (logs/plex_cert.prom by default) that the
+node_exporter textfile collector can pick up. The report command summarizes
+phase durations across the saved runs.
+
+Usage: python3 renew_metrics.py report [--dir logs/timings] [--last N]
+"""
+
+import sys
+import json
+import math
+import time
+import argparse
+import threading
+from pathlib import Path
+from datetime import datetime, timezone
+from contextlib import contextmanager
+
+from pfx_export import atomic_write
+
+# Run files kept in the timings directory; older ones are deleted
+KEEP_RUNS = 1000
+
+
+class PhaseTimer:
+    """Collects the spans of one run; spans may be recorded from several threads"""
+
+    def __init__(self, run_id):
+        self.run_id = run_id
+        self.started = time.time()
+        self._started = time.perf_counter()
+        self.duration = None
+        self.outcome = 'success'
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def add(self, phase, duration, outcome='ok', domain=None, start=None, error=None):
+        """Record a span measured elsewhere, e.g. by a subprocess"""
+        span = {'phase': phase, 'domain': domain, 'start': start or time.time() - duration,
+                'duration': round(duration, 6), 'outcome': outcome}
+        if error:
+            span['error'] = error
+        with self._lock:
+            self.spans.append(span)
+
+    @contextmanager
+    def span(self, phase, domain=None):
+        """Time the enclosed block; the yielded dict's 'outcome' may be changed (e.g. to 'skipped')"""
+        span = {'outcome': 'ok'}
+        start, started = time.time(), time.perf_counter()
+        try:
+            yield span
+        except BaseException as e:
+            if not (isinstance(e, SystemExit) and e.code in (0, None)):
+                span['outcome'] = 'error'
+                # A failed subprocess's message repeats its whole command line
+                span['error'] = (f"exit code {e.returncode}" if hasattr(e, 'returncode')
+                                 else str(e) or type(e).__name__)
+            raise
+        finally:
+            self.add(phase, time.perf_counter() - started, span['outcome'], domain, start, span.get('error'))
+
+    def finish(self, outcome=None):
+        self.duration = round(time.perf_counter() - self._started, 6)
+        if outcome:
+            self.outcome = outcome
+
+    def to_dict(self):
+        return {
+            'run': self.run_id,
+            'started': datetime.fromtimestamp(self.started, timezone.utc).isoformat(),
+            'duration': self.duration,
+            'outcome': self.outcome,
+            'spans': sorted(self.spans, key=lambda span: span['start']),
+        }
+
+
+def write_run(timer, directory, keep=KEEP_RUNS):
+    """Write one run as JSON and delete the oldest run files beyond keep"""
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    path = directory / f"run_{timer.run_id}.json"
+    atomic_write(path, (json.dumps(timer.to_dict(), indent=4) + '\n').encode(), mode=0o644)
+
+    runs = sorted(directory.glob('run_*.json'))
+    for old in runs[:max(0, len(runs) - keep)]:
+        old.unlink()
+    return path
+
+
+def _labels(**labels):
+    """Format OpenMetrics labels, leaving out empty ones"""
+    parts = []
+    for name, value in labels.items():
+        if value:
+            value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+            parts.append(f'{name}="{value}"')
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+
+def render_openmetrics(timer):
+    """Return the last run as OpenMetrics text"""
+    lines = []
+
+    def family(name, help_text, samples):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} gauge")
+        for labels, value in samples:
+            lines.append(f"{name}{labels} {value}")
+
+    family('plex_cert_run_timestamp_seconds', "Start time of the last renewal run.",
+           [('', round(timer.started, 3))])
+    family('plex_cert_run_duration_seconds', "Duration of the last renewal run.",
+           [('', timer.duration)])
+    family('plex_cert_run_success', "1 if the last renewal run succeeded.",
+           [('', int(timer.outcome == 'success'))])
+    family('plex_cert_phase_duration_seconds', "Duration of each phase of the last renewal run.",
+           [(_labels(phase=span['phase'], domain=span['domain'], outcome=span['outcome']), span['duration'])
+            for span in timer.spans])
+    lines.append('# EOF')
+    return '\n'.join(lines) + '\n'
+
+
+def write_textfile(timer, path):
+    """Replace the OpenMetrics textfile atomically so collectors never read half a file"""
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    atomic_write(path, render_openmetrics(timer).encode(), mode=0o644)
+
+
+def percentile(values, q):
+    """Nearest-rank percentile of a sorted list"""
+    return values[max(0, math.ceil(q / 100 * len(values)) - 1)]
+
+
+def load_runs(directory, last=None):
+    """Return the saved runs, oldest first"""
+    runs = []
+    for path in sorted(Path(directory).glob('run_*.json')):
+        try:
+            with open(path, 'r') as f:
+                runs.append(json.load(f))
+        except (OSError, json.JSONDecodeError):
+            continue
+    return runs[-last:] if last else runs
+
+
+def summarize(runs):
+    """Return {phase: {'count', 'errors', 'p50', 'p90', 'p99', 'max'}} over all spans of runs"""
+    durations, errors = {}, {}
+    for run in runs:
+        for span in run.get('spans', []):
+            durations.setdefault(span['phase'], []).append(span['duration'])
+            errors[span['phase']] = errors.get(span['phase'], 0) + (span['outcome'] == 'error')
+        if run.get('duration') is not None:
+            durations.setdefault('total', []).append(run['duration'])
+            errors['total'] = errors.get('total', 0) + (run.get('outcome') != 'success')
+
+    summary = {}
+    for phase, values in durations.items():
+        values.sort()
+        summary[phase] = {
+            'count': len(values),
+            'errors': errors[phase],
+            'p50': percentile(values, 50),
+            'p90': percentile(values, 90),
+            'p99': percentile(values, 99),
+            'max': values[-1],
+        }
+    return summary
+
+
+def main():
+    """Print phase-duration percentiles across saved runs"""
+    parser = argparse.ArgumentParser(description="Summarize renewal phase timings")
+    commands = parser.add_subparsers(dest='command', required=True)
+    report = commands.add_parser('report', help="phase-duration percentiles across saved runs")
+    report.add_argument('--dir', default=str(Path(__file__).parent.absolute() / "logs" / "timings"),
+                        help="directory holding run_*.json (default: %(default)s)")
+    report.add_argument('--last', type=int, help="only the last N runs")
+    report.add_argument('--json', action='store_true', help="print the summary as JSON")
+    args = parser.parse_args()
+
+    runs = load_runs(args.dir, args.last)
+    if not runs:
+        print(f"Error: no runs found in {args.dir}", file=sys.stderr)
+        sys.exit(1)
+
+    summary = summarize(runs)
+    if args.json:
+        print(json.dumps(summary, indent=4))
+        return
+
+    print(f"{len(runs)} runs, {runs[0]['started']} to {runs[-1]['started']}")
+    print(f"{'phase':<22} {'count':>6} {'errors':>6} {'p50':>9} {'p90':>9} {'p99':>9} {'max':>9}")
+    for phase, stats in sorted(summary.items(), key=lambda item: item[0] == 'total'):
+        print(f"{phase:<22} {stats['count']:>6} {stats['errors']:>6} "
+              + ' '.join(f"{stats[key]:>8.2f}s" for key in ('p50', 'p90', 'p99', 'max')))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,308 @@
+#!/usr/bin/env python3
+"""
+Renewal Pipeline
+
+Shared by renew_cert.py and manual_renew.py: configuration loading, logging,
+directory setup, PFX conversion and the per-certificate stage pipeline.
+
+Each certificate is renewed as a list of stages (run_certbot,
+convert_to_pfx, then deploy when "deploy" targets are configured). After
+every stage a checkpoint with a hash of the stage's inputs and outputs is
+written to certs/checkpoints/<name>.json. When a run stops part-way, the
+next run resumes: stages that completed with the same inputs, and whose
+outputs are still in place, are skipped, so a retry after a failed PFX
+conversion or deploy does not order the certificate again. Stages marked as
+cached are also skipped in later runs while their inputs are unchanged.
+
+Usage: python3 renew_pipeline.py [certs/checkpoints/NAME.json ...]   (print checkpoints)
+"""
+
+import abc
+import sys
+import json
+import hashlib
+import logging
+import subprocess
+from pathlib import Path
+from datetime import datetime
+
+from pfx_export import atomic_write, export_pfx, input_hash
+from pfx_deploy import deploy_pfx, targets_for
+from renew_metrics import PhaseTimer
+
+
+def file_digest(*paths):
+    """Return a hash of the contents of paths; missing files hash differently from empty ones"""
+    digest = hashlib.sha256()
+    for path in paths:
+        try:
+            data = Path(path).read_bytes()
+        except FileNotFoundError:
+            digest.update(b'missing')
+            continue
+        digest.update(len(data).to_bytes(8, 'big'))
+        digest.update(data)
+    return digest.hexdigest()
+
+
+def value_digest(value):
+    """Return a hash of a JSON-serializable value"""
+    return hashlib.sha256(json.dumps(value, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class Stage:
+    """One step of a certificate's pipeline
+
+    inputs and outputs are callables returning JSON-serializable values that
+    are hashed into the checkpoint; outputs is evaluated after the stage ran
+    and again before it is skipped, so a deleted or replaced output reruns it.
+    A cached stage is skipped whenever its inputs are unchanged, not only
+    when resuming an unfinished run.
+    """
+
+    def __init__(self, name, run, inputs, outputs=None, cache=False):
+        self.name = name
+        self.run = run
+        self.inputs = inputs
+        self.outputs = outputs or (lambda: None)
+        self.cache = cache
+
+
+class Pipeline:
+    """Run stages in order, checkpointing each one to a JSON file"""
+
+    def __init__(self, checkpoint_file, logger, timer=None, domain=None):
+        self.checkpoint_file = Path(checkpoint_file)
+        self.logger = logger
+        self.timer = timer
+        self.domain = domain
+
+    def load(self):
+        try:
+            with open(self.checkpoint_file, 'r') as f:
+                return json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return {}
+
+    def save(self, checkpoint):
+        self.checkpoint_file.parent.mkdir(parents=True, exist_ok=True)
+        # Private like the keys whose hashes it holds
+        atomic_write(self.checkpoint_file, (json.dumps(checkpoint, indent=4) + '\n').encode(), mode=0o600)
+
+    def incomplete(self):
+        """Return the first stage still to run if the last run stopped part-way, else None"""
+        checkpoint = self.load()
+        if checkpoint and not checkpoint.get('finished', True):
+            return checkpoint.get('next_stage')
+        return None
+
+    def run(self, stages):
+        checkpoint = self.load()
+        resuming = bool(checkpoint) and not checkpoint.get('finished', True)
+        completed = checkpoint.setdefault('stages', {})
+
+        for index, stage in enumerate(stages):
+            inputs = value_digest(stage.inputs())
+            saved = completed.get(stage.name, {})
+            if ((resuming or stage.cache) and saved.get('inputs') == inputs
+                    and saved.get('outputs') == value_digest(stage.outputs())):
+                self.logger.info(f"Skipping {stage.name}: completed {saved['completed']} with the same inputs")
+                if self.timer:
+                    self.timer.add(stage.name, 0.0, 'skipped', self.domain)
+                continue
+
+            checkpoint['finished'] = False
+            checkpoint['next_stage'] = stage.name
+            if self.timer:
+                with self.timer.span(stage.name, self.domain):
+                    stage.run()
+            else:
+                stage.run()
+
+            completed[stage.name] = {
+                'inputs': inputs,
+                'outputs': value_digest(stage.outputs()),
+                'completed': datetime.now().isoformat(timespec='seconds'),
+            }
+            if index + 1 < len(stages):
+                # Written before the next stage starts, so a failure there resumes from it
+                checkpoint['next_stage'] = stages[index + 1].name
+                self.save(checkpoint)
+
+        checkpoint['finished'] = True
+        checkpoint.pop('next_stage', None)
+        self.save(checkpoint)
+
+
+class CertRenewerBase(abc.ABC):
+    """Configuration, logging, directories, PFX conversion and stages shared by both renewers
+
+    Subclasses provide _directories(), _live_dir(name) and _pfx_path(name).
+    """
+
+    # Log files are named <log_prefix>_<timestamp>.log
+    log_prefix = "renewal"
+    # Prepended to checkpoint file names, so both renewers can track the same domain
+    checkpoint_prefix = ""
+
+    def __init__(self):
+        self.script_dir = Path(__file__).parent.absolute()
+        self.config_file = self.script_dir / "config" / "settings.json"
+        self.checkpoint_dir = self.script_dir / "certs" / "checkpoints"
+
+        # Setup logging
+        self.log_dir = self.script_dir / "logs"
+        self.log_dir.mkdir(exist_ok=True)
+        self.run_stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        log_file = self.log_dir / f"{self.log_prefix}_{self.run_stamp}.log"
+
+        logging.basicConfig(
+            level=logging.INFO,
+            format='%(asctime)s - %(levelname)s - %(message)s',
+            handlers=[
+                logging.FileHandler(log_file),
+                logging.StreamHandler(sys.stdout)
+            ]
+        )
+        self.logger = logging.getLogger(type(self).__module__)
+        self.timer = PhaseTimer(self.run_stamp)
+
+        # Load configuration
+        self.config = self._load_config()
+
+    def _load_config(self):
+        """Load configuration from settings.json"""
+        try:
+            with open(self.config_file, 'r') as f:
+                config = json.load(f)
+            self.logger.info(f"Configuration loaded from {self.config_file}")
+            return config
+        except FileNotFoundError:
+            self.logger.error(f"Configuration file not found: {self.config_file}")
+            sys.exit(1)
+        except json.JSONDecodeError as e:
+            self.logger.error(f"Invalid JSON in configuration file: {e}")
+            sys.exit(1)
+
+    @abc.abstractmethod
+    def _directories(self):
+        """Return the directories Certbot needs"""
+
+    @abc.abstractmethod
+    def _live_dir(self, name):
+        """Return the Certbot live directory of a certificate"""
+
+    @abc.abstractmethod
+    def _pfx_path(self, name):
+        """Return the PFX file a certificate is converted to"""
+
+    def _create_directories(self):
+        """Create necessary directories for Certbot"""
+        for directory in self._directories():
+            directory.mkdir(parents=True, exist_ok=True)
+            self.logger.info(f"Created directory: {directory}")
+
+    def _convert_to_pfx(self, name, logger=None):
+        """Convert certificate to PFX format"""
+        logger = logger or self.logger
+        cert_live_dir = self._live_dir(name)
+        pfx_output = self._pfx_path(name)
+
+        logger.info("Converting certificate to PFX format...")
+        logger.info(f"Looking for certificates in: {cert_live_dir}")
+
+        if not cert_live_dir.exists():
+            logger.error(f"Certificate directory not found: {cert_live_dir}")
+            raise FileNotFoundError("Certificate directory not found")
+
+        # Get PFX password from config or use empty password
+        pfx_password = self.config.get('pfx_password', '')
+        if not pfx_password:
+            logger.info("No PFX password configured - using empty password")
+
+        try:
+            # Built and verified in-process and renamed into place, so Plex never sees a half-written file
+            if export_pfx(cert_live_dir, pfx_output, name, pfx_password):
+                logger.info(f"PFX file created and verified: {pfx_output}")
+            else:
+                logger.info(f"Certificate unchanged - keeping existing PFX file: {pfx_output}")
+
+            return pfx_output
+
+        except (OSError, ValueError, subprocess.CalledProcessError) as e:
+            logger.error(f"PFX conversion failed: {e}")
+            raise
+
+    def _deploy(self, name, logger=None):
+        """Push the PFX of one certificate to its deploy targets concurrently"""
+        logger = logger or self.logger
+        targets = targets_for(self.config, name)
+        workers = int(self.config.get('deploy', {}).get('workers', 16))
+
+        logger.info(f"Deploying {self._pfx_path(name)} to {len(targets)} target(s)...")
+        results = deploy_pfx(self._pfx_path(name), targets, workers, log=logger.info)
+        failed = [target for target, result, _ in results if isinstance(result, Exception)]
+        if failed:
+            raise RuntimeError(f"Deploy failed for: {', '.join(failed)}")
+
+    def _pfx_inputs(self, name):
+        """Return pfx_export's hash of the key, chain, name and password, or None before Certbot ran
+
+        The password only enters mixed with the private key, so the
+        checkpoint cannot be used to guess it.
+        """
+        live_dir = self._live_dir(name)
+        try:
+            key_pem = (live_dir / "privkey.pem").read_bytes()
+            chain_pem = (live_dir / "fullchain.pem").read_bytes()
+        except FileNotFoundError:
+            return None
+        return input_hash(key_pem, chain_pem, name, self.config.get('pfx_password', ''))
+
+    def _pipeline(self, name, logger=None):
+        """Return the checkpointed pipeline of one certificate"""
+        checkpoint_file = self.checkpoint_dir / f"{self.checkpoint_prefix}{name}.json"
+        return Pipeline(checkpoint_file, logger or self.logger, self.timer, name)
+
+    def _certificate_stages(self, group, obtain, logger=None):
+        """Return the stages that obtain one certificate, convert it to PFX and deploy it"""
+        name = group[0]
+        live_dir = self._live_dir(name)
+        key_files = (live_dir / "fullchain.pem", live_dir / "privkey.pem")
+        stages = [
+            Stage('run_certbot', obtain,
+                  inputs=lambda: {'hostnames': group, 'email': self.config.get('email')},
+                  outputs=lambda: file_digest(*key_files)),
+            Stage('convert_to_pfx', lambda: self._convert_to_pfx(name, logger),
+                  inputs=lambda: {'pfx': self._pfx_inputs(name)},
+                  outputs=lambda: file_digest(self._pfx_path(name)),
+                  cache=True),
+        ]
+        if targets_for(self.config, name):
+            # Not cached: every target is checked, and ones already holding this PFX are skipped
+            stages.append(Stage('deploy', lambda: self._deploy(name, logger),
+                                inputs=lambda: {'pfx': file_digest(self._pfx_path(name)),
+                                                'targets': targets_for(self.config, name)}))
+        return stages
+
+
+def main():
+    """Print the state of certificate checkpoints"""
+    paths = sys.argv[1:] or sorted((Path(__file__).parent.absolute() / "certs" / "checkpoints").glob('*.json'))
+    if not paths:
+        print("No checkpoints found", file=sys.stderr)
+        sys.exit(1)
+
+    for path in map(Path, paths):
+        checkpoint = Pipeline(path, None).load()
+        if checkpoint.get('finished', True):
+            status = 'finished'
+        else:
+            status = f"resumes at {checkpoint.get('next_stage')}"
+        print(f"{path.stem}: {status}")
+        for stage, entry in checkpoint.get('stages', {}).items():
+            print(f"  {stage}: completed {entry['completed']}")
+
+
+if __name__ == "__main__":
+    main()
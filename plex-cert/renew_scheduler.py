@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+"""
+Renewal Scheduler
+
+Keeps one renewal process running instead of a cron job. The process holds
+a lock file, so neither a second scheduler nor a one-shot renew_cert.py run
+can use the Certbot directories at the same time. It sleeps until the next
+certificate enters its renewal window, plus a random jitter kept per
+certificate. Failed renewals are retried with exponential backoff.
+
+The last run, outcome, expiry date and next attempt of every certificate are
+kept in certs/renewal_state.json, which one-shot runs update as well.
+
+Usage: python3 renew_cert.py --schedule
+       python3 renew_scheduler.py [certs/renewal_state.json]   (print the saved state)
+"""
+
+import os
+import sys
+import json
+import time
+import fcntl
+import random
+from pathlib import Path
+from datetime import datetime, timedelta, timezone
+
+from pfx_export import atomic_write
+
+
+def retry_delay(failures, initial_minutes=10, max_hours=12):
+    """Return the wait after the given number of consecutive failures, doubling each time, with jitter"""
+    minutes = min(initial_minutes * 2 ** (failures - 1), max_hours * 60)
+    # Up to 20% extra so several certificates that failed together do not retry in lockstep
+    return timedelta(minutes=minutes * random.uniform(1.0, 1.2))
+
+
+def parse_time(value):
+    """Parse an ISO timestamp written by RenewalState, or return None"""
+    return datetime.fromisoformat(value) if value else None
+
+
+class RenewalLock:
+    """Exclusive, non-blocking lock on a file, holding the owner's pid"""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.file = None
+
+    def acquire(self):
+        """Take the lock or raise RuntimeError naming the process that holds it"""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.file = open(self.path, 'a+')
+        try:
+            fcntl.flock(self.file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            self.file.seek(0)
+            owner = self.file.read().strip() or 'unknown'
+            self.file.close()
+            self.file = None
+            raise RuntimeError(f"Another renewal is already running (pid {owner}, lock file {self.path})")
+
+        self.file.seek(0)
+        self.file.truncate()
+        self.file.write(f"{os.getpid()}\n")
+        self.file.flush()
+        return self
+
+    def release(self):
+        if self.file is not None:
+            fcntl.flock(self.file, fcntl.LOCK_UN)
+            self.file.close()
+            self.file = None
+
+    def __enter__(self):
+        return self if self.file is not None else self.acquire()
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+class RenewalState:
+    """Per-certificate renewal history stored as JSON and replaced atomically on every save"""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        try:
+            with open(self.path, 'r') as f:
+                self.data = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            self.data = {}
+        self.data.setdefault('certificates', {})
+
+    def certificate(self, name):
+        """Return the mutable state entry of one certificate"""
+        return self.data['certificates'].setdefault(name, {})
+
+    def set_expiry(self, name, expires, jitter_hours=6):
+        """Store a certificate's expiry, choosing a new window jitter whenever it changes"""
+        entry = self.certificate(name)
+        if expires is None or entry.get('expires') == expires.isoformat():
+            return
+        entry['expires'] = expires.isoformat()
+        entry['jitter_seconds'] = round(random.uniform(0, jitter_hours * 3600))
+
+    def record(self, name, success, now, next_attempt, expires=None, jitter_hours=6):
+        """Record one renewal attempt and when the certificate may be tried again"""
+        entry = self.certificate(name)
+        entry['last_run'] = now.isoformat()
+        entry['last_result'] = 'success' if success else 'failure'
+        if success:
+            entry['last_success'] = now.isoformat()
+            entry['failures'] = 0
+        else:
+            entry['failures'] = entry.get('failures', 0) + 1
+        entry['next_attempt'] = next_attempt.isoformat()
+        self.set_expiry(name, expires, jitter_hours)
+
+    def save(self):
+        self.data['updated'] = datetime.now(timezone.utc).isoformat()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        atomic_write(self.path, (json.dumps(self.data, indent=4) + '\n').encode(), mode=0o644)
+
+
+class RenewalScheduler:
+    """Run a PlexCertRenewer whenever one of its certificates becomes due"""
+
+    def __init__(self, renewer, sleep=time.sleep):
+        self.renewer = renewer
+        self.logger = renewer.logger
+        self.sleep = sleep
+        config = renewer.config
+        self.window = timedelta(days=float(config.get('renew_before_days', 30)))
+        self.jitter_hours = float(config.get('schedule_jitter_hours', 6))
+        # Upper bound on one sleep, so clock changes and manual renewals are noticed
+        self.max_sleep = float(config.get('schedule_max_sleep_hours', 24)) * 3600
+
+    def next_run(self, group, state, now):
+        """Return when a certificate should next be renewed"""
+        name = group[0]
+        state.set_expiry(name, self.renewer._certificate_expiry(name), self.jitter_hours)
+        entry = state.certificate(name)
+        not_before = parse_time(entry.get('next_attempt')) or now
+
+        due, _ = self.renewer._needs_renewal(group)
+        expires = parse_time(entry.get('expires'))
+        if due or expires is None:
+            return max(now, not_before)
+        # Enter the renewal window at a per-certificate offset rather than all at once
+        window_start = expires - self.window + timedelta(seconds=entry.get('jitter_seconds', 0))
+        return max(window_start, not_before)
+
+    def run(self):
+        """Renew due certificates, then sleep until the next one is due; never returns"""
+        self.logger.info("Renewal scheduler started")
+        groups = self.renewer._certificate_groups()
+
+        while True:
+            now = datetime.now(timezone.utc)
+            state = RenewalState(self.renewer.state_file)
+            schedule = {group[0]: self.next_run(group, state, now) for group in groups}
+            due = [group for group in groups if schedule[group[0]] <= now]
+            state.save()
+
+            if due:
+                self.renewer.run_stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+                with self.renewer._timed_run():
+                    self.renewer.renew_due(due)
+                continue
+
+            name, wake = min(schedule.items(), key=lambda item: item[1])
+            wait = min((wake - now).total_seconds(), self.max_sleep)
+            self.logger.info(f"Next renewal: {name} at {wake.isoformat(timespec='seconds')} - "
+                             f"sleeping {timedelta(seconds=round(wait))}")
+            self.sleep(wait)
+
+
+def main():
+    """Print the saved renewal state"""
+    path = Path(sys.argv[1]) if len(sys.argv) > 1 else Path(__file__).parent.absolute() / "certs" / "renewal_state.json"
+    if not path.exists():
+        print(f"Error: state file not found: {path}", file=sys.stderr)
+        sys.exit(1)
+
+    state = RenewalState(path)
+    for name, entry in sorted(state.data['certificates'].items()):
+        print(f"{name}:")
+        for key in ('expires', 'last_run', 'last_result', 'failures', 'next_attempt'):
+            if key in entry:
+                print(f"  {key}: {entry[key]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+Tests for renew_cert with Certbot replaced by a stub that writes a new certificate (or nothing)
+Usage: python3 -m pytest plex-cert/test_renew_cert.py   (or python3 -m unittest test_renew_cert)
+"""
+
+import logging
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+from datetime import datetime, timedelta, timezone
+
+from pfx_export import x509
+from renew_cert import PlexCertRenewer
+from renew_metrics import PhaseTimer
+from renew_scheduler import RenewalState, parse_time
+
+if x509 is not None:
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import ec
+    from cryptography.x509.oid import NameOID
+
+
+def write_certificate(live_dir, hostname, days_left):
+    """Write a self-signed fullchain.pem and privkey.pem for hostname expiring in days_left days"""
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, hostname)])
+    now = datetime.now(timezone.utc)
+    certificate = (x509.CertificateBuilder()
+                   .subject_name(name).issuer_name(name)
+                   .public_key(key.public_key())
+                   .serial_number(x509.random_serial_number())
+                   .not_valid_before(now - timedelta(days=1))
+                   .not_valid_after(now + timedelta(days=days_left))
+                   .add_extension(x509.SubjectAlternativeName([x509.DNSName(hostname)]), critical=False)
+                   .sign(key, hashes.SHA256()))
+    live_dir.mkdir(parents=True, exist_ok=True)
+    (live_dir / "fullchain.pem").write_bytes(certificate.public_bytes(serialization.Encoding.PEM))
+    (live_dir / "privkey.pem").write_bytes(key.private_bytes(serialization.Encoding.PEM,
+                                                             serialization.PrivateFormat.PKCS8,
+                                                             serialization.NoEncryption()))
+
+
+@unittest.skipIf(x509 is None, "needs the cryptography package to create test certificates")
+class RunCertbotTest(unittest.TestCase):
+
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.base = Path(temp_dir.name)
+
+        # Built without __init__, which reads the real settings.json and logs to the script directory
+        self.renewer = PlexCertRenewer.__new__(PlexCertRenewer)
+        self.renewer.script_dir = self.base
+        self.renewer.log_dir = self.base / "logs"
+        self.renewer.log_dir.mkdir()
+        self.renewer.run_stamp = 'test'
+        self.renewer.state_file = self.base / "certs" / "renewal_state.json"
+        self.renewer.checkpoint_dir = self.base / "certs" / "checkpoints"
+        self.renewer.azure_credentials = self.base / "secrets" / "azure.ini"
+        self.renewer.venv_path = self.base / "venv"
+        self.renewer.logger = logging.getLogger(__name__)
+        self.renewer.timer = PhaseTimer('test')
+        self.renewer.config = {'domain': 'plex.example.com', 'email': 'admin@example.com'}
+        self.live_dir = self.renewer._live_dir('plex.example.com')
+        self.commands = []
+
+    def certbot(self, cmd, **kwargs):
+        """Record the command and issue a certificate valid for 90 days, as Certbot would"""
+        self.commands.append(cmd)
+        write_certificate(self.live_dir, 'plex.example.com', 90)
+
+    def run_certbot(self):
+        with mock.patch('renew_cert.subprocess.run', side_effect=self.certbot):
+            self.renewer._run_certbot(['plex.example.com'], self.renewer.logger, self.base / "certbot.log")
+        self.assertEqual(len(self.commands), 1)
+        return self.commands[0]
+
+    def test_forced_renewal_passes_force_renewal(self):
+        write_certificate(self.live_dir, 'plex.example.com', 80)
+        due, _ = self.renewer._needs_renewal(['plex.example.com'])
+        self.assertFalse(due)
+
+        # renew_certificate(force=True) renews groups that are not due
+        self.assertIn('--force-renewal', self.run_certbot())
+
+    def test_window_wider_than_certbots_passes_force_renewal(self):
+        self.renewer.config['renew_before_days'] = 45
+        self.renewer.config['propagation_check'] = False
+        write_certificate(self.live_dir, 'plex.example.com', 40)
+        due, reason = self.renewer._needs_renewal(['plex.example.com'])
+        self.assertTrue(due, reason)
+
+        cmd = self.run_certbot()
+        self.assertEqual(cmd[:2], [str(self.base / "venv" / "bin" / "certbot"), 'certonly'])
+        self.assertIn('--force-renewal', cmd)
+
+    def test_certbot_no_op_is_recorded_as_a_failure(self):
+        write_certificate(self.live_dir, 'plex.example.com', 20)
+        previous = (self.live_dir / "fullchain.pem").read_bytes()
+
+        # Certbot deciding the certificate is not due yet: exit 0 and leave the lineage alone
+        with mock.patch('renew_cert.subprocess.run', side_effect=lambda cmd, **kwargs: self.commands.append(cmd)):
+            results = [self.renewer._renew_group(['plex.example.com'])]
+        self.assertEqual(results, [None])
+        self.assertEqual((self.live_dir / "fullchain.pem").read_bytes(), previous)
+
+        started = datetime.now(timezone.utc)
+        self.renewer._record_results([['plex.example.com']], results)
+        entry = RenewalState(self.renewer.state_file).certificate('plex.example.com')
+        self.assertEqual(entry['last_result'], 'failure')
+        self.assertEqual(entry['failures'], 1)
+        # The retry backoff (10 minutes after the first failure), not the 12-hour success interval
+        self.assertLess(parse_time(entry['next_attempt']) - started, timedelta(hours=1))
+
+    def test_new_certificate_is_recorded_as_a_success(self):
+        write_certificate(self.live_dir, 'plex.example.com', 20)
+        with mock.patch('renew_cert.subprocess.run', side_effect=self.certbot):
+            results = [self.renewer._renew_group(['plex.example.com'])]
+        self.assertEqual(results, [self.base / "certs" / "plex.example.com.pfx"])
+
+        self.renewer._record_results([['plex.example.com']], results)
+        entry = RenewalState(self.renewer.state_file).certificate('plex.example.com')
+        self.assertEqual(entry['last_result'], 'success')
+        self.assertEqual(entry['failures'], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()